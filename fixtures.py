@@ -0,0 +1,114 @@
+"""Factories shared by the tests, for building matches, events and Elo
+models without fetching anything from TBA."""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from frc import FRC
+from predict.elo import FRCElo
+from util.event import Event, EventData
+from util.poll_scheduler import PollScheduler
+from util.tba_wrapper import BlueAllianceWrapper
+import requests
+import time
+
+EVENT_CODE = '2017test'
+
+ELO_PARAMS = {'qm_K': 20, 'fm_K': 5, 'new_team_rating': 1350, 'init_stdev': 50}
+
+
+def make_elo(ratings=None):
+    """ An FRCElo model, with the teams in ratings (team number -> rating)
+    already seen. """
+    elo = FRCElo(**ELO_PARAMS)
+    for team, rating in (ratings or {}).items():
+        elo.init_team('frc%s' % team, rating)
+    return elo
+
+
+def make_match(blue, red, blue_score=-1, red_score=-1, match_number=None,
+               event_code=EVENT_CODE, comp_level='qm', set_number=1, surrogates=()):
+    """ A match in TBA's format between the blue and red team numbers. A
+    score of -1 means it hasn't been played, and it only has a key if it
+    has a match_number. """
+    def alliance(teams, score):
+        return {'team_keys': ['frc%s' % team for team in teams], 'score': score,
+                'surrogate_team_keys': ['frc%s' % team for team in surrogates
+                                        if team in teams]}
+    match = {'comp_level': comp_level, 'set_number': set_number,
+             'alliances': {'blue': alliance(blue, blue_score), 'red': alliance(red, red_score)}}
+    if match_number is not None:
+        if comp_level == 'qm':
+            key = '%s_qm%s' % (event_code, match_number)
+        else:
+            key = '%s_%s%sm%s' % (event_code, comp_level, set_number, match_number)
+        match.update({'key': key, 'match_number': match_number, 'event_key': event_code,
+                      'time': None, 'predicted_time': None})
+    return match
+
+
+def make_event_response(name='Test Regional'):
+    """ TBA's response for an event that's in progress. """
+    today = datetime.utcnow()
+    return {'name': name, 'timezone': None, 'playoff_type': 0,
+            'start_date': (today - timedelta(1)).strftime('%Y-%m-%d'),
+            'end_date': (today + timedelta(1)).strftime('%Y-%m-%d')}
+
+
+class LocalTBA:
+    """Stands in for BlueAllianceWrapper, serving each event's matches from
+    event_matches instead of fetching them from TBA. The events in slow
+    take a while to fetch, and those in fail can't be fetched at all."""
+    sort_by_match_number = staticmethod(BlueAllianceWrapper.sort_by_match_number)
+    webhook_match = staticmethod(BlueAllianceWrapper.webhook_match)
+
+    def __init__(self, event_matches=None, fail=(), slow=()):
+        self.event_matches = event_matches or {}
+        self.fail = set(fail)
+        self.slow = set(slow)
+        # number of has_match_been_played calls
+        self.played_checks = 0
+        # events whose cached responses have been expired
+        self.expired = []
+
+    def has_match_been_played(self, match):
+        self.played_checks += 1
+        return BlueAllianceWrapper.has_match_been_played(match)
+
+    def get_raw_event(self, event_code, return_changed=False, priority=None):
+        if event_code in self.fail:
+            raise requests.ConnectionError('no response')
+        if event_code in self.slow:
+            time.sleep(0.2)
+        return make_event_response(), True
+
+    def get_event_matches(self, event_code, return_changed=False, priority=None):
+        return self.event_matches[event_code], True
+
+    def fetch_alliance_data(self, event_code):
+        return None
+
+    def is_cached(self, event_code):
+        return True
+
+    def expire_event(self, event_code):
+        self.expired.append(event_code)
+
+
+def make_event(matches, elo=None, tba=None):
+    """ An event in progress, processed from matches. """
+    event = Event(EVENT_CODE, elo or make_elo(), tba or LocalTBA(), refresh=False)
+    event.process_event_data(EventData(make_event_response(), True, matches, True, None))
+    return event
+
+
+def make_frc(tba):
+    """ An FRC whose events, the keys of tba.event_matches, are yet to be
+    fetched. """
+    frc = FRC(2017, 'test')
+    frc.tba_wrapper = tba
+    frc.fetch_executor = ThreadPoolExecutor(max_workers=FRC.MAX_FETCH_WORKERS)
+    frc.elo = make_elo()
+    frc.events = OrderedDict((event_code, Event(event_code, frc.elo, tba, refresh=False))
+                             for event_code in tba.event_matches)
+    frc.scheduler = PollScheduler()
+    return frc
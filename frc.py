@@ -1,7 +1,14 @@
 from predict.elo import FRCElo
+from predict.elo_replay import EloReplay
+from predict.elo_checkpoints import EloCheckpoints
 from util.tba_wrapper import BlueAllianceWrapper
 from util.event import Event
+from util.poll_scheduler import PollScheduler
+from util.live_updates import LiveUpdates
+from util.snapshots import SnapshotBuilder
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
 import threading
 import time
 
@@ -10,9 +17,30 @@ class FRC(threading.Thread):
 
     """Class to tie the rest of the event-getting and predicting stuff together
     to separate it from the flask stuff. """
+
+    # maximum number of events fetched from TBA at once
+    MAX_FETCH_WORKERS = 8
+    # longest the polling loop sleeps for, even if nothing is due
+    MAX_SLEEP = 60*60
+
     def __init__(self, current_year, thread_name):
         self.current_year = current_year
         self.current_year_str = str(current_year)
+        # held while updating events or the ratings, which are shared between
+        # the polling loop and the webhook handler
+        self.update_lock = threading.Lock()
+        # set to wake the polling loop early, eg when a webhook makes an
+        # event due
+        self.wake = threading.Event()
+        # pushes changes to events' predictions to browsers watching them
+        self.live_updates = LiveUpdates()
+        # the util.snapshots.Snapshot web requests read, replaced (never
+        # changed) whenever events or ratings change
+        self.snapshot = None
+        self.snapshot_builder = SnapshotBuilder()
+        # a util.snapshots.SnapshotWriter, when web pages are served by
+        # other processes
+        self.snapshot_writer = None
         super().__init__(name=thread_name)
 
     def setup(self):
@@ -21,41 +49,204 @@ class FRC(threading.Thread):
         with open('tba/key.txt', 'r') as keyfile:
             self.tba_key = keyfile.readline().rstrip('\n')
 
-        self.tba_wrapper = BlueAllianceWrapper(self.tba_key)
+        # one pooled connection per fetch worker
+        self.tba_wrapper = BlueAllianceWrapper(self.tba_key, pool_size=self.MAX_FETCH_WORKERS)
+        self.fetch_executor = ThreadPoolExecutor(max_workers=self.MAX_FETCH_WORKERS)
 
-        self.elo = FRCElo(qm_K=20, fm_K=5, new_team_rating=1350, init_stdev=50)
+        self.elo_params = {'qm_K': 20, 'fm_K': 5, 'new_team_rating': 1350,
+                           'init_stdev': 50}
+        # arguments to FRCElo.next_year between seasons
+        self.reversion_params = {'reversion_score': 1500, 'reversion_factor': 0.2,
+                                 'new_stdev': 50}
+        self.elo = FRCElo(**self.elo_params)
+        self.elo_replay = EloReplay(self.elo)
+        self.elo_checkpoints = EloCheckpoints()
         self.process_previous_years()
 
         ev_dicts = self.tba_wrapper.get_year_events(self.current_year)
         self.events = OrderedDict()
         for ev_dict in ev_dicts:
             event_code = self.current_year_str+ev_dict['event_code']
-            self.events[event_code] = Event(event_code, self.elo, self.tba_wrapper)
+            self.events[event_code] = Event(event_code, self.elo, self.tba_wrapper,
+                                            refresh=False)
+        self.refresh_events(list(self.events.values()))
+        self.publish_snapshot()
+
+        self.scheduler = PollScheduler()
+        for event in self.events.values():
+            self.scheduler.schedule(event)
 
     def process_previous_years(self):
-        for year in range(2008, self.current_year):
-            print("Getting year matches %s" % year)
-            year_events = self.tba_wrapper.get_year_matches(str(year))
-            print("Got year matches %s" % year)
-
-            print("Running ELO for year %s" % year)
-            # year events is an OrderedDict in chronological order, with event
-            # codes as keys
-            self.process_year_matches(year_events)
-            self.elo.next_year(1500, 0.2, 50)
-
-    def process_year_matches(self, year_events):
-        for event_code, event in year_events.items():
-            for match in event:
-                self.elo.update(match)
+        years = list(range(2008, self.current_year))
+        fingerprints = [self.tba_wrapper.get_year_matches_fingerprint(year)
+                        for year in years]
+        params = dict(self.elo_params, **self.reversion_params)
+        keys = EloCheckpoints.season_keys(params, years, fingerprints)
+
+        # pick up from the newest season whose checkpoint is still valid
+        num_restored = self.elo_checkpoints.restore(self.elo, years, keys)
+        if num_restored:
+            print("Restored ratings up to the end of %s" % years[num_restored-1])
+
+        for year, key in zip(years[num_restored:], keys[num_restored:]):
+            archive = self.tba_wrapper.get_year_archive(year)
+            if archive is not None:
+                print("Running ELO for year %s from the match archive" % year)
+                self.elo_replay.replay(EloReplay.season_from_archive(archive))
+            else:
+                print("Running ELO for year %s" % year)
+                # replayed as the events are read, so the season is never
+                # all in memory at once
+                self.elo_replay.replay_events(self.tba_wrapper.iter_year_matches(year))
+            self.elo.next_year(**self.reversion_params)
+            self.elo_checkpoints.save(year, key, self.elo)
+
+    def refresh_events(self, events):
+        """ Refresh events, fetching their data from TBA concurrently.
+        Only the fetching is concurrent: the fetched data is processed one
+        event at a time, in the order given, so the Elo ratings are updated
+        in the same order as if each event had been refreshed in turn.
+        Returns:
+            A dict of timings for the refresh.
+        """
+        start = time.monotonic()
+        futures = [self.fetch_executor.submit(event.fetch_event_data) for event in events]
+        fetch_time = 0.0
+        process_time = 0.0
+        num_refreshed = 0
+        for event, future in zip(events, futures):
+            wait_start = time.monotonic()
+            try:
+                event_data = future.result()
+            except requests.RequestException as e:
+                # leave the event as it was, it'll be tried again after
+                # backing off (see PollScheduler.poll_interval)
+                print("Failed to fetch %s: %s" % (event.event_code, e))
+                with self.update_lock:
+                    event.fetch_failures += 1
+                continue
+            finally:
+                fetch_time += time.monotonic()-wait_start
+            process_start = time.monotonic()
+            with self.update_lock:
+                event.process_event_data(event_data)
+            self.live_updates.publish(event.event_code, event.event_dict)
+            process_time += time.monotonic()-process_start
+            num_refreshed += 1
+        return {'events': num_refreshed, 'failed': len(events)-num_refreshed,
+                'total': time.monotonic()-start, 'fetch_wait': fetch_time,
+                'process': process_time}
 
     def run(self):
         while True:
-            start = time.monotonic()
-            for event in self.events.values():
-                if event.to_update:
-                    event.update_event_status()
-            to_wait = 180-(time.monotonic()-start)
+            with self.update_lock:
+                due = set(self.scheduler.pop_due())
+            # refresh in the same order as setup, so ratings are updated in
+            # event order
+            events = [event for event in self.events.values() if event.event_code in due]
+            if events:
+                timings = self.refresh_events(events)
+                with self.update_lock:
+                    for event in events:
+                        self.scheduler.schedule(event)
+                self.publish_snapshot()
+                print("%s refreshed %s events (%s failed) in %.2fs, %.2fs waiting on TBA, "
+                      "%.2fs processing" % (self.name, timings['events'], timings['failed'],
+                                            timings['total'], timings['fetch_wait'],
+                                            timings['process']))
+                intervals = ["%s %ss" % (event.event_code,
+                                         self.scheduler.poll_intervals[event.event_code])
+                             for event in events]
+                print("%s poll intervals: %s, queue depth: %s"
+                      % (self.name, ", ".join(intervals), self.scheduler.queue_depth))
+                cache_stats = self.elo.prediction_cache.stats()
+                print("%s prediction cache: %s entries, %s hits, %s misses, %s invalidated, "
+                      "%s evicted" % (self.name, cache_stats['size'], cache_stats['hits'],
+                                      cache_stats['misses'], cache_stats['invalidations'],
+                                      cache_stats['evictions']))
+                store_stats = self.tba_wrapper.data_store.stats()['matches']
+                print("%s data store: %s of %s years loaded (%.1fMB), %s loads in %.2fs, "
+                      "%s evicted" % (self.name, len(store_stats['resident']),
+                                      store_stats['years'],
+                                      store_stats['resident_bytes'] / 2**20,
+                                      store_stats['loads'], store_stats['load_time'],
+                                      store_stats['evictions']))
+                stats = self.tba_wrapper.request_stats.summary()
+                print("%s TBA requests: %s, connections opened: %s, mean latency: %s, p95: %s"
+                      % (self.name, stats['requests'], self.tba_wrapper.num_connections(),
+                         stats['mean'], stats['p95']))
+                queue_stats = self.tba_wrapper.scheduler.stats()
+                print("%s TBA request queue: %s" % (self.name, ", ".join(
+                    "%s %s sent, %s shared, p95 wait %s" % (
+                        name, priority_stats['requests'], priority_stats['deduplicated'],
+                        priority_stats['p95_wait'])
+                    for name, priority_stats in queue_stats.items())))
+
+            with self.update_lock:
+                next_due = self.scheduler.next_due()
+            to_wait = (self.MAX_SLEEP if next_due is None
+                       else min(self.MAX_SLEEP, next_due-time.time()))
             if to_wait > 0:
-                print("%s sleeping for %s seconds" % (self.name, to_wait))
-                time.sleep(to_wait)
+                self.wake.wait(to_wait)
+            self.wake.clear()
+
+    def handle_webhook(self, message_type, message_data):
+        """ Apply a message pushed by a TBA webhook.
+        match_score messages are applied straight to their event. The others
+        don't include the new schedule or alliances, so just make the event
+        due to be polled.
+        Returns:
+            False if the message wasn't for one of our events or isn't a type
+            we handle.
+        """
+        event_code = message_data.get('event_key')
+        if event_code is None and 'match' in message_data:
+            event_code = message_data['match'].get('event_key')
+        event = self.events.get(event_code)
+        if event is None:
+            return False
+
+        with self.update_lock:
+            if message_type == 'match_score':
+                match = self.tba_wrapper.webhook_match(message_data['match'])
+                if event.apply_match(match):
+                    self.scheduler.record_push(event_code)
+                else:
+                    self.tba_wrapper.expire_event(event_code)
+                    self.scheduler.poll_now(event_code)
+            elif message_type in ['schedule_updated', 'alliance_selection']:
+                if message_type == 'alliance_selection':
+                    event.alliance_data = None
+                # so the poll fetches the change rather than reusing what
+                # TBA sent before it
+                self.tba_wrapper.expire_event(event_code)
+                self.scheduler.record_push(event_code)
+                self.scheduler.poll_now(event_code)
+            else:
+                return False
+        if event.event_dict is not None:
+            self.live_updates.publish(event_code, event.event_dict)
+        self.publish_snapshot()
+        self.wake.set()
+        return True
+
+    def publish_snapshot(self):
+        """ Replace self.snapshot with one of the current events and ratings,
+        and write it to self.snapshot_writer, if there is one. Events that
+        haven't been fetched yet are left out until they have been. """
+        with self.update_lock:
+            snapshot = self.snapshot_builder.build(
+                OrderedDict((event_code, event.event_dict)
+                            for event_code, event in self.events.items()
+                            if event.event_dict is not None),
+                self.elo.elo)
+            # one assignment, so requests see either the old snapshot or the
+            # new one, and the old one is freed once they're done with it
+            self.snapshot = snapshot
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.write(snapshot)
+
+    def current_snapshot(self):
+        """ The latest Snapshot, or None before setup has finished. Safe to
+        call from any thread without the update lock. """
+        return self.snapshot
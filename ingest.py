@@ -0,0 +1,29 @@
+"""The ingestion process: polls TBA, keeps the predictions up to date and
+publishes snapshots of them to cache/snapshots for the web workers in
+web_worker.py to serve. Also receives TBA's webhooks (on port 5002) and
+streams live updates to event pages (on port 5001).
+
+Run with `python ingest.py`, alongside any number of web workers, eg
+`gunicorn --workers 8 web_worker:app`."""
+
+from frc import FRC
+from util.live_updates import LiveUpdateServer
+from util.snapshots import SnapshotWriter
+from web import create_app, load_webhook_secret
+from werkzeug.serving import run_simple
+
+SNAPSHOT_DIRECTORY = 'cache/snapshots'
+WEBHOOK_PORT = 5002
+
+if __name__ == '__main__':
+    frc = FRC(2017, 'backend-thread')
+    frc.snapshot_writer = SnapshotWriter(SNAPSHOT_DIRECTORY)
+    frc.setup()
+    frc.start()
+
+    live_update_server = LiveUpdateServer(frc.live_updates, port=5001)
+    live_update_server.start()
+
+    # only webhooks are sent here, pages are served by the web workers
+    app = create_app(frc, load_webhook_secret())
+    run_simple('0.0.0.0', WEBHOOK_PORT, app, threaded=True)
@@ -1,8 +1,8 @@
-from flask import Flask, request
-from flask import render_template
 from frc import FRC
-
-app = Flask(__name__)
+from util.live_updates import LiveUpdateServer
+from util.sqlite_store import SQLiteDataStore
+from web import create_app, load_webhook_secret
+import os
 
 # the following abomination is just for developing the webpages themselves.
 # feel free to turn off your linter
@@ -60,34 +60,19 @@ frc = FRC(2017, 'backend-thread')
 frc.setup()
 frc.start()
 
+# shared secret set when registering the webhook with TBA, used to check
+# that webhook messages really come from TBA
+webhook_secret = load_webhook_secret()
 
-@app.route('/')
-def index():
-    events = []
-    past_events = []
-    for event in frc.events.values():
-        if event.event_dict['upcoming_matches']:
-            events.append(event.event_dict)
-        else:
-            past_events.append(event.event_dict)
-    return render_template('index.html', events=events, past_events=past_events)
-
-
-@app.route('/event/<string:event_code>')
-def event(event_code):
-    event = frc.events[event_code].event_dict
-    return render_template('event.html', event=event)
-
-
-@app.route('/team/<int:team>')
-def team(team):
-    # TODO: actually make team page
-    return str(team)
+# streams prediction updates to event pages, on its own port as it holds a
+# connection open to every viewer
+live_update_server = LiveUpdateServer(frc.live_updates, port=5001)
+live_update_server.start()
 
+# index of every team's matches, built with `python -m util.sqlite_store`
+match_store = None
+if os.path.exists('cache/' + SQLiteDataStore.DATABASE_FILE):
+    match_store = SQLiteDataStore('cache/' + SQLiteDataStore.DATABASE_FILE)
 
-@app.route('/tba-webhook', methods=['POST'])
-def tba_webhook():
-    msg_data = request.json['message_data']
-    msg_type = request.json['message_type']
-    if msg_type == 'verification':
-        print('TBA verification key: %s' % msg_data)
+app = create_app(frc, webhook_secret, live_updates_port=live_update_server.port,
+                 match_store=match_store)
@@ -1,7 +1,10 @@
 import statistics
+import numpy as np
 from collections import deque
+from itertools import chain
 from scipy.stats import norm
 from collections import namedtuple
+from predict.prediction_cache import PredictionCache
 
 Match = namedtuple('Match', ['blue_teams', 'red_teams', 'blue_score', 'red_score',
                              'comp_level'])
@@ -32,6 +35,13 @@ class FRCElo(object):
         # used so we only calculate stdev every so often not every update
         # helps reduce CPU load
         self.stdev_i = 0
+        # Dict where key, value is "team_no", number of times the team's
+        # rating has changed
+        self.rating_versions = {}
+        # changed when every rating changes at once (eg between years)
+        self.rating_epoch = 0
+        # blue win probabilities, valid while the teams' versions are unchanged
+        self.prediction_cache = PredictionCache()
 
     def predict(self, raw_match=None, teams=None):
         if not teams:
@@ -41,20 +51,19 @@ class FRCElo(object):
             match = Match(blue_teams=teams['blue'], red_teams=teams['red'],
                           blue_score=None, red_score=None, comp_level=None)
 
-        try:
-            blue_elo = sum([self.elo[team] for team in match.blue_teams])
-            red_elo = sum([self.elo[team] for team in match.red_teams])
-        except KeyError:
-            for team in match.blue_teams + match.red_teams:
-                if team not in self.elo.keys():
-                    self.init_team(team)
+        for team in match.blue_teams + match.red_teams:
+            if team not in self.elo:
+                self.init_team(team)
 
+        key = PredictionCache.key(match.blue_teams, match.red_teams)
+        versions = self.versions(key[0] + key[1])
+        blue_win_prob = self.prediction_cache.get(key, versions)
+        if blue_win_prob is None:
             blue_elo = sum([self.elo[team] for team in match.blue_teams])
             red_elo = sum([self.elo[team] for team in match.red_teams])
-
-        elo_diff = float(blue_elo - red_elo)
-
-        blue_win_prob = self.diff_to_prob(elo_diff)
+            elo_diff = float(blue_elo - red_elo)
+            blue_win_prob = self.diff_to_prob(elo_diff)
+            self.prediction_cache.put(key, versions, blue_win_prob)
 
         return blue_win_prob
 
@@ -69,6 +78,89 @@ class FRCElo(object):
         expected_blue_margin = norm.ppf(blue_win_prior, loc=0, scale=self.stdev)
         return expected_blue_margin
 
+    def predict_many(self, raw_matches=None, teams=None):
+        """Vectorised version of predict for a whole list of matches.
+        :param raw_matches: List of TBA match dicts.
+        :param teams: Alternatively, a list of dicts with 'blue' and 'red'
+        lists of team keys, like the teams argument of predict.
+        :return: Array of blue win probabilities, one per match.
+        """
+        if teams is None:
+            teams = self.match_teams(raw_matches)
+        blue_win_probs = np.empty(len(teams))
+        misses = []
+        for i, match_teams in enumerate(teams):
+            for team in match_teams['blue'] + match_teams['red']:
+                if team not in self.elo:
+                    self.init_team(team)
+            key = PredictionCache.key(match_teams['blue'], match_teams['red'])
+            versions = self.versions(key[0] + key[1])
+            blue_win_prob = self.prediction_cache.get(key, versions)
+            if blue_win_prob is None:
+                misses.append((i, key, versions))
+            else:
+                blue_win_probs[i] = blue_win_prob
+        if misses:
+            # price everything not in the cache in one pass
+            miss_probs = self.diff_to_prob(self.elo_diffs(teams=[teams[i] for i, _, _ in misses]))
+            for (i, key, versions), blue_win_prob in zip(misses, miss_probs):
+                blue_win_probs[i] = blue_win_prob
+                self.prediction_cache.put(key, versions, blue_win_prob)
+        return blue_win_probs
+
+    def predict_margin_many(self, raw_matches=None, teams=None, blue_win_probs=None):
+        """Vectorised version of predict_margin for a whole list of matches.
+        :param blue_win_probs: The result of predict_many for the same matches,
+        if already known, so the ratings don't need to be looked up again.
+        :return: Array of expected blue margins, one per match.
+        """
+        if blue_win_probs is None:
+            blue_win_probs = self.predict_many(raw_matches, teams)
+        return norm.ppf(blue_win_probs, loc=0, scale=self.stdev)
+
+    def elo_diffs(self, raw_matches=None, teams=None):
+        """Blue alliance rating minus red alliance rating for each match."""
+        if teams is None:
+            teams = self.match_teams(raw_matches)
+
+        # each alliance's ratings are looked up as one flat array and summed
+        # per match with bincount, as alliances can be any size
+        alliances = {alliance: [match_teams[alliance] for match_teams in teams]
+                     for alliance in ['blue', 'red']}
+        for team in set(chain.from_iterable(alliances['blue'] + alliances['red'])) - \
+                self.elo.keys():
+            self.init_team(team)
+        match_numbers = np.arange(len(teams))
+        alliance_ratings = {}
+        for alliance, alliance_teams in alliances.items():
+            sizes = np.fromiter(map(len, alliance_teams), np.intp, len(teams))
+            ratings = np.fromiter(map(self.elo.__getitem__, chain.from_iterable(alliance_teams)),
+                                  float, int(sizes.sum()))
+            alliance_ratings[alliance] = np.bincount(np.repeat(match_numbers, sizes),
+                                                     weights=ratings, minlength=len(teams))
+        return alliance_ratings['blue'] - alliance_ratings['red']
+
+    @staticmethod
+    def match_teams(raw_matches):
+        return [{'blue': raw_match['alliances']['blue']['team_keys'],
+                 'red': raw_match['alliances']['red']['team_keys']}
+                for raw_match in raw_matches]
+
+    def versions(self, teams):
+        """The rating version of each team, which changes whenever the team's
+        rating does. Predictions made with the same versions are the same."""
+        return (self.rating_epoch,) + tuple(self.rating_versions.get(team, 0) for team in teams)
+
+    def ratings_changed(self, teams=None):
+        """Record that the ratings of teams (or every team, if None) have
+        changed, invalidating predictions that used them."""
+        if teams is None:
+            self.rating_epoch += 1
+            self.prediction_cache.clear()
+            return
+        for team in teams:
+            self.rating_versions[team] = self.rating_versions.get(team, 0) + 1
+
     def recalculate_stdev(self, blue_score, red_score):
         self.stdev_i += 1
         self.stdev_scores.append(blue_score)
@@ -111,6 +203,7 @@ class FRCElo(object):
             self.elo[team] += update
         for team in match.red_teams:
             self.elo[team] -= update
+        self.ratings_changed(match.blue_teams + match.red_teams)
 
     def init_team(self, team_number, rating=None):
         """Add a new team with rating rating.
@@ -119,6 +212,20 @@ class FRCElo(object):
         provided in constructor.
         """
         self.elo[str(team_number)] = rating if rating else self.new_team_rating
+        self.ratings_changed([str(team_number)])
+
+    def get_state(self):
+        """Return a picklable copy of everything the ratings depend on."""
+        return {'elo': dict(self.elo), 'stdev': self.stdev,
+                'stdev_scores': list(self.stdev_scores), 'stdev_i': self.stdev_i}
+
+    def set_state(self, state):
+        """Restore state previously returned by get_state."""
+        self.elo = dict(state['elo'])
+        self.stdev = state['stdev']
+        self.stdev_scores = deque(state['stdev_scores'], maxlen=FRCElo.STDEV_LEN)
+        self.stdev_i = state['stdev_i']
+        self.ratings_changed()
 
     def next_year(self, reversion_score, reversion_factor, new_stdev):
         for team, elo in self.elo.items():
@@ -127,6 +234,7 @@ class FRCElo(object):
         self.stdev = new_stdev
         self.stdev_scores = deque([], maxlen=FRCElo.STDEV_LEN)
         self.stdev_i = 0
+        self.ratings_changed()
 
     @staticmethod
     def get_match_data(match):
@@ -0,0 +1,87 @@
+import glob
+import hashlib
+import os
+import pickle
+
+from typing import Dict, List
+
+from predict.elo import FRCElo
+
+
+class EloCheckpoints(object):
+    """Per-season snapshots of FRCElo state, so that startup only has to
+    replay the seasons that changed since the last run.
+
+    Each season's checkpoint is stored under a key that chains together the
+    Elo parameters, the previous season's key and a fingerprint of the
+    season's cached matches. Changing the parameters invalidates every
+    checkpoint, while changing one season's data invalidates only that season
+    and the ones after it.
+    """
+
+    CHECKPOINT_FILE_EXTENSION = '-elo_checkpoint.p'
+
+    def __init__(self, checkpoint_directory: str = 'cache/elo_checkpoints'):
+        self.checkpoint_directory = checkpoint_directory.rstrip('/')
+        os.makedirs(self.checkpoint_directory, exist_ok=True)
+
+    @staticmethod
+    def season_keys(params: Dict, years: List[int], fingerprints: List[str]) -> List[str]:
+        """ Work out the checkpoint key for each season.
+        Args:
+            params: The Elo parameters (K-factors, new team rating, reversion
+            settings etc) the ratings are calculated with.
+            years: The seasons, in the order they are replayed.
+            fingerprints: A fingerprint of each season's matches, or None if
+            the season can't be fingerprinted.
+        Returns:
+            A key for each season. A season's key is None if it or any season
+            before it has no fingerprint, as its checkpoint can't be trusted.
+        """
+        keys = []
+        previous_key = repr(sorted(params.items()))
+        for year, fingerprint in zip(years, fingerprints):
+            if previous_key is None or fingerprint is None:
+                key = None
+            else:
+                key_source = '|'.join([previous_key, str(year), fingerprint])
+                key = hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+            keys.append(key)
+            previous_key = key
+        return keys
+
+    def restore(self, elo: FRCElo, years: List[int], keys: List[str]) -> int:
+        """ Load the newest valid checkpoint into elo.
+        Returns:
+            The number of seasons (from the start of years) that the restored
+            state already includes. 0 if there was no valid checkpoint.
+        """
+        for i in reversed(range(len(years))):
+            if keys[i] is None:
+                continue
+            checkpoint_file = self.checkpoint_file(years[i], keys[i])
+            if os.path.isfile(checkpoint_file):
+                with open(checkpoint_file, 'rb') as f:
+                    elo.set_state(pickle.load(f))
+                return i + 1
+        return 0
+
+    def save(self, year: int, key: str, elo: FRCElo):
+        """ Checkpoint elo's state at the end of year, replacing any stale
+        checkpoint for that year. """
+        if key is None:
+            return
+        checkpoint_file = self.checkpoint_file(year, key)
+        for stale_file in glob.glob(self.checkpoint_file(year, '*')):
+            if stale_file != checkpoint_file:
+                os.remove(stale_file)
+        # write to a temporary file first so a crash can't leave a truncated
+        # checkpoint behind under a valid key
+        tmp_file = checkpoint_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(elo.get_state(), f)
+        os.replace(tmp_file, checkpoint_file)
+
+    def checkpoint_file(self, year: int, key: str) -> str:
+        return ''.join([self.checkpoint_directory, '/', str(year), '-', key,
+                        self.CHECKPOINT_FILE_EXTENSION])
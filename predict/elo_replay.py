@@ -0,0 +1,232 @@
+import numpy as np
+from collections import OrderedDict, namedtuple
+from scipy.special import ndtr
+
+from predict.elo import FRCElo
+
+# A season of matches compiled down to flat arrays. Team columns hold indices
+# into `teams` (padded with -1 for short alliances), and the arrays are in the
+# order the matches were played.
+CompiledSeason = namedtuple('CompiledSeason', ['teams', 'blue_teams', 'red_teams',
+                                               'blue_scores', 'red_scores', 'is_qm'])
+
+
+class EloReplay(object):
+    """Replays whole seasons through the FRCElo update rule in one pass.
+
+    Applying FRCElo.update match by match re-parses every TBA dict, rebuilds
+    the alliance sums and calls into scipy twice per match. Everything that
+    does not depend on the ratings (team lookups, margins, K-factors and the
+    rolling score stdev) is worked out up front with NumPy, which leaves a
+    tight loop over plain lists for the sequential part.
+
+    The expected margin in FRCElo.update is norm.ppf(norm.cdf(diff/550)) scaled
+    by the stdev, which is just stdev*diff/550, so no CDF/PPF evaluation is
+    needed inside the loop. Results match the per-match path to within
+    floating point rounding.
+    """
+
+    # fewest matches replay_events replays at once
+    BATCH_SIZE = 2000
+
+    def __init__(self, elo: FRCElo):
+        self.elo = elo
+
+    @staticmethod
+    def compile_season(year_events) -> CompiledSeason:
+        """ Compile a season into a CompiledSeason.
+        Args:
+            year_events: OrderedDict of event code -> list of TBA match dicts,
+            in chronological order (as stored in the DataStore).
+        """
+        team_index = {}
+        blue_teams = []
+        red_teams = []
+        blue_scores = []
+        red_scores = []
+        is_qm = []
+        for event in year_events.values():
+            if not event:
+                continue
+            for raw_match in event:
+                match = FRCElo.get_match_data(raw_match)
+                for alliance_teams, alliance_rows in ((match.blue_teams, blue_teams),
+                                                      (match.red_teams, red_teams)):
+                    row = []
+                    for team in alliance_teams:
+                        if team not in team_index:
+                            team_index[team] = len(team_index)
+                        row.append(team_index[team])
+                    alliance_rows.append(row)
+                blue_scores.append(match.blue_score)
+                red_scores.append(match.red_score)
+                is_qm.append(match.comp_level == 'qm')
+
+        return CompiledSeason(teams=list(team_index),
+                              blue_teams=EloReplay._pad_alliances(blue_teams),
+                              red_teams=EloReplay._pad_alliances(red_teams),
+                              blue_scores=np.array(blue_scores, dtype=np.int64),
+                              red_scores=np.array(red_scores, dtype=np.int64),
+                              is_qm=np.array(is_qm, dtype=bool))
+
+    @staticmethod
+    def season_from_archive(archive) -> CompiledSeason:
+        """ A CompiledSeason using the arrays of a util.match_archive.MatchArchive
+        (which has the same layout) without copying them. """
+        return CompiledSeason(teams=archive.teams.tolist(),
+                              blue_teams=archive.blue_teams,
+                              red_teams=archive.red_teams,
+                              blue_scores=archive.blue_scores,
+                              red_scores=archive.red_scores,
+                              # comp level code 0 is 'qm'
+                              is_qm=archive.comp_levels == 0)
+
+    @staticmethod
+    def _pad_alliances(rows):
+        width = max((len(row) for row in rows), default=3)
+        padded = np.full((len(rows), width), -1, dtype=np.int32)
+        for i, row in enumerate(rows):
+            padded[i, :len(row)] = row
+        return padded
+
+    def replay_year(self, year_events):
+        """ Compile and replay a season. See replay. """
+        return self.replay(self.compile_season(year_events))
+
+    def replay_events(self, event_matches, batch_size=None):
+        """ Replay a stream of events, such as DataStore.iter_year_events
+        yields, without holding the whole season in memory. Events are
+        compiled and replayed in batches of at least batch_size matches
+        (BATCH_SIZE by default), which leaves self.elo in the same state as
+        replaying the season at once.
+        Args:
+            event_matches: Iterable of (event code, list of TBA match dicts),
+            in chronological order.
+        Returns:
+            Array of the blue alliance's pre-match win probability for each
+            match, as for replay.
+        """
+        if batch_size is None:
+            batch_size = self.BATCH_SIZE
+        forecasts = []
+        batch = OrderedDict()
+        batch_matches = 0
+        for event_code, matches in event_matches:
+            batch[event_code] = matches
+            batch_matches += len(matches or [])
+            if batch_matches >= batch_size:
+                forecasts.append(self.replay_year(batch))
+                batch = OrderedDict()
+                batch_matches = 0
+        forecasts.append(self.replay_year(batch))
+        return np.concatenate(forecasts)
+
+    def replay(self, season: CompiledSeason):
+        """ Apply every match in season to self.elo, leaving it in the same state
+        as calling FRCElo.update on each match in turn.
+        Returns:
+            Array of the blue alliance's pre-match win probability for each
+            match, the same as FRCElo.predict would have given.
+        """
+        elo = self.elo
+        num_matches = len(season.blue_scores)
+        if num_matches == 0:
+            return np.zeros(0)
+
+        # map the season's team indices onto positions in a flat ratings list,
+        # adding new teams in the order FRCElo.update would have met them
+        for team in season.teams:
+            if team not in elo.elo:
+                elo.init_team(team)
+        all_teams = list(elo.elo)
+        position = {team: i for i, team in enumerate(all_teams)}
+        global_ids = np.array([position[team] for team in season.teams], dtype=np.int64)
+        ratings = list(elo.elo.values())
+
+        stdevs = self.stdev_schedule(season)
+        margins = (season.blue_scores - season.red_scores).astype(np.float64)
+        K = np.where(season.is_qm, elo.qm_K, elo.fm_K).astype(np.float64)
+        # update = K * (margin - stdev*diff/550) / stdev
+        #        = K*margin/stdev - (K/550) * diff
+        offsets = (K * margins / stdevs).tolist()
+        slopes = (K / 550).tolist()
+
+        blue = self._alliance_lists(season.blue_teams, global_ids)
+        red = self._alliance_lists(season.red_teams, global_ids)
+
+        diffs = []
+        for blue_ids, red_ids, offset, slope in zip(blue, red, offsets, slopes):
+            blue_elo = 0
+            for team in blue_ids:
+                blue_elo += ratings[team]
+            red_elo = 0
+            for team in red_ids:
+                red_elo += ratings[team]
+            diff = float(blue_elo - red_elo)
+            diffs.append(diff)
+            update = offset - slope * diff
+            for team in blue_ids:
+                ratings[team] += update
+            for team in red_ids:
+                ratings[team] -= update
+
+        elo.elo.update(zip(all_teams, ratings))
+        elo.ratings_changed()
+
+        scores = np.empty(2 * num_matches, dtype=np.int64)
+        scores[0::2] = season.blue_scores
+        scores[1::2] = season.red_scores
+        elo.stdev_scores.extend(scores[-FRCElo.STDEV_LEN:].tolist())
+        elo.stdev_i += num_matches
+        elo.stdev = float(stdevs[-1])
+
+        return ndtr(np.array(diffs) / 550)
+
+    def stdev_schedule(self, season: CompiledSeason):
+        """ The stdev FRCElo would use for each match in season.
+
+        FRCElo.recalculate_stdev recomputes the stdev over the last STDEV_LEN
+        scores every 20th update, so this only depends on the scores and can
+        be computed for the whole season at once from running sums.
+        """
+        elo = self.elo
+        num_matches = len(season.blue_scores)
+
+        new_scores = np.empty(2 * num_matches, dtype=np.float64)
+        new_scores[0::2] = season.blue_scores
+        new_scores[1::2] = season.red_scores
+        scores = np.concatenate((np.array(elo.stdev_scores, dtype=np.float64), new_scores))
+        num_prior = len(elo.stdev_scores)
+
+        # indices of the matches after which the stdev is recalculated
+        counts = elo.stdev_i + np.arange(1, num_matches + 1)
+        recalc = np.nonzero(counts % 20 == 0)[0]
+
+        stdevs = np.full(num_matches, float(elo.stdev))
+        if len(recalc):
+            # the score sums are of integers well under 2**53, so these are
+            # exact and the variance is computed without cancellation error
+            sums = np.concatenate(([0.0], np.cumsum(scores)))
+            sq_sums = np.concatenate(([0.0], np.cumsum(scores * scores)))
+            end = num_prior + 2 * (recalc + 1)
+            start = np.maximum(end - FRCElo.STDEV_LEN, 0)
+            n = (end - start).astype(np.float64)
+            s1 = sums[end] - sums[start]
+            s2 = sq_sums[end] - sq_sums[start]
+            window_stdev = np.sqrt((n * s2 - s1 * s1) / (n * (n - 1)))
+
+            # carry each recalculated value forward to the following matches
+            last_recalc = np.full(num_matches, -1)
+            last_recalc[recalc] = np.arange(len(recalc))
+            last_recalc = np.maximum.accumulate(last_recalc)
+            has_recalc = last_recalc >= 0
+            stdevs[has_recalc] = window_stdev[last_recalc[has_recalc]]
+
+        return stdevs
+
+    @staticmethod
+    def _alliance_lists(alliance_teams, global_ids):
+        if (alliance_teams >= 0).all():
+            return global_ids[alliance_teams].tolist()
+        return [[int(global_ids[team]) for team in row if team >= 0]
+                for row in alliance_teams]
@@ -1,135 +1,311 @@
-from collections import OrderedDict
-import random
+from collections import OrderedDict, namedtuple
+from itertools import combinations
 from typing import List
-from copy import copy
+import numpy as np
+
+from predict.playoff_formats import PLAYOFF_FORMATS, RoundRobin, is_tree
+
+# What has already happened in the playoffs. series_wins maps each series key
+# to an array of the games each alliance has won in it. rr_points maps each
+# round robin key to an array of the points each alliance has, and
+# rr_played to the set of (alliance, alliance) pairs that have already played.
+PlayoffState = namedtuple('PlayoffState', ['series_wins', 'rr_points', 'rr_played'])
+
+
+def series_win_prob(game_win_prob, wins_needed, losses_left):
+    """Probability of winning wins_needed more games before losing
+    losses_left more, when each game is won with probability game_win_prob.
+    Works elementwise on arrays."""
+    game_win_prob = np.asarray(game_win_prob, dtype=np.float64)
+    wins_needed = np.asarray(wins_needed)
+    losses_left = np.asarray(losses_left)
+    # sum over the number of games lost (k) before the deciding win:
+    # C(wins_needed-1+k, k) p^wins_needed (1-p)^k
+    prob = np.zeros(np.broadcast(game_win_prob, wins_needed, losses_left).shape)
+    max_losses = int(np.max(losses_left)) if losses_left.size else 0
+    for k in range(max_losses):
+        ways = np.ones_like(prob)
+        for j in range(1, k + 1):
+            ways = ways * (wins_needed - 1 + j) / j
+        term = ways * game_win_prob ** wins_needed * (1 - game_win_prob) ** k
+        prob += np.where(k < losses_left, term, 0)
+    # series that are already decided
+    prob = np.where(wins_needed <= 0, 1.0, prob)
+    prob = np.where((losses_left <= 0) & (wins_needed > 0), 0.0, prob)
+    return prob
 
 
 class Alliance:
-    def __init__(self, teams: List[str], alliance_num: int,
-                 current_round, current_round_record, levels):
+    def __init__(self, teams: List[str], alliance_num: int, team_keys, levels):
+        # the teams whose ratings are used for predictions
         self.teams = teams
         self.alliance_num = alliance_num
+        # every team that has played for the alliance
+        self.team_keys = set(team_keys)
         self.passed_round = OrderedDict([(level, 0) for level in levels])
-        self.current_round = current_round
-        self.current_round_record = current_round_record
-        for round in self.passed_round.keys():
-            self.passed_round[round] = True
-            if round == current_round:
-                break
 
     def through_percent(self, num_sims):
-        through_percentages = copy(self.passed_round)
-        for level, passed_number in through_percentages.items():
+        through_percentages = OrderedDict()
+        for level, passed_number in self.passed_round.items():
             through_percentages[level] = passed_number/num_sims
         return through_percentages
 
 
 class KnockoutPredictor:
 
-    EIGHT_TEAM_BRACKET = (((1, 8), (4, 5)), ((2, 7), (3, 6)))
+    NUM_SIMS = 100000
 
-    levels = ['ef', 'qf', 'sf', 'fm', 'won']
-
-    def __init__(self, event, knockout_type, elo, is_sim=False):
+    def __init__(self, event, knockout_type, elo, is_sim=False, num_sims=None, seed=None,
+                 exact=False):
+        """
+        :param knockout_type: The playoff format, one of the values of
+        Event.PLAYOFF_TYPE_MAPPING.
+        :param is_sim: If True, predict the playoffs from the start, ignoring
+        any matches already played and backup robots.
+        :param exact: If True, predict_bracket_knockout calculates the exact
+        probabilities instead of simulating, for formats where that is
+        possible.
+        """
         self.event = event
         self.knockout_type = knockout_type
+        self.playoff_format = PLAYOFF_FORMATS[knockout_type]
         self.elo = elo
         self.is_sim = is_sim
+        self.num_sims = self.NUM_SIMS if num_sims is None else num_sims
+        self.random = np.random.RandomState(seed)
+        self.exact = exact
+
+    @property
+    def levels(self):
+        return [playoff_round.level for playoff_round in self.playoff_format.rounds]
+
+    @property
+    def level_names(self):
+        return [playoff_round.name for playoff_round in self.playoff_format.rounds]
+
+    def predict_bracket_knockout(self, alliance_data, matches=None):
+        if self.exact and is_tree(self.playoff_format):
+            return self.calculate_bracket_knockout(alliance_data, matches)
+        return self.simulate_bracket_knockout(alliance_data, matches)
+
+    def simulate_bracket_knockout(self, alliance_data, matches=None):
+        """ Simulate the rest of the playoffs num_sims times.
+
+        The win probability for every pair of alliances is worked out once up
+        front, and all the simulations are then run together, one stage of
+        the playoffs at a time.
+        Args:
+            alliance_data: TBA alliance data for the event.
+            matches: The event's matches, used to pick up the playoffs from
+            where they are now.
+        Returns:
+            A list of [teams, through_percentages] for each alliance, where
+            through_percentages maps each level to the fraction of simulations
+            in which the alliance was still in the playoffs after that level.
+        """
+        alliances, win_probs, state = self.prepare_bracket(alliance_data, matches)
+        seed_index = {alliance.alliance_num: i for i, alliance in enumerate(alliances)}
+
+        num_sims = self.num_sims
+        sims = np.arange(num_sims)
+        results = {}
+        alive = np.ones((num_sims, len(alliances)), dtype=bool)
+        passed = np.zeros((len(alliances), len(self.levels)))
+
+        def resolve(source):
+            if source[0] == 'seed':
+                return np.full(num_sims, seed_index[source[1]])
+            return results[source]
+
+        for level_num, playoff_round in enumerate(self.playoff_format.rounds):
+            for stage in playoff_round.stages:
+                if isinstance(stage, RoundRobin):
+                    ranked = self.simulate_round_robin(stage, win_probs, state, seed_index)
+                    for rank in range(ranked.shape[1]):
+                        results[('rank', rank + 1)] = ranked[:, rank]
+                        if rank >= stage.advance:
+                            alive[sims, ranked[:, rank]] = False
+                    continue
+
+                first, second = resolve(stage.first), resolve(stage.second)
+                first_win_prob = self.series_win_probs(stage, win_probs, state)[first, second]
+                first_won = self.random.random_sample(num_sims) < first_win_prob
+                winner = np.where(first_won, first, second)
+                loser = np.where(first_won, second, first)
+                results[('winner', stage.key)] = winner
+                results[('loser', stage.key)] = loser
+                if stage.eliminates:
+                    alive[sims, loser] = False
+            passed[:, level_num] = alive.sum(axis=0)
+
+        return self.bracket_results(alliances, passed, num_sims)
+
+    def simulate_round_robin(self, stage, win_probs, state, seed_index):
+        """ Simulate the unplayed matches of a round robin.
+        Returns:
+            (num_sims, len(stage.seeds)) array of the alliances in each
+            simulation, from first to last.
+        """
+        num_sims = self.num_sims
+        num_alliances = len(win_probs)
+        members = np.array([seed_index[seed] for seed in stage.seeds])
+        played = state.rr_played.get(stage.key, set())
+        to_play = [(a, b) for a, b in combinations(members.tolist(), 2)
+                   if (a, b) not in played and (b, a) not in played]
 
-    def simulate_bracket_knockout(self, alliance_data):
-        levels = self.levels[1:-1]
-        alliances = self.generate_initial_state(alliance_data, levels)
+        points = np.tile(state.rr_points.get(stage.key, np.zeros(num_alliances)),
+                         (num_sims, 1))
+        if to_play:
+            first, second = np.array(to_play).T
+            first_won = self.random.random_sample((num_sims, len(to_play))) < \
+                win_probs[first, second]
+            # two points to the winner of each match
+            first_points = np.zeros((len(to_play), num_alliances))
+            first_points[np.arange(len(to_play)), first] = 2
+            second_points = np.zeros((len(to_play), num_alliances))
+            second_points[np.arange(len(to_play)), second] = 2
+            points += first_won @ first_points + (~first_won) @ second_points
 
-        starting_round = 'qf'
+        # points are whole numbers, so adding a random fraction breaks ties
+        # randomly without otherwise changing the order
+        standings = points[:, members] + self.random.random_sample((num_sims, len(members)))
+        return members[np.argsort(-standings, axis=1)]
 
-        num_sims = 1000
+    def calculate_bracket_knockout(self, alliance_data, matches=None):
+        """ Calculate the exact chance of each alliance getting through each
+        level of the bracket. Same return value as simulate_bracket_knockout.
+        Only works for formats where is_tree is True.
 
-        for i in range(num_sims):
-            bracket = self.generate_starting_bracket(alliances, starting_round)
-            for level in levels:
-                # store all the alliances through this level in a dict by number
-                self._alliances_through = {}
-                self.recursive_bracket_simulate(bracket, len(self.levels)-2)
+        Works through the bracket keeping, for every series, the probability
+        of each alliance being its winner. The winner of a series is one of
+        the alliances that could have reached either side of it, so each
+        series is a pair of matrix products with its series win probabilities.
+        """
+        alliances, win_probs, state = self.prepare_bracket(alliance_data, matches)
+        seed_index = {alliance.alliance_num: i for i, alliance in enumerate(alliances)}
 
-                # add one to the count of each alliance getting through this level
-                for alliance in self._alliances_through.values():
-                    alliance.passed_round[level] += 1
+        passed = np.zeros((len(alliances), len(self.levels)))
+        winner_probs = {}
+        for level_num, playoff_round in enumerate(self.playoff_format.rounds):
+            for series in playoff_round.stages:
+                first, second = [np.eye(len(alliances))[seed_index[source[1]]]
+                                 if source[0] == 'seed' else winner_probs[source[1]]
+                                 for source in (series.first, series.second)]
+                series_probs = self.series_win_probs(series, win_probs, state)
+                # P(alliance a from the first side wins) =
+                #   P(a on first side) * sum_b P(b on second side) * P(a beats b)
+                winner_probs[series.key] = first * (series_probs @ second) + \
+                    second * (first @ (1 - series_probs))
+                passed[:, level_num] += winner_probs[series.key]
+
+        return self.bracket_results(alliances, passed, 1)
+
+    def series_win_probs(self, series, win_probs, state):
+        """ Matrix of the probability that alliance i, as the first alliance
+        in series, wins it against alliance j, given the games each has
+        already won in it. """
+        wins = state.series_wins.get(series.key, np.zeros(len(win_probs)))
+        first_needed, second_needed = series.wins_needed
+        return series_win_prob(win_probs, first_needed - wins[:, np.newaxis],
+                               second_needed - wins[np.newaxis, :])
+
+    def prepare_bracket(self, alliance_data, matches):
+        """ Set up everything the playoff calculations need.
+        Returns:
+            The alliances, a matrix of the probability that alliance i beats
+            alliance j in a single match, and the PlayoffState.
+        """
+        alliances = self.generate_initial_state(alliance_data)
+        win_probs = self.alliance_win_probs(alliances)
+        if self.is_sim or not matches:
+            state = PlayoffState({}, {}, {})
+        else:
+            state = self.playoff_state(alliances, matches)
+        return alliances, win_probs, state
+
+    def playoff_state(self, alliances, matches):
+        """ Work out the PlayoffState from the event's played matches. """
+        round_robin_keys = set(stage.key for playoff_round in self.playoff_format.rounds
+                               for stage in playoff_round.stages
+                               if isinstance(stage, RoundRobin))
+        state = PlayoffState({}, {}, {})
+        for match in matches:
+            if match['comp_level'] == 'qm':
+                continue
+            blue_score = match['alliances']['blue']['score']
+            red_score = match['alliances']['red']['score']
+            if blue_score is None or blue_score == -1 or red_score is None or red_score == -1:
+                continue
+            blue = self.match_alliance(alliances, match['alliances']['blue']['team_keys'])
+            red = self.match_alliance(alliances, match['alliances']['red']['team_keys'])
+            if blue is None or red is None:
+                continue
+
+            key = (match['comp_level'], match['set_number'])
+            if key in round_robin_keys:
+                points = state.rr_points.setdefault(key, np.zeros(len(alliances)))
+                state.rr_played.setdefault(key, set()).add((blue, red))
+                if blue_score == red_score:
+                    points[[blue, red]] += 1
+                else:
+                    points[blue if blue_score > red_score else red] += 2
+            elif blue_score != red_score:
+                # tied playoff matches are replayed, so they don't count
+                wins = state.series_wins.setdefault(key, np.zeros(len(alliances)))
+                wins[blue if blue_score > red_score else red] += 1
+        return state
+
+    @staticmethod
+    def match_alliance(alliances, team_keys):
+        """ Index of the alliance that team_keys played for, or None. """
+        overlaps = [len(alliance.team_keys.intersection(team_keys)) for alliance in alliances]
+        best = int(np.argmax(overlaps))
+        return best if overlaps[best] else None
+
+    def bracket_results(self, alliances, passed, total):
+        for alliance, alliance_passed in zip(alliances, passed):
+            alliance.passed_round = OrderedDict(zip(self.levels, alliance_passed.tolist()))
 
         simulation_results = []
         for alliance in alliances:
-            through_percentages = alliance.through_percent(num_sims)
+            through_percentages = alliance.through_percent(total)
             simulation_results.append([alliance.teams, through_percentages])
 
         # sort by the chance of winning the comp
         simulation_results = sorted(simulation_results,
-                                    key=lambda x: x[1]['fm'])
+                                    key=lambda x: x[1][self.levels[-1]])
 
         return simulation_results
 
-    def recursive_bracket_simulate(self, bracket, level_number):
-        if all([isinstance(n, Alliance) for n in bracket]):
-            if any(self.levels.index(alliance.current_round) > level_number
-                    for alliance in bracket):
-                if self.levels.index(bracket[0].current_round) > level_number:
-                    winner = bracket[0]
-                else:
-                    winner = bracket[1]
-            else:
-                record = [bracket[0].current_round_record['wins'],
-                          bracket[1].current_round_record['losses']]
-                winner = self.simulate_match(bracket, record)
-            self._alliances_through[winner.alliance_num] = winner
-            return winner
-        else:
-            for i, half_bracket in enumerate(bracket):
-                bracket[i] = self.recursive_bracket_simulate(
-                        half_bracket, level_number-1)
-            return bracket
-
-    def simulate_match(self, matchup, record, to_win=2):
-        while record[0] < to_win and record[1] < to_win:
-            a_win_prob = self.elo.predict(teams={'blue': matchup[0].teams, 'red': matchup[1].teams})
-            if random.uniform(0, 1) <= a_win_prob:
-                record[0] += 1
-            else:
-                record[1] += 1
-        if record[0] > record[1]:
-            return matchup[0]
-        else:
-            return matchup[1]
+    def alliance_win_probs(self, alliances):
+        """ Matrix of the probability that alliance i beats alliance j in a
+        single match. """
+        pairs = [(i, j) for i in range(len(alliances)) for j in range(len(alliances))]
+        win_probs = self.elo.predict_many(teams=[{'blue': alliances[i].teams,
+                                                  'red': alliances[j].teams}
+                                                 for i, j in pairs])
+        return np.asarray(win_probs).reshape(len(alliances), len(alliances))
 
-    def generate_initial_state(self, alliance_data, levels):
+    def generate_initial_state(self, alliance_data):
         alliances = []
         for num, raw_alliance in enumerate(alliance_data, start=1):
             # TODO: Add support for 3rd pick
             teams = raw_alliance['picks'][:3]
-            if raw_alliance['backup'] and raw_alliance['out'] in teams \
-                    and not self.is_sim:
-                teams[teams.index(raw_alliance['out'])] = raw_alliance['in']
+            team_keys = list(raw_alliance['picks'])
+            backup = raw_alliance.get('backup')
+            if backup and not self.is_sim:
+                team_keys.append(backup['in'])
+                if backup['out'] in teams:
+                    teams[teams.index(backup['out'])] = backup['in']
             try:
                 # parse alliance number if available
                 alliance_num = int(raw_alliance['name'].lstrip('Alliance '))
-            except KeyError:
+            except (KeyError, ValueError, AttributeError):
                 # else just assume the alliances are in order
                 alliance_num = num
 
-            if not self.is_sim:
-                level = raw_alliance['level']
-                record = raw_alliance['status']['current_level_record']
-            else:
-                level = 'qf'
-                record = {'wins': 0, 'losses': 0}
-            alliance = Alliance(teams, alliance_num, level, record, levels)
+            alliances.append(Alliance(teams, alliance_num, team_keys, self.levels))
 
-            alliances.append(alliance)
-
-        return alliances
-
-    def generate_starting_bracket(self, alliances, bracket_min_level):
-        if bracket_min_level == "qf":
-            bracket = [[[alliances[0], alliances[7]], [alliances[3], alliances[4]]],
-                       [[alliances[1], alliances[6]], [alliances[2], alliances[5]]]]
-            return bracket
-        else:
-            print("Error: invalid bracket type")
-            raise Exception
+        # formats with fewer alliances only take the top seeds
+        alliances = sorted(alliances, key=lambda alliance: alliance.alliance_num)
+        return alliances[:self.playoff_format.num_alliances]
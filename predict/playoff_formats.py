@@ -0,0 +1,130 @@
+"""Descriptions of the playoff formats in Event.PLAYOFF_TYPE_MAPPING.
+
+A format is a list of rounds, each of which is a list of stages that are
+played together. A stage is either a Series between two alliances or a
+RoundRobin between several. Series name where their alliances come from, so
+the whole bracket is plain data and the same engine (KnockoutPredictor) can
+simulate every format.
+
+Sources are tuples of:
+    ('seed', n): alliance number n.
+    ('winner', key) / ('loser', key): the winner or loser of the series key.
+    ('rank', n): the alliance ranked n (from 1) at the end of the round robin.
+
+Stage keys are the (comp_level, set_number) that TBA files the stage's
+matches under, which is how matches already played are matched up to the
+stage they belong to.
+"""
+from collections import namedtuple
+
+# wins_needed is the number of games (first, second) need to win the series.
+# If eliminates is False the loser drops into a losers' bracket rather than
+# being knocked out.
+Series = namedtuple('Series', ['key', 'first', 'second', 'wins_needed', 'eliminates'])
+# every alliance plays each other once, and the top `advance` go through
+RoundRobin = namedtuple('RoundRobin', ['key', 'seeds', 'advance'])
+Round = namedtuple('Round', ['level', 'name', 'stages'])
+PlayoffFormat = namedtuple('PlayoffFormat', ['num_alliances', 'rounds'])
+
+LEVEL_NAMES = {'ef': 'Eighths', 'qf': 'Quarters', 'sf': 'Semis', 'f': 'Final'}
+
+BEST_OF_3 = (2, 2)
+BEST_OF_5 = (3, 3)
+SINGLE_MATCH = (1, 1)
+
+
+def single_elimination(seed_pairs, levels, wins_needed=BEST_OF_3):
+    """ Build a standard knockout bracket.
+    Args:
+        seed_pairs: The first round matchups, in bracket order, so the winners
+        of pairs 2n and 2n+1 meet in the next round.
+        levels: The TBA comp level of each round.
+    """
+    rounds = []
+    sources = [(('seed', first), ('seed', second)) for first, second in seed_pairs]
+    for level in levels:
+        stages = [Series((level, set_number), first, second, wins_needed, True)
+                  for set_number, (first, second) in enumerate(sources, start=1)]
+        rounds.append(Round(level, LEVEL_NAMES[level], stages))
+        winners = [('winner', series.key) for series in stages]
+        sources = list(zip(winners[0::2], winners[1::2]))
+    return PlayoffFormat(num_alliances=2 * len(seed_pairs), rounds=rounds)
+
+
+def is_tree(playoff_format):
+    """ True if every stage only depends on seeds and winners of earlier
+    stages, so that the bracket is a tree and can be calculated exactly. """
+    for playoff_round in playoff_format.rounds:
+        for stage in playoff_round.stages:
+            if not isinstance(stage, Series):
+                return False
+            if any(source[0] not in ('seed', 'winner')
+                   for source in (stage.first, stage.second)):
+                return False
+    return True
+
+
+BRACKET_16_TEAM = single_elimination(
+    [(1, 16), (8, 9), (4, 13), (5, 12), (2, 15), (7, 10), (3, 14), (6, 11)],
+    ['ef', 'qf', 'sf', 'f'])
+
+BRACKET_8_TEAM = single_elimination([(1, 8), (4, 5), (2, 7), (3, 6)], ['qf', 'sf', 'f'])
+
+BRACKET_4_TEAM = single_elimination([(1, 4), (2, 3)], ['sf', 'f'])
+
+# Championship round robin: every alliance plays every other once, with the
+# top two playing a best of 3 final.
+ROUND_ROBIN_6_TEAM = PlayoffFormat(num_alliances=6, rounds=[
+    Round('rr', 'Escape Round Robin',
+          [RoundRobin(('sf', 1), [1, 2, 3, 4, 5, 6], 2)]),
+    Round('f', 'Win Finals',
+          [Series(('f', 1), ('rank', 1), ('rank', 2), BEST_OF_3, True)]),
+])
+
+
+def _double_elim_series(key, first, second, eliminates=True):
+    return Series(key, first, second, SINGLE_MATCH, eliminates)
+
+
+# Single match double elimination, using TBA's legacy set numbering.
+DOUBLE_ELIM_8_TEAM = PlayoffFormat(num_alliances=8, rounds=[
+    Round('r1', 'Round 1', [
+        _double_elim_series(('ef', 1), ('seed', 1), ('seed', 8), eliminates=False),
+        _double_elim_series(('ef', 2), ('seed', 4), ('seed', 5), eliminates=False),
+        _double_elim_series(('ef', 3), ('seed', 2), ('seed', 7), eliminates=False),
+        _double_elim_series(('ef', 4), ('seed', 3), ('seed', 6), eliminates=False)]),
+    Round('r2', 'Round 2', [
+        _double_elim_series(('ef', 5), ('loser', ('ef', 1)), ('loser', ('ef', 2))),
+        _double_elim_series(('ef', 6), ('loser', ('ef', 3)), ('loser', ('ef', 4))),
+        _double_elim_series(('qf', 1), ('winner', ('ef', 1)), ('winner', ('ef', 2)),
+                            eliminates=False),
+        _double_elim_series(('qf', 2), ('winner', ('ef', 3)), ('winner', ('ef', 4)),
+                            eliminates=False)]),
+    Round('r3', 'Round 3', [
+        _double_elim_series(('qf', 3), ('loser', ('qf', 1)), ('winner', ('ef', 6))),
+        _double_elim_series(('qf', 4), ('loser', ('qf', 2)), ('winner', ('ef', 5)))]),
+    Round('r4', 'Round 4', [
+        _double_elim_series(('sf', 1), ('winner', ('qf', 3)), ('winner', ('qf', 4))),
+        _double_elim_series(('sf', 2), ('winner', ('qf', 1)), ('winner', ('qf', 2)),
+                            eliminates=False)]),
+    Round('r5', 'Round 5', [
+        _double_elim_series(('f', 1), ('loser', ('sf', 2)), ('winner', ('sf', 1)))]),
+    # the unbeaten alliance only has to win once, the other alliance twice
+    Round('f', 'Final', [
+        Series(('f', 2), ('winner', ('sf', 2)), ('winner', ('f', 1)), (1, 2), True)]),
+])
+
+BO5_FINALS = PlayoffFormat(num_alliances=2, rounds=[
+    Round('f', LEVEL_NAMES['f'],
+          [Series(('f', 1), ('seed', 1), ('seed', 2), BEST_OF_5, True)]),
+])
+
+# keyed by the values of Event.PLAYOFF_TYPE_MAPPING
+PLAYOFF_FORMATS = {
+    8: BRACKET_8_TEAM,
+    16: BRACKET_16_TEAM,
+    4: BRACKET_4_TEAM,
+    '6-team-round-robin': ROUND_ROBIN_6_TEAM,
+    'DOUBLE_ELIM_8_TEAM': DOUBLE_ELIM_8_TEAM,
+    'BO5_FINALS': BO5_FINALS,
+}
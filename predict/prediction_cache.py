@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """Cache of blue win probabilities, keyed by alliance composition.
+
+    Each entry records the rating version of every team in the match (see
+    FRCElo.rating_versions) when it was calculated. A lookup only hits if
+    all six versions still match, so an entry is invalidated exactly when
+    one of its teams' ratings changes, and never otherwise. The least
+    recently used entries are evicted once there are more than max_size.
+    """
+
+    MAX_SIZE = 100000
+
+    def __init__(self, max_size=None):
+        self.max_size = self.MAX_SIZE if max_size is None else max_size
+        # key -> (versions, blue win probability), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(blue_teams, red_teams):
+        # the order of teams within an alliance doesn't change the prediction
+        return tuple(sorted(blue_teams)), tuple(sorted(red_teams))
+
+    def get(self, key, versions):
+        """ The cached blue win probability for key, or None if there isn't
+        one calculated with the ratings at versions. """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == versions:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1]
+            self.invalidations += 1
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, versions, blue_win_prob):
+        self.entries[key] = (versions, blue_win_prob)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations, 'evictions': self.evictions}
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class RankingProjector:
+    """Projects the final qualification rankings by simulating the rest of
+    the qualification schedule.
+
+    Every unplayed match is priced once with FRCElo.predict_many, and then all
+    the simulations are drawn together as a (num_sims, num_matches) array of
+    results. Ranking points are totalled with a matrix product against which
+    teams played in each match, so there is no per-match Python loop.
+
+    Played matches count the ranking points TBA reports where the score
+    breakdown has them (including bonus ranking points), or 2 for a win and
+    1 for a tie otherwise. Simulated matches only award the 2 points for a
+    win, as bonus ranking points aren't predicted.
+    """
+
+    NUM_SIMS = 10000
+
+    # number of alliance captains, used for the chance of being a top seed
+    NUM_CAPTAINS = 8
+
+    def __init__(self, elo, num_sims=None, seed=None):
+        self.elo = elo
+        self.num_sims = self.NUM_SIMS if num_sims is None else num_sims
+        self.random = np.random.RandomState(seed)
+
+    def project(self, played_matches, unplayed_matches):
+        """ Simulate the rest of qualifications.
+        Args:
+            played_matches: The qualification matches already played.
+            unplayed_matches: The qualification matches still to be played.
+        Returns:
+            An OrderedDict of team key -> dict of the team's projection, with
+            'ranking_points' (the current total), 'mean_ranking_points',
+            'ranking_point_distribution' (an OrderedDict of final total ->
+            probability), 'mean_seed', 'seed_distribution' (a list of the
+            probability of finishing in each seed, from first) and
+            'top_seed_prob' (the chance of finishing as an alliance captain).
+            Ordered by mean seed.
+        """
+        teams = OrderedDict()
+        for match in played_matches + unplayed_matches:
+            for alliance in ['blue', 'red']:
+                for team in self.ranked_teams(match, alliance):
+                    teams.setdefault(team, len(teams))
+        if not teams:
+            return OrderedDict()
+
+        current_points = np.zeros(len(teams))
+        for match in played_matches:
+            for alliance in ['blue', 'red']:
+                points = self.ranking_points(match, alliance)
+                for team in self.ranked_teams(match, alliance):
+                    current_points[teams[team]] += points
+
+        num_sims = self.num_sims
+        final_points = np.tile(current_points, (num_sims, 1))
+        if unplayed_matches:
+            # which teams earn ranking points if blue/red win each match
+            blue_teams = np.zeros((len(unplayed_matches), len(teams)))
+            red_teams = np.zeros((len(unplayed_matches), len(teams)))
+            for i, match in enumerate(unplayed_matches):
+                for team in self.ranked_teams(match, 'blue'):
+                    blue_teams[i, teams[team]] = 1
+                for team in self.ranked_teams(match, 'red'):
+                    red_teams[i, teams[team]] = 1
+
+            blue_win_probs = self.elo.predict_many(unplayed_matches)
+            blue_won = self.random.random_sample((num_sims, len(unplayed_matches))) < \
+                blue_win_probs
+            final_points += 2 * (blue_won @ blue_teams + (~blue_won) @ red_teams)
+
+        # ranking points are whole numbers, so adding a random fraction breaks
+        # ties randomly without otherwise changing the order
+        standings = final_points + self.random.random_sample(final_points.shape)
+        order = np.argsort(-standings, axis=1)
+        seeds = np.empty_like(order)
+        seeds[np.arange(num_sims)[:, np.newaxis], order] = np.arange(len(teams))
+
+        projections = []
+        for team, i in teams.items():
+            seed_distribution = np.bincount(seeds[:, i], minlength=len(teams)) / num_sims
+            totals, counts = np.unique(final_points[:, i], return_counts=True)
+            projections.append((team, {
+                'ranking_points': float(current_points[i]),
+                'mean_ranking_points': float(final_points[:, i].mean()),
+                'ranking_point_distribution': OrderedDict(
+                    zip(totals.tolist(), (counts / num_sims).tolist())),
+                'mean_seed': float(seeds[:, i].mean() + 1),
+                'seed_distribution': seed_distribution.tolist(),
+                'top_seed_prob': float(seed_distribution[:self.NUM_CAPTAINS].sum())}))
+
+        return OrderedDict(sorted(projections, key=lambda x: x[1]['mean_seed']))
+
+    @staticmethod
+    def ranked_teams(match, alliance):
+        """ The teams on alliance whose ranking the match counts towards. """
+        alliance_data = match['alliances'][alliance]
+        surrogates = alliance_data.get('surrogate_team_keys') or []
+        return [team for team in alliance_data['team_keys'] if team not in surrogates]
+
+    @staticmethod
+    def ranking_points(match, alliance):
+        """ The ranking points alliance earned in a played match. """
+        breakdown = match.get('score_breakdown')
+        if breakdown and 'rp' in breakdown.get(alliance, {}):
+            return breakdown[alliance]['rp']
+        other = 'red' if alliance == 'blue' else 'blue'
+        score = match['alliances'][alliance]['score']
+        other_score = match['alliances'][other]['score']
+        return 2 if score > other_score else (1 if score == other_score else 0)
@@ -0,0 +1,65 @@
+"""Compare the per-match FRCElo.update path against EloReplay on synthetic
+seasons. Run from the repository root with `python -m predict.replay_benchmark`."""
+
+from predict.elo import FRCElo
+from predict.elo_replay import EloReplay
+from collections import OrderedDict
+import random
+import time
+
+NUM_YEARS = 11
+EVENTS_PER_YEAR = 120
+MATCHES_PER_EVENT = 90
+TEAMS_PER_EVENT = 40
+NUM_TEAMS = 3500
+
+
+def synthetic_year(year, rng):
+    year_events = OrderedDict()
+    for event_num in range(EVENTS_PER_YEAR):
+        teams = ['frc%s' % t for t in rng.sample(range(1, NUM_TEAMS), TEAMS_PER_EVENT)]
+        matches = []
+        for match_num in range(MATCHES_PER_EVENT):
+            picked = rng.sample(teams, 6)
+            comp_level = 'qm' if match_num < MATCHES_PER_EVENT - 15 else 'qf'
+            matches.append({
+                'key': '%sev%s_%s%s' % (year, event_num, comp_level, match_num),
+                'comp_level': comp_level,
+                'alliances': {
+                    'blue': {'team_keys': picked[:3], 'score': rng.randint(0, 400)},
+                    'red': {'team_keys': picked[3:], 'score': rng.randint(0, 400)}}})
+        year_events['%sev%s' % (year, event_num)] = matches
+    return year_events
+
+
+def make_elo():
+    return FRCElo(qm_K=20, fm_K=5, new_team_rating=1350, init_stdev=50)
+
+
+if __name__ == '__main__':
+    rng = random.Random(2018)
+    years = [synthetic_year(year, rng) for year in range(2008, 2008 + NUM_YEARS)]
+    num_matches = sum(len(event) for year in years for event in year.values())
+    print("%s seasons, %s matches" % (len(years), num_matches))
+
+    per_match = make_elo()
+    start = time.perf_counter()
+    for year_events in years:
+        for event in year_events.values():
+            for match in event:
+                per_match.update(match)
+        per_match.next_year(1500, 0.2, 50)
+    per_match_time = time.perf_counter() - start
+
+    batch = make_elo()
+    replay = EloReplay(batch)
+    start = time.perf_counter()
+    for year_events in years:
+        replay.replay_year(year_events)
+        batch.next_year(1500, 0.2, 50)
+    batch_time = time.perf_counter() - start
+
+    max_diff = max(abs(per_match.elo[team] - batch.elo[team]) for team in per_match.elo)
+    print("FRCElo.update: %.2fs" % per_match_time)
+    print("EloReplay:     %.2fs (%.1fx)" % (batch_time, per_match_time / batch_time))
+    print("Max rating difference: %.3g" % max_diff)
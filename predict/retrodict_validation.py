@@ -1,44 +1,42 @@
-"""Testing out and experimenting with the prediction algorithm"""
+"""Testing out and experimenting with the prediction algorithm.
 
-from elo import FRCElo
-import pickle
-import statistics
+Reads the seasons from the match archives in cache/ (see util.match_archive,
+which converts the cached matches with `python -m util.match_archive`). Run
+from the repository root with `python -m predict.retrodict_validation`."""
+
+from predict.elo import FRCElo
+from predict.elo_replay import EloReplay
+from util.data_store import DataStore
+from util.match_archive import MatchArchive
 import math
+import numpy as np
+import statistics
 
 default_stdev = 50
 
 elo = FRCElo(qm_K=20, fm_K=5, new_team_rating=1350, init_stdev=default_stdev)
+replay = EloReplay(elo)
 
-briers = []
 year_briers = []
 
 predictions_outcomes = []
 
-i = 0
-
 for year in range(2008, 2018):
-    with open("../cache/" + str(year) + "matches.p", "rb") as year_file:
-        year_events = pickle.load(year_file)
-        processed_teams = []
-        for event in year_events.values():
-            for match in event:
-
-                forecast = elo.predict(match)
-                processed_match = FRCElo.get_match_data(match)
-                margin = processed_match.blue_score - processed_match.red_score
-                outcome = 0.5 if margin == 0 else (1 if margin > 0 else 0)
-
-                if year % 2 == 0:
-                    predictions_outcomes.append((forecast, outcome))
-                    briers.append((forecast - outcome) ** 2)
-
-                elo.update(match)
-
-        if not briers == []:
-            print("%s year brier %s" % (year, statistics.mean(briers)))
-            year_briers.append(statistics.mean(briers))
-        briers = []
-        elo.next_year(1500, 0.2, default_stdev)
+    archive = MatchArchive.load('cache/%s%s' % (year, DataStore.ARCHIVE_DIRECTORY_EXTENSION))
+    if archive is None:
+        print("No match archive for %s" % year)
+        continue
+    # pre-match blue win probabilities
+    forecasts = replay.replay(EloReplay.season_from_archive(archive))
+    margins = archive.blue_scores.astype(np.int64) - archive.red_scores
+    outcomes = np.where(margins == 0, 0.5, (margins > 0).astype(np.float64))
+
+    if year % 2 == 0:
+        predictions_outcomes.extend(zip(forecasts.tolist(), outcomes.tolist()))
+        year_brier = float(np.mean((forecasts - outcomes) ** 2))
+        print("%s year brier %s" % (year, year_brier))
+        year_briers.append(year_brier)
+    elo.next_year(1500, 0.2, default_stdev)
 
 print(statistics.mean(year_briers))
 
@@ -71,18 +69,3 @@ for match in predictions_outcomes:
         blue_wins += 1
 
 print("red: %s, blue %s" % (red_wins, blue_wins))
-"""
-
-predict = [0, 0]
-outcome = [0, 0]
-
-for  match in predictions_outcomes:
-    if match[0] < 0.5 and not match[1] == 0.5:
-        predict[0] += 1
-        outcome[0] += match[1]
-    elif match[0] > 0.5 and not match[1] == 0.5:
-        predict[1] += 1
-        outcome[1] += match[1]
-
-print("0.25 %s %s" % (outcome[0]/predict[0], predict[0]))
-print("0.25 %s %s" % (outcome[1]/predict[1], predict[1]))"""
@@ -0,0 +1,28 @@
+from fixtures import make_elo, make_match
+import numpy as np
+
+RATINGS = {team: 1300 + 7 * team for team in range(1, 21)}
+
+
+def test_matches_predict():
+    random = np.random.RandomState(0)
+    # teams above 20 haven't been seen before, and one match has a two team
+    # alliance
+    matches = [make_match(*random.choice(30, 6, replace=False).reshape(2, 3) + 1)
+               for _ in range(50)]
+    matches.append(make_match([1, 25], [3, 4, 26]))
+
+    batch = make_elo(RATINGS)
+    serial = make_elo(RATINGS)
+    blue_win_probs = batch.predict_many(matches)
+    margins = batch.predict_margin_many(blue_win_probs=blue_win_probs)
+    assert np.allclose(blue_win_probs, [serial.predict(match) for match in matches])
+    assert np.allclose(margins, [serial.predict_margin(match) for match in matches])
+    assert batch.elo == serial.elo
+
+    def alliance_rating(match, alliance):
+        return sum(serial.elo[team] for team in match['alliances'][alliance]['team_keys'])
+    assert np.allclose(make_elo(RATINGS).elo_diffs(matches),
+                       [alliance_rating(match, 'blue') - alliance_rating(match, 'red')
+                        for match in matches])
+    assert len(make_elo(RATINGS).elo_diffs([])) == 0
@@ -0,0 +1,42 @@
+from fixtures import ELO_PARAMS, make_elo
+from predict.elo_checkpoints import EloCheckpoints
+
+
+def test_changed_season_invalidates_later_keys():
+    years = [2008, 2009, 2010]
+    keys = EloCheckpoints.season_keys(ELO_PARAMS, years, ['a', 'b', 'c'])
+    changed = EloCheckpoints.season_keys(ELO_PARAMS, years, ['a', 'B', 'c'])
+    assert keys[0] == changed[0]
+    assert keys[1] != changed[1] and keys[2] != changed[2]
+
+    other_params = dict(ELO_PARAMS, qm_K=10)
+    assert not set(keys) & set(EloCheckpoints.season_keys(other_params, years, ['a', 'b', 'c']))
+
+    assert EloCheckpoints.season_keys(ELO_PARAMS, years, ['a', None, 'c'])[1:] == [None, None]
+
+
+def test_restore_newest_valid_checkpoint(tmp_path):
+    checkpoints = EloCheckpoints(str(tmp_path))
+    years = [2008, 2009, 2010]
+    keys = EloCheckpoints.season_keys(ELO_PARAMS, years, ['a', 'b', 'c'])
+
+    elo = make_elo()
+    for year, key in zip(years, keys):
+        elo.init_team('frc%s' % year)
+        elo.stdev_scores.append(year)
+        elo.stdev_i += 1
+        checkpoints.save(year, key, elo)
+
+    restored = make_elo()
+    assert checkpoints.restore(restored, years, keys) == 3
+    assert restored.get_state() == elo.get_state()
+
+    # 2009's data changed, so only the 2008 checkpoint is still usable
+    changed_keys = EloCheckpoints.season_keys(ELO_PARAMS, years, ['a', 'B', 'c'])
+    restored = make_elo()
+    assert checkpoints.restore(restored, years, changed_keys) == 1
+    assert list(restored.elo) == ['frc2008']
+
+    # saving under the new key replaces the stale checkpoint
+    checkpoints.save(2009, changed_keys[1], restored)
+    assert len(list(tmp_path.glob('2009-*'))) == 1
@@ -0,0 +1,84 @@
+from fixtures import make_elo
+from predict.elo_replay import EloReplay
+from collections import OrderedDict
+import random
+
+
+def make_year(year, rng, num_events=6, num_matches=70):
+    year_events = OrderedDict()
+    for event_num in range(num_events):
+        teams = ['frc%s' % t for t in rng.sample(range(1, 200), 30)]
+        matches = []
+        for match_num in range(num_matches):
+            picked = rng.sample(teams, 6)
+            matches.append({
+                'key': '%sev%s_qm%s' % (year, event_num, match_num),
+                'comp_level': 'qm' if match_num < num_matches - 10 else 'sf',
+                'alliances': {
+                    'blue': {'team_keys': picked[:3], 'score': rng.randint(0, 300)},
+                    'red': {'team_keys': picked[3:], 'score': rng.randint(0, 300)}}})
+        year_events['%sev%s' % (year, event_num)] = matches
+    return year_events
+
+
+def test_replay_matches_per_match_updates():
+    rng = random.Random(0)
+    years = [make_year(year, rng) for year in range(2008, 2011)]
+
+    per_match = make_elo()
+    forecasts = []
+    for year_events in years:
+        year_forecasts = []
+        for event in year_events.values():
+            for match in event:
+                year_forecasts.append(per_match.predict(match))
+                per_match.update(match)
+        forecasts.append(year_forecasts)
+        per_match.next_year(1500, 0.2, 50)
+
+    batch = make_elo()
+    replay = EloReplay(batch)
+    for year_events, year_forecasts in zip(years, forecasts):
+        replayed = replay.replay_year(year_events)
+        assert max(abs(replayed - year_forecasts)) < 1e-9
+        batch.next_year(1500, 0.2, 50)
+
+    assert list(batch.elo) == list(per_match.elo)
+    for team, rating in per_match.elo.items():
+        assert abs(batch.elo[team] - rating) < 1e-9
+
+
+def test_replay_continues_from_partial_season():
+    rng = random.Random(1)
+    year_events = make_year(2009, rng, num_events=2, num_matches=55)
+    first_event, second_event = year_events.keys()
+
+    per_match = make_elo()
+    for event in year_events.values():
+        for match in event:
+            per_match.update(match)
+
+    batch = make_elo()
+    for match in year_events[first_event]:
+        batch.update(match)
+    EloReplay(batch).replay_year(OrderedDict([(second_event, year_events[second_event])]))
+
+    assert batch.stdev_i == per_match.stdev_i
+    assert list(batch.stdev_scores) == list(per_match.stdev_scores)
+    assert abs(batch.stdev - per_match.stdev) < 1e-9
+    for team, rating in per_match.elo.items():
+        assert abs(batch.elo[team] - rating) < 1e-9
+
+
+def test_replay_events_in_batches():
+    year_events = make_year(2008, random.Random(3))
+
+    whole = make_elo()
+    expected = EloReplay(whole).replay_year(year_events)
+    batched = make_elo()
+    # batches that end part way through the stdev recalculation period
+    forecasts = EloReplay(batched).replay_events(iter(year_events.items()), batch_size=33)
+
+    assert max(abs(forecasts - expected)) < 1e-9
+    assert batched.elo == whole.elo
+    assert batched.stdev == whole.stdev and batched.stdev_i == whole.stdev_i
@@ -0,0 +1,95 @@
+from fixtures import make_elo, make_match
+from predict.knockout_predictor import KnockoutPredictor, series_win_prob
+from predict.playoff_formats import PLAYOFF_FORMATS
+import numpy as np
+
+RATINGS = {team: 1650 - 6 * team for team in range(1, 49)}
+
+
+def make_alliance_data(num_alliances=8):
+    return [{'name': 'Alliance %s' % num,
+             'picks': ['frc%s' % (3 * num - 2 + i) for i in range(3)],
+             'backup': None}
+            for num in range(1, num_alliances + 1)]
+
+
+def alliance_match(comp_level, set_number, blue_num, red_num, blue_won):
+    def teams(num):
+        return [3 * num - 2 + i for i in range(3)]
+    return make_match(teams(blue_num), teams(red_num), 100 if blue_won else 50,
+                      50 if blue_won else 100, comp_level=comp_level, set_number=set_number)
+
+
+def level_sums(results):
+    return {level: sum(through[level] for _, through in results) for level in results[0][1]}
+
+
+def test_series_win_prob():
+    assert np.isclose(series_win_prob(0.6, 2, 2), 0.6 ** 2 + 2 * 0.6 ** 2 * 0.4)
+    assert series_win_prob(0.3, 0, 1) == 1.0
+    assert series_win_prob(0.9, 1, 0) == 0.0
+    assert np.isclose(series_win_prob(0.25, 1, 1), 0.25)
+
+
+def test_simulation_respects_playoff_state():
+    matches = [alliance_match('qf', 1, 1, 8, True), alliance_match('qf', 1, 8, 1, False),
+               alliance_match('qf', 2, 4, 5, False), alliance_match('qf', 2, 4, 5, True),
+               alliance_match('qf', 3, 2, 7, False)]
+    predictor = KnockoutPredictor(None, 8, make_elo(RATINGS), num_sims=20000, seed=0)
+    results = predictor.simulate_bracket_knockout(make_alliance_data(), matches)
+
+    by_first_team = {teams[0]: through for teams, through in results}
+    assert by_first_team['frc1']['qf'] == 1.0
+    assert by_first_team['frc22']['qf'] == 0.0
+    assert 0 < by_first_team['frc10']['qf'] < 1
+    assert by_first_team['frc19']['qf'] > 0.5
+    assert np.allclose(list(level_sums(results).values()), [4, 2, 1])
+    # results are sorted by chance of winning the event
+    assert [through['f'] for _, through in results] == \
+        sorted(through['f'] for _, through in results)
+
+
+def test_exact_matches_simulation():
+    matches = [alliance_match('qf', 1, 1, 8, False), alliance_match('qf', 3, 2, 7, True),
+               alliance_match('qf', 3, 2, 7, True), alliance_match('qf', 4, 3, 6, True)]
+    elo = make_elo(RATINGS)
+    for knockout_type, num_alliances in [(8, 8), (16, 16), (4, 4), ('BO5_FINALS', 2)]:
+        alliance_data = make_alliance_data(num_alliances)
+        exact = KnockoutPredictor(None, knockout_type, elo, exact=True).predict_bracket_knockout(
+            alliance_data, matches)
+        simulated = KnockoutPredictor(None, knockout_type, elo, num_sims=200000,
+                                      seed=1).predict_bracket_knockout(alliance_data, matches)
+
+        simulated_by_team = {teams[0]: through for teams, through in simulated}
+        for teams, exact_through in exact:
+            simulated_through = simulated_by_team[teams[0]]
+            assert list(exact_through) == list(simulated_through)
+            for level in exact_through:
+                # a few standard errors of a 200k sample
+                assert abs(exact_through[level] - simulated_through[level]) < 0.005
+        assert np.isclose(level_sums(exact)['f'], 1.0)
+
+
+def test_every_playoff_format():
+    elo = make_elo(RATINGS)
+    for knockout_type, playoff_format in PLAYOFF_FORMATS.items():
+        predictor = KnockoutPredictor(None, knockout_type, elo, num_sims=1000, seed=2)
+        results = predictor.predict_bracket_knockout(make_alliance_data(16))
+        assert len(results) == playoff_format.num_alliances
+        assert np.isclose(level_sums(results)[predictor.levels[-1]], 1.0)
+
+    predictor = KnockoutPredictor(None, 'DOUBLE_ELIM_8_TEAM', elo, num_sims=1000, seed=3)
+    sums = level_sums(predictor.predict_bracket_knockout(make_alliance_data()))
+    # alliances left after each round
+    assert np.allclose(list(sums.values()), [8, 6, 4, 3, 2, 1])
+
+
+def test_round_robin_state():
+    # alliance 6 has won all five of its round robin matches
+    matches = [alliance_match('sf', 1, 6, num, True) for num in range(1, 6)]
+    predictor = KnockoutPredictor(None, '6-team-round-robin', make_elo(RATINGS), num_sims=5000,
+                                  seed=4)
+    results = predictor.predict_bracket_knockout(make_alliance_data(6), matches)
+    by_first_team = {teams[0]: through for teams, through in results}
+    assert by_first_team['frc16']['rr'] == 1.0
+    assert np.allclose(list(level_sums(results).values()), [2, 1])
@@ -0,0 +1,39 @@
+from fixtures import make_elo, make_match
+from predict.prediction_cache import PredictionCache
+import numpy as np
+
+
+def test_invalidation():
+    elo = make_elo({team: 1300 + 10 * team for team in range(1, 13)})
+    matches = [make_match([1, 2, 3], [4, 5, 6]), make_match([7, 8, 9], [10, 11, 12])]
+    cache = elo.prediction_cache
+
+    first = elo.predict_many(matches)
+    assert (cache.hits, cache.misses) == (0, 2)
+    # teams listed in a different order are the same alliance
+    assert np.allclose(elo.predict_many([make_match([3, 2, 1], [6, 5, 4])]), first[:1])
+    assert elo.predict(matches[1]) == first[1]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # only the predictions involving the six teams that played are
+    # invalidated (the update itself uses the cached prediction)
+    elo.update(make_match([1, 2, 3], [4, 5, 6], 100, 20))
+    second = elo.predict_many(matches)
+    assert (cache.hits, cache.misses, cache.invalidations) == (4, 3, 1)
+    assert second[0] > first[0] and second[1] == first[1]
+
+    # uncached predictions are the same as they were before caching
+    elo.prediction_cache = PredictionCache()
+    assert np.allclose(elo.predict_many(matches), second)
+
+    elo.next_year(reversion_score=1500, reversion_factor=0.2, new_stdev=50)
+    assert elo.prediction_cache.stats()['size'] == 0
+
+
+def test_eviction():
+    cache = PredictionCache(max_size=2)
+    for i in range(3):
+        cache.put(((str(i),), ('x',)), (0, 0, 0), i / 10)
+    assert cache.stats()['evictions'] == 1
+    assert cache.get((('0',), ('x',)), (0, 0, 0)) is None
+    assert cache.get((('2',), ('x',)), (0, 0, 0)) == 0.2
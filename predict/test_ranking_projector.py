@@ -0,0 +1,24 @@
+from fixtures import make_elo, make_match
+from predict.ranking_projector import RankingProjector
+import numpy as np
+
+
+def test_projection():
+    # team 1 is far stronger than everyone else
+    elo = make_elo({1: 3000})
+    played = [make_match([1, 2, 3], [4, 5, 6], 100, 20),
+              make_match([1, 4, 5], [2, 3, 6], 50, 50, surrogates=[6])]
+    unplayed = [make_match([1, 5, 6], [2, 3, 4]), make_match([3, 4, 6], [1, 2, 5])]
+
+    projections = RankingProjector(elo, num_sims=2000, seed=0).project(played, unplayed)
+
+    assert list(projections)[0] == 'frc1'
+    assert projections['frc1']['ranking_points'] == 3
+    # surrogate appearances don't count
+    assert projections['frc6']['ranking_points'] == 0
+    assert projections['frc1']['mean_ranking_points'] > 6.9
+    assert projections['frc1']['seed_distribution'][0] > 0.9
+    assert np.isclose(sum(p['top_seed_prob'] for p in projections.values()), 6)
+    for projection in projections.values():
+        assert np.isclose(sum(projection['ranking_point_distribution'].values()), 1)
+        assert np.isclose(sum(projection['seed_distribution']), 1)
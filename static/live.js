@@ -0,0 +1,139 @@
+// Keeps an event page up to date with the deltas streamed by
+// util.live_updates.LiveUpdateServer, rather than reloading the page.
+(function () {
+    var script = document.getElementById('live-updates');
+    var seq = 0;
+    var state = {};
+
+    function cell(text, className) {
+        var td = document.createElement('td');
+        td.textContent = text;
+        if (className) {
+            td.className = className;
+        }
+        return td;
+    }
+
+    function row(cells) {
+        var tr = document.createElement('tr');
+        cells.forEach(function (td) { tr.appendChild(td); });
+        return tr;
+    }
+
+    function teams(alliance) {
+        return alliance.join(' ');
+    }
+
+    // replace every row of the table after the first numHeaderRows
+    function setRows(tableId, rows, numHeaderRows) {
+        var table = document.getElementById(tableId);
+        while (table.rows.length > numHeaderRows) {
+            table.deleteRow(numHeaderRows);
+        }
+        rows.forEach(function (tr) { table.appendChild(tr); });
+    }
+
+    function showCard(cardId, show) {
+        document.getElementById(cardId).hidden = !show;
+    }
+
+    function matchCells(match) {
+        return [cell(match.name), cell(teams(match.blue_alliance), 'blue'),
+                cell(match.blue_win_prob), cell(teams(match.red_alliance), 'red'),
+                cell(match.red_win_prob)];
+    }
+
+    var render = {
+        status: function (status) {
+            document.getElementById('event-status').textContent = status;
+        },
+        upcoming_matches: function (matches) {
+            setRows('upcoming-table', matches.map(function (match) {
+                return row(matchCells(match));
+            }), 1);
+            showCard('upcoming-card', matches.length > 0);
+        },
+        retrodictions: function (matches) {
+            setRows('retrodiction-table', matches.map(function (match) {
+                return row(matchCells(match).concat(
+                    [cell(match.predicted_margin), cell(match.actual_margin)]));
+            }), 1);
+            showCard('retrodiction-card', matches.length > 0);
+        },
+        rank_projections: function (projections) {
+            setRows('rankings-table', projections.map(function (team) {
+                return row([cell(team.team), cell(Math.floor(team.ranking_points)),
+                            cell(team.mean_ranking_points.toFixed(1)),
+                            cell(team.mean_seed.toFixed(1)), cell(team.top_seed_percent)]);
+            }), 1);
+            showCard('rankings-card', projections.length > 0);
+        },
+        finals: function (finals) {
+            var table = document.getElementById('knockout-table');
+            while (table.rows.length) {
+                table.deleteRow(0);
+            }
+            showCard('knockout-card', finals.in_progress);
+            if (!finals.in_progress) {
+                return;
+            }
+            var names;
+            if (finals.final_type === 'knockout') {
+                var heading = document.createElement('tr');
+                var alliance = document.createElement('th');
+                alliance.rowSpan = 2;
+                alliance.textContent = 'Alliance';
+                var chance = document.createElement('th');
+                chance.id = 'chance-win-text';
+                chance.colSpan = finals.rounds;
+                chance.textContent = 'Chance of winning';
+                heading.appendChild(alliance);
+                heading.appendChild(chance);
+                table.appendChild(heading);
+                names = finals.level_names;
+            } else {
+                names = ['Escape Round Robin', 'Win Finals'];
+            }
+            var levels = document.createElement('tr');
+            names.forEach(function (name) {
+                var th = document.createElement('th');
+                th.textContent = name;
+                levels.appendChild(th);
+            });
+            table.appendChild(levels);
+            finals.knockout_predictions.forEach(function (prediction) {
+                table.appendChild(row([cell(teams(prediction[0]))].concat(
+                    prediction.slice(1).map(function (percent) { return cell(percent); }))));
+            });
+        }
+    };
+
+    function apply(message) {
+        // deltas can be resent, but a full state (sent on connecting) is
+        // always applied, in case the server has restarted
+        if (message.seq <= seq && !message.full) {
+            return;
+        }
+        seq = message.seq;
+        var changed = Object.keys(message.set || {});
+        changed.forEach(function (key) { state[key] = message.set[key]; });
+        Object.keys(message.append || {}).forEach(function (key) {
+            var append = message.append[key];
+            state[key] = (state[key] || []).slice(0, append.start).concat(append.items);
+            changed.push(key);
+        });
+        changed.forEach(function (key) {
+            if (render[key] && state[key] !== undefined) {
+                render[key](state[key]);
+            }
+        });
+    }
+
+    // the server starts by sending the full state, which the deltas apply to
+    var url = location.protocol + '//' + location.hostname + ':' + script.dataset.port +
+        '/events/' + script.dataset.event + '/stream';
+    var source = new EventSource(url);
+    source.onmessage = function (e) {
+        apply(JSON.parse(e.data));
+    };
+}());
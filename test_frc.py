@@ -0,0 +1,33 @@
+from fixtures import LocalTBA, make_frc, make_match
+
+# events sharing teams, so the ratings depend on the order they're processed
+EVENT_MATCHES = {
+    '2017slow': [make_match([1, 2, 3], [4, 5, 6], 100, 20, match_number=1, event_code='2017slow'),
+                 make_match([1, 2, 3], [7, 8, 9], match_number=2, event_code='2017slow')],
+    '2017fail': [make_match([1, 4, 7], [2, 5, 8], 30, 60, match_number=1, event_code='2017fail')],
+    '2017fast': [make_match([1, 5, 9], [2, 4, 6], 40, 90, match_number=1, event_code='2017fast'),
+                 make_match([3, 5, 9], [2, 4, 6], match_number=2, event_code='2017fast')],
+}
+
+
+def test_refresh_events():
+    frc = make_frc(LocalTBA(EVENT_MATCHES, fail=['2017fail'], slow=['2017slow']))
+    processed = []
+    for event in frc.events.values():
+        def process_event_data(event_data, event=event, process=event.process_event_data):
+            processed.append(event.event_code)
+            process(event_data)
+        event.process_event_data = process_event_data
+
+    timings = frc.refresh_events(list(frc.events.values()))
+    # processed in the order given, though the first finished fetching last
+    assert processed == ['2017slow', '2017fast']
+    assert (timings['events'], timings['failed']) == (2, 1)
+    assert frc.events['2017fail'].event_dict is None
+    assert frc.events['2017fail'].fetch_failures == 1
+
+    # the same ratings as refreshing each event in turn
+    serial = make_frc(LocalTBA(EVENT_MATCHES))
+    serial.events['2017slow'].update_event_status()
+    serial.events['2017fast'].update_event_status()
+    assert frc.elo.elo == serial.elo.elo
@@ -0,0 +1,246 @@
+from fixtures import EVENT_CODE, LocalTBA, make_event, make_match
+from util.event import Event, EventData
+from util.poll_scheduler import PollScheduler
+from util.snapshots import SnapshotReader, SnapshotWriter
+from util.sqlite_store import SQLiteDataStore
+from web import create_app
+import copy
+import fixtures
+import gzip
+import hashlib
+import hmac
+import json
+import time
+
+
+def make_frc():
+    matches = [make_match([1, 2, 3], [4, 5, 6], 100, 50, match_number=1),
+               make_match([1, 2, 3], [4, 5, 6], match_number=2),
+               make_match([7, 8, 9], [10, 11, 12], match_number=3),
+               make_match([1, 8, 9], [10, 5, 6], match_number=4)]
+    frc = fixtures.make_frc(LocalTBA())
+    frc.events[EVENT_CODE] = make_event(matches, frc.elo, frc.tba_wrapper)
+    frc.scheduler.schedule(frc.events[EVENT_CODE])
+    frc.publish_snapshot()
+    return frc
+
+
+# as sent by TBA, which uses the older match format with 'teams'
+MATCH_SCORE = {
+    'message_type': 'match_score',
+    'message_data': {
+        'event_name': 'Test Regional', 'match_key': EVENT_CODE + '_qm2', 'event_key': EVENT_CODE,
+        'match': {'key': EVENT_CODE + '_qm2', 'comp_level': 'qm', 'set_number': 1,
+                  'match_number': 2, 'event_key': EVENT_CODE, 'time': None,
+                  'alliances': {'blue': {'teams': ['frc1', 'frc2', 'frc3'], 'score': 20},
+                                'red': {'teams': ['frc4', 'frc5', 'frc6'], 'score': 80}}}}}
+
+SCHEDULE_UPDATED = {
+    'message_type': 'schedule_updated',
+    'message_data': {'event_name': 'Test Regional', 'event_key': EVENT_CODE,
+                     'first_match_time': 1500000000}}
+
+
+def test_match_score():
+    frc = make_frc()
+    event = frc.events[EVENT_CODE]
+    client = create_app(frc).test_client()
+    rating_before = frc.elo.elo['frc1']
+    untouched_prediction = event.upcoming_matches[EVENT_CODE + '_qm3']
+
+    assert client.post('/tba-webhook', json=MATCH_SCORE).status_code == 200
+
+    assert EVENT_CODE + '_qm2' in event.processed_matches
+    assert frc.elo.elo['frc1'] < rating_before
+    assert list(event.upcoming_matches) == [EVENT_CODE + '_qm3', EVENT_CODE + '_qm4']
+    # only matches involving the teams that played are repriced
+    assert event.upcoming_matches[EVENT_CODE + '_qm3'] is untouched_prediction
+    assert [match['name'] for match in event.event_dict['retrodictions']] == \
+        ['Quals 1 Match 1', 'Quals 1 Match 2']
+    # polling backs off while TBA is pushing updates
+    assert frc.scheduler.receiving_pushes(EVENT_CODE, time.time())
+    assert frc.scheduler.next_due() >= time.time() + PollScheduler.PUSH_SAFETY_INTERVAL - 5
+
+    # and pushed to browsers watching the event
+    live_state = frc.live_updates.catch_up(EVENT_CODE)['set']
+    assert len(live_state['retrodictions']) == 2
+
+    # a repeated message doesn't update the ratings again
+    rating_after = frc.elo.elo['frc1']
+    client.post('/tba-webhook', json=MATCH_SCORE)
+    assert frc.elo.elo['frc1'] == rating_after
+
+
+def test_schedule_updated():
+    frc = make_frc()
+    client = create_app(frc).test_client()
+    assert client.post('/tba-webhook', json=SCHEDULE_UPDATED).status_code == 200
+    assert frc.scheduler.next_due() <= time.time()
+    assert frc.wake.is_set()
+    # the poll asks TBA, rather than reusing a response within its max-age
+    assert frc.tba_wrapper.expired == [EVENT_CODE]
+
+    # rescheduling once the poll that was already running finishes doesn't
+    # push the requested poll back
+    frc.scheduler.schedule(frc.events[EVENT_CODE])
+    assert frc.scheduler.next_due() <= time.time()
+
+
+def test_webhook_signature():
+    frc = make_frc()
+    client = create_app(frc, webhook_secret='secret').test_client()
+    body = json.dumps(SCHEDULE_UPDATED)
+    assert client.post('/tba-webhook', data=body,
+                       content_type='application/json').status_code == 401
+    signature = hmac.new(b'secret', body.encode(), hashlib.sha256).hexdigest()
+    assert client.post('/tba-webhook', data=body, content_type='application/json',
+                       headers={'X-TBA-HMAC': signature}).status_code == 200
+
+
+def test_event_page():
+    frc = make_frc()
+    page = create_app(frc, live_updates_port=5001).test_client().get('/event/' + EVENT_CODE)
+    assert page.status_code == 200
+    assert b'Quals 1 Match 2' in page.data
+    assert b'live.js' in page.data and b'data-port="5001"' in page.data
+
+
+def test_team_page(tmp_path):
+    match_store = SQLiteDataStore(str(tmp_path / 'matches.sqlite'), new_data_store=True,
+                                  year_events={2017: [EVENT_CODE]})
+    match_store.add_event_matches(2017, EVENT_CODE,
+                                  [make_match([1, 2, 3], [4, 5, 6], match_number=1)])
+    client = create_app(make_frc(), match_store=match_store).test_client()
+    assert client.get('/team/5').json == {'team': 5, 'events': {'2017': [EVENT_CODE]}}
+    assert client.get('/team/7').json == {'team': 7, 'events': {}}
+
+
+def test_snapshot_worker(tmp_path):
+    frc = make_frc()
+    frc.snapshot_writer = SnapshotWriter(str(tmp_path))
+    worker = create_app(None, snapshots=SnapshotReader(str(tmp_path))).test_client()
+    assert worker.get('/event/' + EVENT_CODE).status_code == 503
+
+    frc.publish_snapshot()
+    assert b'Quals 1 Match 2' in worker.get('/event/' + EVENT_CODE).data
+    assert b'Test Regional' in worker.get('/').data
+    assert worker.get('/event/2017none').status_code == 404
+    assert worker.post('/tba-webhook', json=MATCH_SCORE).status_code == 404
+
+    # webhooks applied by the ingestion process show up in the next snapshot
+    create_app(frc).test_client().post('/tba-webhook', json=MATCH_SCORE)
+    snapshot = SnapshotReader(str(tmp_path)).current()
+    assert [match['name'] for match in snapshot.event(EVENT_CODE)['retrodictions']] == \
+        ['Quals 1 Match 1', 'Quals 1 Match 2']
+
+
+def test_requests_read_snapshots():
+    frc = make_frc()
+    client = create_app(frc).test_client()
+    before = frc.current_snapshot()
+    client.post('/tba-webhook', json=MATCH_SCORE)
+
+    after = frc.current_snapshot()
+    assert after is not before
+    # a request still holding the old snapshot sees it as it was
+    assert len(before.event(EVENT_CODE)['retrodictions']) == 1
+    assert len(after.event(EVENT_CODE)['retrodictions']) == 2
+    assert after.ratings()['frc1'] == frc.elo.elo['frc1'] != before.ratings()['frc1']
+    assert client.get('/event/' + EVENT_CODE).status_code == 200
+
+
+def test_page_cache():
+    frc = make_frc()
+    app = create_app(frc)
+    client = app.test_client()
+
+    page = client.get('/event/' + EVENT_CODE, headers={'Accept-Encoding': 'gzip'})
+    assert page.headers['Content-Encoding'] == 'gzip'
+    assert b'Quals 1 Match 2' in gzip.decompress(page.data)
+    etag = page.headers['ETag']
+    plain = client.get('/event/' + EVENT_CODE)
+    assert 'Content-Encoding' not in plain.headers and plain.headers['ETag'] != etag
+    assert client.get('/api/event/' + EVENT_CODE).json['name'] == 'Test Regional'
+
+    # unchanged, so served from the cache, or not at all if the client has it
+    again = client.get('/event/' + EVENT_CODE,
+                       headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert again.status_code == 304 and again.headers['ETag'] == etag
+    client.get('/')
+    client.get('/')
+    stats = app.response_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (3, 3, 3)
+
+    # a new snapshot with only the ratings changed doesn't invalidate anything
+    frc.publish_snapshot()
+    assert client.get('/event/' + EVENT_CODE, headers={'If-None-Match': plain.headers['ETag']}
+                      ).status_code == 304
+
+    # once the event changes, its pages are rendered again
+    client.post('/tba-webhook', json=MATCH_SCORE)
+    changed = client.get('/event/' + EVENT_CODE,
+                         headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert app.response_cache.stats()['invalidations'] == 1
+    assert client.get('/event/2017none').status_code == 404
+
+
+def test_unfetched_event():
+    frc = make_frc()
+    # an event whose first fetch failed
+    unfetched = Event('2017fail', frc.elo, frc.tba_wrapper, refresh=False)
+    frc.events['2017fail'] = unfetched
+    frc.scheduler.schedule(unfetched)
+    frc.publish_snapshot()
+    client = create_app(frc).test_client()
+
+    assert frc.current_snapshot().event_codes == [EVENT_CODE]
+    assert b'Test Regional' in client.get('/').data
+    assert client.get('/event/2017fail').status_code == 404
+    match_score = json.loads(json.dumps(MATCH_SCORE))
+    match_score['message_data']['event_key'] = '2017fail'
+    match_score['message_data']['match']['event_key'] = '2017fail'
+    assert client.post('/tba-webhook', json=match_score).status_code == 200
+    assert not frc.live_updates.has_event('2017fail')
+
+
+def test_unchanged_refresh_keeps_etag():
+    frc = make_frc()
+    app = create_app(frc)
+    client = app.test_client()
+    etag = client.get('/event/' + EVENT_CODE).headers['ETag']
+    index_etag = client.get('/').headers['ETag']
+    version = frc.current_snapshot().event_version(EVENT_CODE)
+
+    # polled again, with TBA sending the same data back (once in full, once
+    # as a 304)
+    event = frc.events[EVENT_CODE]
+    for matches_changed in [True, False]:
+        event.process_event_data(EventData(copy.deepcopy(event.event_response), True,
+                                           copy.deepcopy(event.matches), matches_changed, None))
+        frc.publish_snapshot()
+    assert frc.current_snapshot().event_version(EVENT_CODE) == version
+    assert client.get('/event/' + EVENT_CODE, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/', headers={'If-None-Match': index_etag}).status_code == 304
+    assert app.response_cache.stats()['invalidations'] == 0
+
+
+def test_unchanged_poll_keeps_webhook_matches():
+    frc = make_frc()
+    event = frc.events[EVENT_CODE]
+    fetched_matches = event.matches
+    client = create_app(frc).test_client()
+    client.post('/tba-webhook', json=MATCH_SCORE)
+
+    # polled, with TBA still sending the matches from before the webhook
+    event.update_matches(fetched_matches, matches_changed=False)
+    assert EVENT_CODE + '_qm2' not in event.upcoming_matches
+
+    match_score = json.loads(json.dumps(MATCH_SCORE))
+    match = match_score['message_data']['match']
+    match['key'] = match_score['message_data']['match_key'] = EVENT_CODE + '_qm3'
+    match['match_number'] = 3
+    client.post('/tba-webhook', json=match_score)
+    assert list(event.upcoming_matches) == [EVENT_CODE + '_qm4']
+    assert event.first_unplayed == 3
+    assert len(event.retrodictions) == 3
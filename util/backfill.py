@@ -0,0 +1,153 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from util.data_store import DataStore
+from util.request_scheduler import Priority
+import json
+import os
+import requests
+import time
+
+
+class Backfill():
+    """Fills a fresh data store with the matches of past seasons from TBA.
+
+    Requests are made from a pool of max_workers threads at backfill
+    priority, so they're rate limited by the wrapper's RequestScheduler and
+    never hold up requests for current events. Each event's matches are
+    added to the data store as soon as they arrive, so nothing fetched is
+    lost if the backfill is interrupted.
+
+    Only events that have finished are fetched. Events still to come or
+    being played are left as None, so BlueAllianceWrapper.get_event_matches
+    keeps asking TBA for them, and they're cached once they finish (see
+    Event.update_matches).
+
+    The data store itself records which events have been fetched (their
+    matches are no longer None), so the only other state is a checkpoint
+    file saying a backfill of these years has started, and which of their
+    events hadn't finished. Running a backfill
+    again with the checkpoint there resumes it, fetching only the events
+    still missing. Once every event has been fetched, the data store is
+    marked as complete (see BlueAllianceWrapper.cache_trusted) and the
+    checkpoint removed.
+    """
+
+    CHECKPOINT_FILE = 'backfill.json'
+    # events between progress reports
+    REPORT_INTERVAL = 100
+
+    def __init__(self, tba_wrapper, years, metadata_years=[], max_workers=8):
+        """
+        Args:
+            tba_wrapper: The BlueAllianceWrapper to fetch with. Its
+            cache_directory is where the data store is created.
+            years: The years to backfill.
+            metadata_years: Passed on to the DataStore.
+            max_workers: Most requests in flight at once.
+        """
+        self.tba_wrapper = tba_wrapper
+        self.years = list(years)
+        self.metadata_years = metadata_years
+        self.max_workers = max_workers
+        self.checkpoint_file = os.path.join(tba_wrapper.cache_directory, self.CHECKPOINT_FILE)
+        # codes of the events that hadn't finished when the backfill started
+        self.unfinished = set()
+        self.stats = {'events': 0, 'matches': 0, 'failed': 0, 'skipped': 0,
+                      'unfinished': 0, 'requests': 0, 'time': 0.0}
+
+    def fetch(self, request_url):
+        return self.tba_wrapper.fetch_json(request_url, priority=Priority.BACKFILL)
+
+    def fetch_year_events(self, year):
+        events = self.fetch('%s/events/%s' % (self.tba_wrapper.api_url, year))
+        return sorted(events, key=lambda x: x['start_date'])
+
+    def fetch_event_matches(self, event_code):
+        matches = self.fetch('%s/event/%s/matches' % (self.tba_wrapper.api_url, event_code))
+        return self.tba_wrapper.sort_by_match_number(matches)
+
+    def open_data_store(self, executor):
+        """ The data store to fill: the one a previous run started, or a new
+        one with the events of each year. """
+        cache_directory = self.tba_wrapper.cache_directory
+        if os.path.isfile(self.checkpoint_file):
+            with open(self.checkpoint_file, 'r') as checkpoint:
+                state = json.load(checkpoint)
+            if state['years'] == self.years:
+                print('Resuming backfill')
+                self.unfinished = set(state.get('unfinished', []))
+                return DataStore(cache_directory=cache_directory,
+                                 metadata_years=self.metadata_years)
+
+        print('Fetching the events of %s years' % len(self.years))
+        year_events = {}
+        # TBA's end dates are the last day of the event
+        today = time.strftime('%Y-%m-%d', time.gmtime())
+        for year, events in zip(self.years, executor.map(self.fetch_year_events, self.years)):
+            year_events[year] = [event['key'] for event in events]
+            self.unfinished.update(event['key'] for event in events
+                                   if event['end_date'] >= today)
+        self.stats['requests'] += len(self.years)
+        data_store = DataStore(cache_directory=cache_directory, new_data_store=True,
+                               year_events=year_events, metadata_years=self.metadata_years)
+        # written only once the new data store is, so a resumed run never
+        # uses a partly written one
+        with open(self.checkpoint_file + '.tmp', 'w') as checkpoint:
+            json.dump({'years': self.years, 'unfinished': sorted(self.unfinished)},
+                      checkpoint)
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+        return data_store
+
+    def run(self):
+        """ Fetch every event not yet in the data store.
+        Returns:
+            The data store.
+        """
+        start = time.monotonic()
+        os.makedirs(self.tba_wrapper.cache_directory, exist_ok=True)
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix='backfill') as executor:
+            data_store = self.open_data_store(executor)
+            pending = []
+            for year in self.years:
+                for event_code, matches in data_store.data[year].items():
+                    if event_code in self.unfinished:
+                        self.stats['unfinished'] += 1
+                    elif matches is None:
+                        pending.append((year, event_code))
+                    else:
+                        self.stats['skipped'] += 1
+            print('Backfilling %s events (%s already fetched, %s not finished)'
+                  % (len(pending), self.stats['skipped'], self.stats['unfinished']))
+
+            futures = {executor.submit(self.fetch_event_matches, event_code): (year, event_code)
+                       for year, event_code in pending}
+            for future in as_completed(futures):
+                year, event_code = futures[future]
+                self.stats['requests'] += 1
+                try:
+                    matches = future.result()
+                except requests.RequestException as e:
+                    # left as None, so it's tried again when resuming
+                    print('Failed to fetch %s: %s' % (event_code, e))
+                    self.stats['failed'] += 1
+                    continue
+                # only this thread writes to the data store
+                data_store.add_event_matches(year, event_code, matches)
+                self.stats['events'] += 1
+                self.stats['matches'] += len(matches)
+                if self.stats['events'] % self.REPORT_INTERVAL == 0:
+                    self.report(start)
+
+        self.stats['time'] = time.monotonic() - start
+        self.report(start)
+        if not self.stats['failed']:
+            self.tba_wrapper.mark_cache_trusted()
+            os.remove(self.checkpoint_file)
+        return data_store
+
+    def report(self, start):
+        elapsed = max(time.monotonic() - start, 1e-9)
+        print('Backfilled %s events, %s matches (%s failed) in %.1fs: %.1f events/s, '
+              '%.0f matches/s' % (self.stats['events'], self.stats['matches'],
+                                  self.stats['failed'], elapsed,
+                                  self.stats['events'] / elapsed,
+                                  self.stats['matches'] / elapsed))
@@ -1,21 +1,137 @@
 import pickle
 import glob
 import logging
+import threading
+import time
 
 from collections import OrderedDict
+from collections.abc import Mapping
 from typing import Dict, List
 
+from util.match_archive import MatchArchive
+
 import os.path
 
 
+class LazyYears(Mapping):
+    """Maps each year to its data, loading years the first time they're used.
+
+    At most max_resident years are kept loaded, and the least recently used
+    year is dropped to make room for another. DataStore writes every change
+    to disk as it's made, so a dropped year can always be loaded again.
+
+    Events are fetched from several threads at once, so every access holds
+    a lock: even reads move years in the LRU order, and a year being loaded
+    is only loaded once.
+    """
+
+    def __init__(self, years, load, max_resident=None, size=None):
+        """ Args:
+            years: The years there is data for, in order.
+            load: Function of a year that loads its data.
+            max_resident: Most years to keep loaded, or None for no limit.
+            size: Function of a year giving the bytes its data was loaded
+            from, as an estimate of the memory it takes.
+        """
+        self.years = list(years)
+        self.load = load
+        self.max_resident = max_resident
+        self.size = size
+        # year -> data, least recently used first
+        self.resident = OrderedDict()
+        # year -> estimated size of the loaded data
+        self.resident_sizes = {}
+        self.loads = 0
+        self.load_time = 0
+        self.evictions = 0
+        # reentrant, as __getitem__ calls put
+        self.lock = threading.RLock()
+
+    def __getitem__(self, year):
+        with self.lock:
+            value = self.resident.get(year)
+            if value is not None:
+                self.resident.move_to_end(year)
+                return value
+            if year not in self.years:
+                raise KeyError(year)
+            start = time.perf_counter()
+            value = self.load(year)
+            self.load_time += time.perf_counter() - start
+            self.loads += 1
+            self.put(year, value)
+            return value
+
+    def peek(self, year):
+        """ year's data if it's loaded, else None, without loading it or
+        changing the LRU order. """
+        with self.lock:
+            return self.resident.get(year)
+
+    def put(self, year, value):
+        """ Make value the loaded data for year. """
+        with self.lock:
+            if year not in self.years:
+                self.years = sorted(self.years + [year])
+            self.resident[year] = value
+            self.resident.move_to_end(year)
+            self.resident_sizes[year] = self.size(year) if self.size is not None else 0
+            while self.max_resident is not None and len(self.resident) > self.max_resident:
+                evicted, _ = self.resident.popitem(last=False)
+                del self.resident_sizes[evicted]
+                self.evictions += 1
+
+    def __contains__(self, year):
+        return year in self.years
+
+    def __iter__(self):
+        return iter(list(self.years))
+
+    def __len__(self):
+        return len(self.years)
+
+    def __repr__(self):
+        with self.lock:
+            return 'LazyYears(%s, resident=%s)' % (self.years, list(self.resident))
+
+    def stats(self):
+        with self.lock:
+            return {'years': len(self.years), 'resident': list(self.resident),
+                    'resident_bytes': sum(self.resident_sizes.values()),
+                    'loads': self.loads, 'load_time': self.load_time,
+                    'evictions': self.evictions}
+
+
 class DataStore(object):
+    """Stores matches and metadata for each event, a file per year.
+
+    Each year has a base file (an OrderedDict of event code -> data), plus
+    any events added since the base file was written. Adding an event writes
+    just that event to its own segment file, and then appends a line naming
+    the segment to the year's index file, so adding an event costs the size
+    of the event rather than the year, and a crash can't corrupt data that
+    was already stored. compact() folds a year's segments back into its base
+    file, so the year loads with a single read.
+
+    Years are only loaded when they're first used (see LazyYears), and at
+    most max_resident_years of each kind of data are kept in memory.
+    """
 
     CACHE_FILE_EXTENSION = '-event_matches.p'
     METADATA_FILE_EXTENSION = '-event_metadata.p'
+    INDEX_FILE_EXTENSION = '-index.txt'
+    ARCHIVE_DIRECTORY_EXTENSION = '-match_archive'
+    SEGMENT_DIRECTORY_EXTENSION = '-segments'
+    # kinds of data, and the extension of their base files
+    KIND_EXTENSIONS = {'matches': CACHE_FILE_EXTENSION,
+                       'metadata': METADATA_FILE_EXTENSION}
+    # years with more segments than this are compacted when an event is added
+    COMPACT_THRESHOLD = 64
+    MAX_RESIDENT_YEARS = 3
 
     def __init__(self, cache_directory: str='cache',
                  new_data_store: bool=False, year_events: Dict[int, list]={},
-                 metadata_years: List[int]=[]):
+                 metadata_years: List[int]=[], max_resident_years: int = None):
         """Initialise the DataStore class.
         Args:
             cache_directory: Path to directory the data store's cache files
@@ -27,58 +143,82 @@ class DataStore(object):
             dictionary correspond to the years we will be storing matches for,
             and the values the events within those years. List of events must
             be ordered by start date (ie in chronological order).
+            metadata_years: The years to store event metadata for.
+            max_resident_years: Most years of matches (and of metadata) to
+            keep loaded at once. Defaults to MAX_RESIDENT_YEARS.
         """
 
         self.cache_directory = cache_directory.rstrip('/')
+        if max_resident_years is None:
+            max_resident_years = self.MAX_RESIDENT_YEARS
 
         if new_data_store:
-            year_odicts = [(year, OrderedDict(
-                [(event_code, None) for event_code in events]))
-                for year, events in year_events.items()]
-            self.data = OrderedDict(sorted(year_odicts,
-                                           key=lambda x: x[0]))
-
-            # write the data to disk
-            for year, year_odict in self.data.items():
+            self.data = LazyYears(sorted(year_events), self.load_matches,
+                                  max_resident_years, self.matches_size)
+
+            # write the data to disk, replacing anything added to the old data
+            # store
+            for year in sorted(year_events):
+                year_odict = OrderedDict(
+                    [(event_code, None) for event_code in year_events[year]])
                 self.write_cache(year, year_odict)
+                if os.path.isfile(self.index_file(year)):
+                    os.remove(self.index_file(year))
+                self.data.put(year, year_odict)
         else:
-            self.data = OrderedDict()
-
             # Find the data files. Must be of the form:
             # <year>-event_matches.p
             cache_file_pattern = ''.join([self.cache_directory, '/',
                                           '????',  # match year
                                           self.CACHE_FILE_EXTENSION])
             cache_files = glob.glob(cache_file_pattern)
+            # years with only events added since
+            cache_files += glob.glob(''.join([self.cache_directory, '/', '????',
+                                              self.INDEX_FILE_EXTENSION]))
 
             # Sort cache files by year
             def get_year(cache_fname): return int(
-                    cache_fname.lstrip(self.cache_directory+'/')[:4])
-            cache_files = sorted(cache_files, key=get_year)
-
-            #
-            for fname in cache_files:
-                year_odict = pickle.load(open(fname, 'rb'))
-                year = get_year(fname)
-                self.data[year] = year_odict
+                    os.path.basename(cache_fname)[:4])
+            years = sorted(set(get_year(fname) for fname in cache_files))
+            self.data = LazyYears(years, self.load_matches, max_resident_years,
+                                  self.matches_size)
 
         if metadata_years:
-            self.metadata = OrderedDict()
-            for year in metadata_years:
-                year_file = ''.join([self.cache_directory, '/',
-                                     str(year), self.METADATA_FILE_EXTENSION])
-                if os.path.isfile(year_file):
-                    year_meta_odict = pickle.load(open(year_file, 'rb'))
-                    self.metadata[year] = year_meta_odict
-                else:
-                    self.metadata[year] = OrderedDict()
+            self.metadata = LazyYears(metadata_years, self.load_metadata,
+                                      max_resident_years, self.metadata_size)
         else:
             self.metadata = None
         print(self.metadata)
 
+    def load_matches(self, year: int) -> OrderedDict:
+        return self.load_year(year, 'matches')
+
+    def load_metadata(self, year: int) -> OrderedDict:
+        return self.load_year(year, 'metadata')
+
+    def matches_size(self, year: int) -> int:
+        return self.year_size(year, 'matches')
+
+    def metadata_size(self, year: int) -> int:
+        return self.year_size(year, 'metadata')
+
+    def year_size(self, year: int, kind: str) -> int:
+        """ Bytes of pickled data load_year reads for year and kind. """
+        paths = [self.cache_file(year, self.KIND_EXTENSIONS[kind])]
+        paths += [os.path.join(self.segment_directory(year), segment_name)
+                  for segment_kind, _, segment_name in self.read_index(year)
+                  if segment_kind == kind]
+        return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+    def stats(self) -> Dict:
+        """ Counts of year loads and evictions, the time spent loading, and
+        which years are loaded, for matches and metadata. """
+        return {'matches': self.data.stats(),
+                'metadata': self.metadata.stats() if self.metadata is not None else None}
+
     def add_event_metadata(self, year: int, event_code: str, data: Dict):
         self.metadata[year][event_code] = data
-        self.write_cache(year, self.metadata[year], self.METADATA_FILE_EXTENSION)
+        self.write_segment(year, 'metadata', event_code, data)
 
     def add_event_matches(self, year: int, event_code: str, matches: List):
         """ Add matches to our data store.
@@ -97,7 +237,7 @@ class DataStore(object):
                             % (event_code, year))
         print("Year %s event_code %s" % (year, event_code))
         self.data[year][event_code] = matches
-        self.write_cache(year, self.data[year])
+        self.write_segment(year, 'matches', event_code, matches)
 
     def get_year_events(self, year: int) -> List[str]:
         """ Get the list of event codes for a year from the data store.
@@ -122,17 +262,192 @@ class DataStore(object):
         # been added to this event.
         return [] if event_match_data is None else event_match_data
 
+    def iter_year_events(self, year: int):
+        """ Stream year's matches an event at a time, in chronological order,
+        without keeping the year loaded (unless it already is).
+        Yields:
+            (event code, list of matches), with `[]` for events with no
+            matches added.
+        """
+        year_events = self.data.peek(year)
+        if year_events is None:
+            year_events = self.load_year(year, 'matches')
+        for event_code, matches in year_events.items():
+            yield event_code, [] if matches is None else matches
+
+    def iter_events(self, years: List[int] = None):
+        """ Stream the matches of years (by default all of them) an event at
+        a time, in chronological order.
+        Yields:
+            (year, event code, list of matches)
+        """
+        for year in list(self.data) if years is None else years:
+            for event_code, matches in self.iter_year_events(year):
+                yield year, event_code, matches
+
     def get_event_metadata(self, event_year: int, event_code: str) -> Dict:
         if event_code in self.metadata[event_year].keys():
             return self.metadata[event_year][event_code]
         return None
 
-    def write_cache(self, year: int, value, file_extension=None):
-        """ Write value to the cache for year. """
+    def year_fingerprint(self, year: int) -> str:
+        """ Get a cheap fingerprint of the cached matches for year.
+        The fingerprint changes whenever the year's cache file is rewritten,
+        so it can be used to tell if anything derived from that year's matches
+        is stale without loading them.
+        Returns:
+            A string identifying the current version of the year's cache file,
+            or None if there is no cache file for the year.
+        """
+        cache_file = self.cache_file(year)
+        if not os.path.isfile(cache_file):
+            return None
+        stats = [os.stat(cache_file)]
+        # events added since the base file was written
+        if os.path.isfile(self.index_file(year)):
+            stats.append(os.stat(self.index_file(year)))
+        return '-'.join('%s-%s' % (stat.st_size, stat.st_mtime_ns) for stat in stats)
 
+    def cache_file(self, year: int, file_extension=None) -> str:
+        """ Path of the cache file for year. """
         if file_extension is None:
             file_extension = self.CACHE_FILE_EXTENSION
-        cache_file = ''.join([self.cache_directory, '/', str(year),
-                              file_extension])
+        return ''.join([self.cache_directory, '/', str(year), file_extension])
+
+    def archive_directory(self, year: int) -> str:
+        return self.cache_file(year, self.ARCHIVE_DIRECTORY_EXTENSION)
+
+    def get_year_archive(self, year: int):
+        """ Get the columnar MatchArchive of year's matches, if there is one
+        that's up to date with the stored matches.
+        Returns:
+            The memory mapped MatchArchive, or None.
+        """
+        fingerprint = self.year_fingerprint(year)
+        if fingerprint is None:
+            return None
+        archive = MatchArchive.load(self.archive_directory(year))
+        if archive is None or archive.source_fingerprint != fingerprint:
+            return None
+        return archive
+
+    def write_year_archive(self, year: int):
+        """ Convert year's stored matches to a MatchArchive, replacing any
+        existing archive.
+        Returns:
+            The new archive, memory mapped.
+        """
+        archive = MatchArchive.from_year_events(self.data[year], self.year_fingerprint(year))
+        archive.save(self.archive_directory(year))
+        return MatchArchive.load(self.archive_directory(year))
+
+    def index_file(self, year: int) -> str:
+        """ Path of the index of the segments added to year. """
+        return self.cache_file(year, self.INDEX_FILE_EXTENSION)
+
+    def segment_directory(self, year: int) -> str:
+        return self.cache_file(year, self.SEGMENT_DIRECTORY_EXTENSION)
+
+    def read_index(self, year: int) -> List:
+        """ The (kind, event code, segment file name) of each segment added to
+        year, oldest first. """
+        if not os.path.isfile(self.index_file(year)):
+            return []
+        entries = []
+        with open(self.index_file(year), 'r') as index:
+            for line in index:
+                # a line without a newline was cut off by a crash while it was
+                # being written, so its segment was never added
+                if not line.endswith('\n'):
+                    break
+                entry = tuple(line.rstrip('\n').split('\t'))
+                if len(entry) == 3:
+                    entries.append(entry)
+        return entries
+
+    def repair_index(self, year: int):
+        """ Remove a line cut off by a crash from the end of year's index
+        file, so the next line isn't appended onto it. """
+        index_file = self.index_file(year)
+        if not os.path.isfile(index_file):
+            return
+        with open(index_file, 'rb+') as index:
+            index.seek(0, os.SEEK_END)
+            size = index.tell()
+            if size == 0:
+                return
+            index.seek(size - 1)
+            if index.read(1) == b'\n':
+                return
+            index.seek(0)
+            contents = index.read()
+            index.truncate(contents.rfind(b'\n') + 1)
+
+    def load_year(self, year: int, kind: str) -> OrderedDict:
+        """ Load the kind ('matches' or 'metadata') of data stored for year:
+        the base file, updated with any segments added since. """
+        base_file = self.cache_file(year, self.KIND_EXTENSIONS[kind])
+        if os.path.isfile(base_file):
+            with open(base_file, 'rb') as base:
+                year_odict = pickle.load(base)
+        else:
+            year_odict = OrderedDict()
+        for segment_kind, event_code, segment_name in self.read_index(year):
+            if segment_kind == kind:
+                segment_file = os.path.join(self.segment_directory(year), segment_name)
+                with open(segment_file, 'rb') as segment:
+                    year_odict[event_code] = pickle.load(segment)
+        return year_odict
+
+    def write_segment(self, year: int, kind: str, event_code: str, value):
+        """ Store value as the kind of data for event_code, without rewriting
+        the rest of the year. """
+        segment_directory = self.segment_directory(year)
+        os.makedirs(segment_directory, exist_ok=True)
+        segment_name = '%s-%s-%s.p' % (event_code, kind, time.time_ns())
+        self.write_file(os.path.join(segment_directory, segment_name), value)
+
+        # the segment only counts once it's in the index
+        self.repair_index(year)
+        with open(self.index_file(year), 'a') as index:
+            index.write('%s\t%s\t%s\n' % (kind, event_code, segment_name))
+            index.flush()
+            os.fsync(index.fileno())
+
+        if len(self.read_index(year)) > self.COMPACT_THRESHOLD:
+            self.compact(year)
+
+    def compact(self, year: int):
+        """ Fold the segments added to year into its base files, so it loads
+        with one read per base file. """
+        entries = self.read_index(year)
+        if not entries:
+            return
+        for kind, file_extension in self.KIND_EXTENSIONS.items():
+            if any(entry[0] == kind for entry in entries):
+                self.write_cache(year, self.load_year(year, kind), file_extension)
+        # if this is interrupted, the segments are just applied again on top of
+        # the base files that already include them
+        os.remove(self.index_file(year))
+        for _, _, segment_name in entries:
+            segment_file = os.path.join(self.segment_directory(year), segment_name)
+            if os.path.isfile(segment_file):
+                os.remove(segment_file)
+
+    def write_cache(self, year: int, value, file_extension=None):
+        """ Replace the base file for year with value. """
+
+        cache_file = self.cache_file(year, file_extension)
         print("Cache file %s" % cache_file)
-        pickle.dump(value, open(cache_file, 'wb'))
+        self.write_file(cache_file, value)
+
+    @staticmethod
+    def write_file(path: str, value):
+        """ Pickle value to path atomically, so path always holds either the
+        old or the new value. """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as tmp_file:
+            pickle.dump(value, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
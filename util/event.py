@@ -1,9 +1,18 @@
 from datetime import datetime, timedelta
 from pytz import timezone, utc
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from predict.knockout_predictor import KnockoutPredictor
+from predict.ranking_projector import RankingProjector
+from util.request_scheduler import Priority
 
 import time
 
+# Everything Event fetches from TBA in one refresh, so that fetching (which
+# is slow, but safe to do for many events at once) can be done separately
+# from processing (which updates the shared ratings).
+EventData = namedtuple('EventData', ['event_response', 'event_changed', 'matches',
+                                     'matches_changed', 'alliance_data'])
+
 
 class Event:
     """Used to represent an individual event. Stores status information,
@@ -38,7 +47,12 @@ class Event:
         "f": "Finals",
     }
 
-    def __init__(self, event_code, elo, tba_wrapper):
+    def __init__(self, event_code, elo, tba_wrapper, refresh=True):
+        """
+        :param refresh: If False, don't fetch the event's data yet. It must
+        be refreshed (see fetch_event_data and process_event_data) before
+        it is used.
+        """
         self.event_code = event_code
         self.elo = elo
         self.tba_wrapper = tba_wrapper
@@ -47,24 +61,100 @@ class Event:
         self.processed_matches = set()
         self.played_matches = set()
         self.retrodictions = []
-        self.upcoming_matches = []
-
-        self.update_event_status()
-        if self.status == self.States.FINISHED and not self.tba_wrapper.is_cached(self.event_code):
-            print("Caching %s" % self.event_code)
-            self.tba_wrapper.cache_matches(self.event_code,
-                                           self.matches,
-                                           event_metadata=self.event_response)
+        # OrderedDict of match key -> prediction dict
+        self.upcoming_matches = OrderedDict()
+        self.matches = []
+        self.alliance_data = None
+        # match key -> fingerprint of the match as last processed, so only new
+        # or changed matches are processed again
+        self.match_fingerprints = {}
+        self.match_played = {}
+        # index in self.matches of the first unplayed match
+        self.first_unplayed = 0
+        # match key -> the rating versions (and stdev) its upcoming
+        # prediction used
+        self.prediction_ratings = {}
+        # None until the event has been fetched successfully
+        self.event_dict = None
+        # failed fetches since the last successful one
+        self.fetch_failures = 0
+
+        if refresh:
+            self.update_event_status()
 
     def update_event_status(self):
-        update_status = (time.time()-self.last_status_tm) >= 180
-        if not update_status:
-            return
-        last_in_progress = self.in_progress
+        """ Fetch and process the event's latest data. How often this is
+        needed is decided by util.poll_scheduler.PollScheduler. """
+        self.process_event_data(self.fetch_event_data())
+
+    def fetch_event_data(self):
+        """ Fetch everything needed to refresh the event from TBA. Doesn't
+        change the event, so is safe to call from another thread.
+        Returns:
+            An EventData to pass to process_event_data.
+        """
         # TODO: handle exceptions in the following (ie if no response)
         print("Fetching metadata for %s" % (self.event_code))
-        self.event_response = self.tba_wrapper.get_raw_event(self.event_code)
-        self.parse_event_response()
+        priority = self.request_priority()
+        event_response, event_changed = self.tba_wrapper.get_raw_event(
+            self.event_code, return_changed=True, priority=priority)
+        matches, matches_changed = self.get_matches(priority)
+        alliance_data = None
+        if self.status == Event.States.FINAL_MATCHES:
+            alliance_data = self.tba_wrapper.fetch_alliance_data(self.event_code)
+        return EventData(event_response, event_changed, matches, matches_changed,
+                         alliance_data)
+
+    def request_priority(self):
+        """ The Priority of requests to TBA for this event: live while its
+        matches are being played. """
+        if self.status in (Event.States.QUALIFICATION_MATCHES, Event.States.FINAL_MATCHES):
+            return Priority.LIVE
+        return Priority.NEAR_TERM
+
+    def process_event_data(self, event_data):
+        """ Update the event, its predictions and the Elo ratings from data
+        fetched by fetch_event_data. """
+        self.fetch_failures = 0
+        self.event_response = event_data.event_response
+        if event_data.event_changed:
+            self.parse_event_response()
+        if event_data.alliance_data is not None:
+            self.alliance_data = event_data.alliance_data
+        self.update_matches(event_data.matches, event_data.matches_changed)
+
+    def apply_match(self, match):
+        """ Apply a single new or updated match (eg pushed by a TBA webhook)
+        without refetching the match list. Only the ratings of the match's
+        teams change, so only the upcoming matches involving them are
+        repriced.
+        Returns:
+            False if the event hasn't been fetched yet, so the match couldn't
+            be applied.
+        """
+        if self.status is None:
+            return False
+        matches = [existing for existing in self.matches if existing['key'] != match['key']]
+        matches = self.tba_wrapper.sort_by_match_number(matches + [match])
+        self.update_matches(matches)
+        return True
+
+    def update_matches(self, matches, matches_changed=True):
+        """ Update the event's status, ratings and predictions from its full
+        (sorted) match list. Only matches that are new or have changed since
+        the last update are processed, and only upcoming matches whose teams'
+        ratings have moved are repriced.
+        Args:
+            matches_changed: False if TBA's matches are the same as last time
+            they were fetched, so the predictions can be reused unless the
+            status has changed or ratings have moved.
+        """
+        if not matches_changed and self.status is not None:
+            # what TBA sent last time may be older than self.matches, which
+            # includes matches applied from webhooks since
+            matches = self.matches
+        last_in_progress = self.in_progress
+        last_status = self.status
 
         event_dict = {}
         event_dict['start_year'] = str(self.event_start.year)
@@ -73,34 +163,63 @@ class Event:
         event_dict['name'] = self.event_response['name']
         event_dict['event_code'] = self.event_code
 
-        matches = self.get_matches()
-
+        changed_matches = self.diff_matches(matches) if matches_changed else []
         update_ratings = self.set_status_code(matches)
-        upcoming_matches = self.update_processed_matches(matches)
 
-        event_dict['upcoming_matches'] = upcoming_matches.values()
-        event_dict['retrodictions'] = self.retrodictions
+        # run even when the matches haven't changed, as matches are also
+        # repriced when their teams' ratings have moved at other events (only
+        # those matches are, so this is cheap)
+        upcoming_matches = self.update_processed_matches(matches, changed_matches)
+        predictions_changed = (bool(changed_matches) or self.status != last_status
+                               or len(upcoming_matches) != len(self.upcoming_matches)
+                               or any(self.upcoming_matches.get(key) is not prediction
+                                      for key, prediction in upcoming_matches.items()))
+        self.upcoming_matches = upcoming_matches
+
+        if predictions_changed or self.event_dict is None:
+            event_dict['upcoming_matches'] = list(self.upcoming_matches.values())
+
+            if self.status in [Event.States.MATCHES_POSTED,
+                               Event.States.QUALIFICATION_MATCHES]:
+                event_dict['rank_projections'] = self.generate_rank_projections(matches)
+            else:
+                event_dict['rank_projections'] = []
+
+            if self.status == Event.States.FINAL_MATCHES:
+                event_dict['finals'] = self.generate_knockout_dict(matches, self.alliance_data)
+            else:
+                event_dict['finals'] = {'in_progress': False}
+        else:
+            # nothing has been played or rescheduled and no ratings have moved
+            # since the last update, so the predictions are the same as last
+            # time (the rank projections are simulated, so wouldn't be)
+            for key in ['upcoming_matches', 'rank_projections', 'finals']:
+                event_dict[key] = self.event_dict[key]
+        # copied, as self.retrodictions keeps being appended to
+        event_dict['retrodictions'] = list(self.retrodictions)
 
         if update_ratings:
             pass
 
         event_dict['status'] = Event.StateStrings[self.status]
-        # TODO: implement finals in progress or not
-        event_dict['finals'] = {'in_progress': False}
         event_dict['status_code'] = ('qm'
                                      if self.status == Event.States.QUALIFICATION_MATCHES
                                      else ('fm' if self.status == Event.States.FINAL_MATCHES
                                            else 'none'))
 
         self.matches = matches
-        if (not self.in_progress and last_in_progress):
+        finished_when_found = (last_status is None and self.status == self.States.FINISHED
+                               and not self.tba_wrapper.is_cached(self.event_code))
+        if (not self.in_progress and last_in_progress) or finished_when_found:
             self.tba_wrapper.cache_matches(self.event_code,
                                            self.matches,
                                            event_metadata=self.event_response)
             print("Caching %s" % self.event_code)
         # This ***MUST*** be done in one step, otherwise we risk sending a user
-        # a half completed dictionary.
-        self.event_dict = event_dict
+        # a half completed dictionary. Kept as the same dict if nothing has
+        # changed, so snapshots (see util.snapshots.SnapshotBuilder) can tell.
+        if event_dict != self.event_dict:
+            self.event_dict = event_dict
         self.last_status_tm = time.time()
 
     def parse_event_response(self):
@@ -117,8 +236,8 @@ class Event:
                          datetime.strptime(
                              self.event_response['end_date'], '%Y-%m-%d'))
 
-        # TODO: add support for different round types
-        self.teams_in_bracket = 8
+        self.playoff_type = self.PLAYOFF_TYPE_MAPPING.get(
+            self.event_response.get('playoff_type'))
 
     def match_processed(self, match):
         if match['key'] in self.processed_matches:
@@ -132,24 +251,97 @@ class Event:
             self.elo.update(match)
             self.processed_matches.add(match['key'])
 
-    def update_processed_matches(self, matches):
+    @staticmethod
+    def match_fingerprint(match):
+        # not the match's time: TBA moves predicted_time on every poll during
+        # an event, and predictions don't depend on it (next_match_time reads
+        # self.matches)
+        alliances = match['alliances']
+        return (alliances['blue']['score'], alliances['red']['score'],
+                tuple(alliances['blue']['team_keys']), tuple(alliances['red']['team_keys']))
+
+    def diff_matches(self, matches):
+        """ Find the matches that are new or have changed since the last
+        update, and move the first unplayed match cursor.
+        Returns:
+            The changed matches, in match order.
+        """
         # Assumes matches is sorted by match number!
-        unplayed_matches = []
-        for match_num, match in enumerate(matches):
-            if not self.tba_wrapper.has_match_been_played(match):
-                unplayed_matches.append(match)
-            else:
+        changed_matches = []
+        first_changed = len(matches)
+        for i, match in enumerate(matches):
+            fingerprint = self.match_fingerprint(match)
+            if self.match_fingerprints.get(match['key']) != fingerprint:
+                self.match_fingerprints[match['key']] = fingerprint
+                self.match_played[match['key']] = self.tba_wrapper.has_match_been_played(match)
+                changed_matches.append(match)
+                first_changed = min(first_changed, i)
+
+        if len(matches) != len(self.matches):
+            # matches have been added or removed, so the cursor could be
+            # anywhere
+            first_unplayed = 0
+        else:
+            first_unplayed = min(self.first_unplayed, first_changed)
+        while (first_unplayed < len(matches) and
+               self.match_played[matches[first_unplayed]['key']]):
+            first_unplayed += 1
+        self.first_unplayed = first_unplayed
+        return changed_matches
+
+    def update_processed_matches(self, matches, changed_matches):
+        """ Process newly played matches, and predict the unplayed ones.
+        Unplayed matches that were already predicted, haven't changed, and
+        whose teams' ratings haven't moved keep their previous prediction.
+        Args:
+            changed_matches: The matches that diff_matches found had changed.
+        """
+        for match in changed_matches:
+            if self.match_played[match['key']]:
                 self.update_retrodictions(match)
                 self.process_match(match)
+
+        # every match before the cursor has been played
+        unplayed_matches = [match for match in matches[self.first_unplayed:]
+                            if not self.match_played[match['key']]]
         if (not unplayed_matches) or self.status == Event.States.FINISHED:
+            self.prediction_ratings = {}
             return OrderedDict()
+
+        changed_keys = set(match['key'] for match in changed_matches)
+        to_price = [match for match in unplayed_matches
+                    if match['key'] in changed_keys or
+                    match['key'] not in self.upcoming_matches or
+                    self.prediction_ratings.get(match['key']) != self.match_ratings(match)]
+        predictions = {}
+        if to_price:
+            # price the matches in one pass
+            blue_win_probs = self.elo.predict_many(to_price)
+            predicted_margins = self.elo.predict_margin_many(blue_win_probs=blue_win_probs)
+            for match, blue_win_prob, predicted_margin in zip(
+                    to_price, blue_win_probs, predicted_margins):
+                predictions[match['key']] = \
+                    self.generate_prediction_dict(match, blue_win_prob, predicted_margin)
+                self.prediction_ratings[match['key']] = self.match_ratings(match)
         upcoming_matches = OrderedDict()
         for match in unplayed_matches:
-            upcoming_matches[match['key']] = \
-                self.generate_prediction_dict(match)
+            upcoming_matches[match['key']] = predictions.get(
+                match['key'], self.upcoming_matches.get(match['key']))
+        for key in set(self.prediction_ratings) - set(upcoming_matches):
+            del self.prediction_ratings[key]
         return upcoming_matches
 
-    def generate_prediction_dict(self, match):
+    def match_ratings(self, match):
+        """ The versions of the ratings (and the stdev) a prediction of match
+        depends on. """
+        alliances = match['alliances']
+        teams = alliances['blue']['team_keys'] + alliances['red']['team_keys']
+        return self.elo.versions(teams) + (self.elo.stdev,)
+
+    def generate_prediction_dict(self, match, blue_win_prob=None, predicted_margin=None):
+        if blue_win_prob is None:
+            blue_win_prob = self.elo.predict(match)
+            predicted_margin = self.elo.predict_margin_many(blue_win_probs=blue_win_prob)
         dict = {}
         dict['name'] = \
             "%s %s Match %s" % \
@@ -158,12 +350,54 @@ class Event:
         for alliance in ['blue', 'red']:
             dict[alliance+'_alliance'] = [team_num.lstrip('frc') for team_num in
                                           match['alliances'][alliance]['team_keys']]
-        blue_win_prob = self.elo.predict(match)
         dict['blue_win_prob'] = int(blue_win_prob*100)
         dict['red_win_prob'] = int((1-blue_win_prob)*100)
-        dict['predicted_margin'] = int(self.elo.predict_margin(match))
+        dict['predicted_margin'] = int(predicted_margin)
         return dict
 
+    def generate_rank_projections(self, matches):
+        played_matches = []
+        unplayed_matches = []
+        for match in matches:
+            if match['comp_level'] != 'qm':
+                continue
+            if self.match_played[match['key']]:
+                played_matches.append(match)
+            else:
+                unplayed_matches.append(match)
+        projections = RankingProjector(self.elo).project(played_matches, unplayed_matches)
+        rank_projections = []
+        for team, projection in projections.items():
+            projection = dict(projection)
+            projection['team'] = team.lstrip('frc')
+            projection['top_seed_percent'] = int(projection['top_seed_prob']*100)
+            rank_projections.append(projection)
+        return rank_projections
+
+    def generate_knockout_dict(self, matches, alliance_data=None):
+        if self.playoff_type is None:
+            # no predictor for this playoff format
+            return {'in_progress': False}
+        if alliance_data is None:
+            alliance_data = self.tba_wrapper.fetch_alliance_data(self.event_code)
+            self.alliance_data = alliance_data
+        if not alliance_data:
+            return {'in_progress': False}
+        # brackets are calculated exactly, the other formats simulated
+        predictor = KnockoutPredictor(self, self.playoff_type, self.elo, exact=True)
+        results = predictor.predict_bracket_knockout(alliance_data, matches)
+        knockout_predictions = []
+        # most likely winner first
+        for teams, through_percentages in reversed(results):
+            knockout_predictions.append(
+                [[team_num.lstrip('frc') for team_num in teams]] +
+                [int(percentage*100) for percentage in through_percentages.values()])
+        final_type = ('round-robin' if self.playoff_type == '6-team-round-robin'
+                      else 'knockout')
+        return {'in_progress': True, 'rounds': len(predictor.levels),
+                'level_names': predictor.level_names, 'final_type': final_type,
+                'knockout_predictions': knockout_predictions}
+
     def generate_retrodiction_dict(self, match):
         dict = self.generate_prediction_dict(match)
         dict['actual_margin'] = int(match['alliances']['blue']['score']
@@ -175,10 +409,22 @@ class Event:
             self.retrodictions.append(self.generate_retrodiction_dict(match))
             self.played_matches.add(match['key'])
 
-    def get_matches(self):
+    def get_matches(self, priority=Priority.NEAR_TERM):
+        """ Returns (matches, changed), where changed is False if the matches
+        are the same as last time. """
         print("Fetching match data for %s" % (self.event_code))
-        matches = self.tba_wrapper.get_event_matches(self.event_code)
-        return matches
+        return self.tba_wrapper.get_event_matches(self.event_code, return_changed=True,
+                                                  priority=priority)
+
+    def next_match_time(self):
+        """ Unix time the next unplayed match is expected to start (TBA's
+        predicted time, falling back to the scheduled time), or None if
+        there isn't one. """
+        times = [match.get('predicted_time') or match.get('time')
+                 for match in self.matches[self.first_unplayed:]
+                 if not self.match_played.get(match['key'])]
+        times = [match_time for match_time in times if match_time]
+        return min(times) if times else None
 
     @property
     def in_progress(self):
@@ -193,6 +439,8 @@ class Event:
                                Event.States.FINAL_MATCHES]
 
     def set_status_code(self, matches):
+        # uses the first unplayed match cursor, so diff_matches(matches) must
+        # have been called first
         # should we update the elo database with new match data, *or* could
         # there possibly be new matches to post predictions for
         update_ratings_predictions = True
@@ -214,7 +462,7 @@ class Event:
             else:
                 self.status = Event.States.NO_DATA
             update_ratings_predictions = False
-        elif not self.tba_wrapper.has_match_been_played(matches[0]):
+        elif self.first_unplayed == 0:
             if now < self.event_end+timedelta(1):
                 self.status = Event.States.MATCHES_POSTED
                 update_ratings_predictions = True
@@ -222,11 +470,8 @@ class Event:
                 self.status = Event.States.NO_DATA
                 update_ratings_predictions = False
         else:
-            first_unplayed = None
-            for match in matches:
-                if not self.tba_wrapper.has_match_been_played(match):
-                    first_unplayed = match
-                    break
+            first_unplayed = (matches[self.first_unplayed]
+                              if self.first_unplayed < len(matches) else None)
             if not first_unplayed and not matches[-1]['comp_level'] == 'qm':
                 if not self.status == Event.States.FINISHED:
                     # if event is already finished, no point in updating
@@ -235,7 +480,7 @@ class Event:
                 else:
                     update_ratings_predictions = False
                 self.status = Event.States.FINISHED
-            elif first_unplayed['comp_level'] is 'qm':
+            elif first_unplayed is None or first_unplayed['comp_level'] == 'qm':
                 self.status = Event.States.QUALIFICATION_MATCHES
                 update_ratings_predictions = True
             else:
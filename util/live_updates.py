@@ -0,0 +1,228 @@
+from collections import defaultdict
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import json
+import re
+import threading
+
+# the parts of Event.event_dict that templates/event.html shows, and that are
+# pushed to browsers when they change
+LIVE_KEYS = ['name', 'status', 'status_code', 'upcoming_matches', 'retrodictions',
+             'rank_projections', 'finals']
+# the fields of each rank projection shown on the page (the rest are
+# distributions, which are large and not shown)
+LIVE_RANK_FIELDS = ['team', 'ranking_points', 'mean_ranking_points', 'mean_seed',
+                    'top_seed_percent']
+
+
+def live_state(event_dict):
+    """ A copy of the parts of event_dict shown on the event page, as plain
+    JSON types. """
+    state = {key: event_dict.get(key) for key in LIVE_KEYS}
+    state['rank_projections'] = [{field: projection[field] for field in LIVE_RANK_FIELDS}
+                                 for projection in state['rank_projections'] or []]
+    # round trip so later changes to event_dict's lists aren't shared
+    return json.loads(json.dumps(state))
+
+
+class LiveUpdates():
+    """Keeps the latest live state of each event, and turns each change into
+    a small delta message for browsers watching the event.
+
+    A message is a dict with 'seq', the event's update number, and:
+        'set': keys whose values have been replaced.
+        'append': keys of lists that have only had items added, mapped to
+        {'start': index of the first new item, 'items': the new items}.
+        'full': True if 'set' is the whole state rather than a delta.
+    Applying a message twice has the same effect as applying it once, so
+    browsers can safely be sent a message they've already seen.
+
+    Publishing is thread safe. Listeners (eg LiveUpdateServer) are called
+    with (event_code, message) from the publishing thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+        self.seqs = defaultdict(int)
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def publish(self, event_code, event_dict):
+        """ Record the event's new state, and send listeners the delta from
+        its last state, if anything has changed. """
+        state = live_state(event_dict)
+        with self.lock:
+            delta = self.delta(self.states.get(event_code, {}), state)
+            if not delta:
+                return
+            self.states[event_code] = state
+            self.seqs[event_code] += 1
+            message = dict(delta, seq=self.seqs[event_code])
+        for listener in self.listeners:
+            listener(event_code, message)
+
+    def catch_up(self, event_code, since=None):
+        """ The message that brings a browser that has seen update since up
+        to date (the whole state), or None if it's already up to date or the
+        event is unknown. """
+        with self.lock:
+            if event_code not in self.states or since == self.seqs[event_code]:
+                return None
+            return {'seq': self.seqs[event_code], 'set': self.states[event_code], 'full': True}
+
+    def has_event(self, event_code):
+        with self.lock:
+            return event_code in self.states
+
+    @staticmethod
+    def delta(old, new):
+        changed = {}
+        appended = {}
+        for key, value in new.items():
+            old_value = old.get(key)
+            if value == old_value and key in old:
+                continue
+            if (isinstance(value, list) and isinstance(old_value, list) and old_value and
+                    value[:len(old_value)] == old_value):
+                appended[key] = {'start': len(old_value), 'items': value[len(old_value):]}
+            else:
+                changed[key] = value
+        delta = {}
+        if changed:
+            delta['set'] = changed
+        if appended:
+            delta['append'] = appended
+        return delta
+
+
+class LiveUpdateServer():
+    """Streams LiveUpdates messages to browsers as Server-Sent Events.
+
+    Runs a single asyncio event loop on its own thread, so idle connections
+    only cost a coroutine each rather than a web server thread. Browsers
+    connect to /events/<event code>/stream, optionally with ?since=<seq> (or
+    the Last-Event-ID header EventSource sends when reconnecting) so they
+    aren't resent a state they already have. Otherwise the whole state is
+    sent first, followed by deltas.
+    """
+
+    STREAM_PATH = re.compile(r'^/events/(\w+)/stream$')
+    # seconds between comments sent to keep idle connections open
+    KEEPALIVE_INTERVAL = 15
+    # seconds a client has to send its request
+    REQUEST_TIMEOUT = 10
+    # clients that fall this many messages behind are disconnected
+    MAX_QUEUED = 64
+
+    def __init__(self, live_updates, host='0.0.0.0', port=5001):
+        self.live_updates = live_updates
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.ready = threading.Event()
+        # event code -> set of asyncio.Queue, one per connected client.
+        # Only used from the event loop's thread.
+        self.subscribers = defaultdict(set)
+
+    def start(self):
+        """ Start serving on a background thread, returning once the server
+        is listening. """
+        thread = threading.Thread(target=self.run, name='live-updates', daemon=True)
+        thread.start()
+        self.ready.wait()
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.live_updates.add_listener(self.on_publish)
+        self.loop.run_until_complete(self.serve())
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        # the port the OS picked, if port was 0
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    @property
+    def num_clients(self):
+        return sum(len(queues) for queues in list(self.subscribers.values()))
+
+    def on_publish(self, event_code, message):
+        data = self.format_message(message)
+        self.loop.call_soon_threadsafe(self.broadcast, event_code, data)
+
+    def broadcast(self, event_code, data):
+        for queue in self.subscribers.get(event_code, ()):
+            if queue.full():
+                # too far behind, so drop the client (it will reconnect and
+                # be sent the whole state)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(data)
+
+    @staticmethod
+    def format_message(message):
+        return ('id: %s\ndata: %s\n\n' % (message['seq'], json.dumps(message))).encode()
+
+    async def handle_client(self, reader, writer):
+        queue = None
+        event_code = None
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.REQUEST_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.decode('latin-1').split()
+            url = urlsplit(parts[1]) if len(parts) == 3 else None
+            path_match = self.STREAM_PATH.match(url.path) if url else None
+            if (parts[:1] != ['GET'] or not path_match or
+                    not self.live_updates.has_event(path_match.group(1))):
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n'
+                             b'Connection: close\r\n\r\n')
+                await writer.drain()
+                return
+            event_code = path_match.group(1)
+            since = headers.get('last-event-id') or parse_qs(url.query).get('since', [None])[0]
+
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\nAccess-Control-Allow-Origin: *\r\n'
+                         b'Connection: keep-alive\r\n\r\n')
+            # subscribe before catching up, so nothing published in between
+            # is missed
+            queue = asyncio.Queue(self.MAX_QUEUED)
+            self.subscribers[event_code].add(queue)
+            catch_up = self.live_updates.catch_up(
+                event_code, int(since) if since and since.isdigit() else None)
+            if catch_up is not None:
+                writer.write(self.format_message(catch_up))
+            await writer.drain()
+
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), self.KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    data = b': keepalive\n\n'
+                if data is None:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError, UnicodeDecodeError):
+            pass
+        finally:
+            if queue is not None:
+                self.subscribers[event_code].discard(queue)
+                if not self.subscribers[event_code]:
+                    del self.subscribers[event_code]
+            writer.close()
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+# comp levels, in the order of their uint8 codes
+COMP_LEVELS = ['qm', 'ef', 'qf', 'sf', 'f']
+
+ARCHIVE_VERSION = 1
+
+
+class MatchArchive(object):
+    """A season of matches in a compact columnar format.
+
+    Only what the Elo model uses is kept: the teams on each alliance (as
+    integer IDs into `teams`, padded with -1 for short alliances), the scores
+    (int16) and the comp level (uint8, see COMP_LEVELS). Matches are in
+    chronological order, and the matches of event i are
+    `event_offsets[i]:event_offsets[i+1]`.
+
+    On disk an archive is a directory of .npy files, which load() memory maps,
+    so opening an archive reads almost nothing and the arrays can be used
+    without copying them.
+    """
+
+    ARRAYS = ['teams', 'event_codes', 'event_offsets', 'blue_teams', 'red_teams',
+              'blue_scores', 'red_scores', 'comp_levels']
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, teams, event_codes, event_offsets, blue_teams, red_teams,
+                 blue_scores, red_scores, comp_levels, source_fingerprint=None):
+        self.teams = teams
+        self.event_codes = event_codes
+        self.event_offsets = event_offsets
+        self.blue_teams = blue_teams
+        self.red_teams = red_teams
+        self.blue_scores = blue_scores
+        self.red_scores = red_scores
+        self.comp_levels = comp_levels
+        # fingerprint of the data the archive was converted from (see
+        # DataStore.year_fingerprint)
+        self.source_fingerprint = source_fingerprint
+
+    @property
+    def num_matches(self):
+        return len(self.blue_scores)
+
+    @classmethod
+    def from_year_events(cls, year_events, source_fingerprint=None):
+        """ Convert a season of TBA match dicts.
+        Args:
+            year_events: OrderedDict of event code -> list of TBA match dicts,
+            in chronological order (as stored in the DataStore). Events with
+            no matches are left out.
+        """
+        team_index = {}
+        event_codes = []
+        event_offsets = [0]
+        alliances = {'blue': [], 'red': []}
+        scores = {'blue': [], 'red': []}
+        comp_levels = []
+        comp_level_codes = {level: code for code, level in enumerate(COMP_LEVELS)}
+        for event_code, matches in year_events.items():
+            if not matches:
+                continue
+            for match in matches:
+                for alliance in ['blue', 'red']:
+                    row = []
+                    for team in match['alliances'][alliance]['team_keys']:
+                        if team not in team_index:
+                            team_index[team] = len(team_index)
+                        row.append(team_index[team])
+                    alliances[alliance].append(row)
+                    scores[alliance].append(match['alliances'][alliance]['score'])
+                comp_levels.append(comp_level_codes[match['comp_level']])
+            event_codes.append(event_code)
+            event_offsets.append(len(comp_levels))
+
+        width = max((len(row) for rows in alliances.values() for row in rows), default=3)
+
+        def pad(rows):
+            padded = np.full((len(rows), width), -1, dtype=np.int32)
+            for i, row in enumerate(rows):
+                padded[i, :len(row)] = row
+            return padded
+
+        return cls(teams=np.array(list(team_index), dtype=str),
+                   event_codes=np.array(event_codes, dtype=str),
+                   event_offsets=np.array(event_offsets, dtype=np.int64),
+                   blue_teams=pad(alliances['blue']), red_teams=pad(alliances['red']),
+                   blue_scores=np.array(scores['blue'], dtype=np.int16),
+                   red_scores=np.array(scores['red'], dtype=np.int16),
+                   comp_levels=np.array(comp_levels, dtype=np.uint8),
+                   source_fingerprint=source_fingerprint)
+
+    def save(self, directory):
+        """ Write the archive to directory, replacing any archive already
+        there. The manifest is written last, so a partly written archive is
+        never loaded. """
+        tmp_directory = directory.rstrip('/') + '.tmp'
+        if os.path.isdir(tmp_directory):
+            shutil.rmtree(tmp_directory)
+        os.makedirs(tmp_directory)
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp_directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(tmp_directory, self.MANIFEST_FILE), 'w') as manifest:
+            json.dump({'version': ARCHIVE_VERSION, 'num_matches': self.num_matches,
+                       'source_fingerprint': self.source_fingerprint}, manifest)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp_directory, directory)
+
+    @classmethod
+    def load(cls, directory):
+        """ Memory map the archive in directory.
+        Returns:
+            The MatchArchive, or None if there isn't a complete archive of
+            this version there.
+        """
+        manifest_file = os.path.join(directory, cls.MANIFEST_FILE)
+        if not os.path.isfile(manifest_file):
+            return None
+        with open(manifest_file, 'r') as manifest:
+            manifest = json.load(manifest)
+        if manifest.get('version') != ARCHIVE_VERSION:
+            return None
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+                  for name in cls.ARRAYS}
+        return cls(source_fingerprint=manifest['source_fingerprint'], **arrays)
+
+    def event_matches(self, event_code):
+        """ Slice of the match arrays holding event_code's matches. """
+        i = int(np.flatnonzero(self.event_codes == event_code)[0])
+        return slice(int(self.event_offsets[i]), int(self.event_offsets[i+1]))
+
+
+if __name__ == '__main__':
+    # Convert the cached seasons to archives, eg
+    # `python -m util.match_archive cache`
+    import sys
+    from util.data_store import DataStore
+
+    data_store = DataStore(cache_directory=sys.argv[1] if len(sys.argv) > 1 else 'cache')
+    for year in data_store.data:
+        if data_store.get_year_archive(year) is None:
+            archive = data_store.write_year_archive(year)
+            print("%s: %s matches" % (year, archive.num_matches))
@@ -0,0 +1,111 @@
+"""Compare loading and replaying cached seasons from the pickled TBA match
+dicts against the columnar match archives. Run from the repository root with
+`python -m util.match_archive_benchmark`.
+
+Each measurement runs in a fresh interpreter, so the peak resident memory it
+reports is that of loading and replaying the seasons alone."""
+
+from predict.elo import FRCElo
+from predict.elo_replay import EloReplay
+from predict.replay_benchmark import NUM_YEARS, synthetic_year
+from util.match_archive import MatchArchive
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+FIRST_YEAR = 2008
+# fields of a TBA score breakdown, so the dicts are the size of real ones
+BREAKDOWN_FIELDS = 40
+
+
+def add_tba_fields(year_events, rng):
+    for matches in year_events.values():
+        for match in matches:
+            match.update({'event_key': match['key'].split('_')[0], 'set_number': 1,
+                          'match_number': 1, 'winning_alliance': 'blue',
+                          'time': 1500000000, 'actual_time': 1500000000,
+                          'predicted_time': 1500000000, 'post_result_time': 1500000000,
+                          'videos': [{'type': 'youtube', 'key': 'abcdefghijk'}]})
+            for alliance in match['alliances'].values():
+                alliance.update({'surrogate_team_keys': [], 'dq_team_keys': []})
+            match['score_breakdown'] = {
+                alliance: {'field%s' % i: rng.randint(0, 100) for i in range(BREAKDOWN_FIELDS)}
+                for alliance in ['blue', 'red']}
+
+
+def write_seasons(directory):
+    rng = random.Random(2018)
+    for year in range(FIRST_YEAR, FIRST_YEAR + NUM_YEARS):
+        year_events = synthetic_year(year, rng)
+        add_tba_fields(year_events, rng)
+        with open(os.path.join(directory, '%s.p' % year), 'wb') as year_file:
+            pickle.dump(year_events, year_file)
+        MatchArchive.from_year_events(year_events).save(
+            os.path.join(directory, '%s-archive' % year))
+
+
+def replay_seasons(directory, source):
+    """ Load and replay each season, printing the load time, replay time and
+    peak resident memory in MB. """
+    replay = EloReplay(FRCElo(qm_K=20, fm_K=5, new_team_rating=1350, init_stdev=50))
+    load_time = replay_time = 0
+    for year in range(FIRST_YEAR, FIRST_YEAR + NUM_YEARS):
+        start = time.perf_counter()
+        if source == 'pickle':
+            with open(os.path.join(directory, '%s.p' % year), 'rb') as year_file:
+                year_events = pickle.load(year_file)
+            season = EloReplay.compile_season(year_events)
+        else:
+            archive = MatchArchive.load(os.path.join(directory, '%s-archive' % year))
+            season = EloReplay.season_from_archive(archive)
+        load_time += time.perf_counter() - start
+        start = time.perf_counter()
+        replay.replay(season)
+        replay.elo.next_year(1500, 0.2, 50)
+        replay_time += time.perf_counter() - start
+    print(load_time, replay_time, peak_rss())
+
+
+def peak_rss():
+    """ Peak resident memory of this process in MB. Read from /proc rather
+    than getrusage, whose ru_maxrss is carried over from the parent process
+    across fork and exec. """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+
+
+def measure(directory, source):
+    output = subprocess.check_output([sys.executable, '-m', __spec__.name, directory, source])
+    return [float(value) for value in output.split()]
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        replay_seasons(*sys.argv[1:])
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_seasons(directory)
+        sizes = {'pickle': 0, 'archive': 0}
+        for year in range(FIRST_YEAR, FIRST_YEAR + NUM_YEARS):
+            sizes['pickle'] += directory_size(os.path.join(directory, '%s.p' % year))
+            sizes['archive'] += directory_size(os.path.join(directory, '%s-archive' % year))
+
+        print("%s seasons" % NUM_YEARS)
+        print("%-8s %10s %10s %10s %10s" % ('', 'on disk', 'load', 'replay', 'peak RSS'))
+        for source in ['pickle', 'archive']:
+            load_time, replay_time, max_rss = measure(directory, source)
+            print("%-8s %8.1fMB %9.2fs %9.2fs %8.0fMB" % (
+                source, sizes[source] / 2**20, load_time, replay_time, max_rss))
@@ -0,0 +1,147 @@
+from util.event import Event
+import heapq
+import time
+
+
+class PollScheduler():
+    """Decides when each Event next needs to be fetched from TBA.
+
+    Events are kept in a priority queue by the time they're next due, so an
+    event months away is polled once a day while an event in the middle of
+    eliminations is polled every MATCH_INTERVAL seconds. The interval comes
+    from the event's status, its start date and the time of its next
+    scheduled match. Finished events aren't polled again. Events whose
+    fetches keep failing are backed off exponentially, from FAILURE_INTERVAL
+    up to FAILURE_MAX_INTERVAL.
+
+    Events that TBA is pushing updates for by webhook (see record_push) are
+    only polled every PUSH_SAFETY_INTERVAL, as a safety net for missed
+    messages.
+    """
+
+    # all in seconds
+    FUTURE_INTERVAL = 24*60*60  # longest wait before an event starts
+    PRE_START_INTERVAL = 60*60  # shortest wait before an event starts
+    PRE_MATCHES_INTERVAL = 10*60  # started, but no schedule yet
+    MATCH_INTERVAL = 20  # a match is about to start, or running late
+    MATCH_WINDOW = 5*60  # how long before a match to start polling quickly
+    LIVE_MAX_INTERVAL = 30*60  # longest wait during an event, eg overnight
+    LIVE_DEFAULT_INTERVAL = 60  # live, but with no match times
+    NO_DATA_INTERVAL = 6*60*60
+    PUSH_SAFETY_INTERVAL = 10*60  # shortest wait while receiving webhooks
+    PUSH_ACTIVE_WINDOW = 30*60  # how long after a webhook to keep backing off
+    FAILURE_INTERVAL = 30  # wait after one failed fetch, doubled for each after
+    FAILURE_MAX_INTERVAL = 60*60
+
+    def __init__(self):
+        # heap of (due time, sequence number, event code). Rescheduling an
+        # event leaves its old entry in the heap, which is skipped when it
+        # no longer matches self.due_times.
+        self.queue = []
+        self.sequence = 0
+        self.due_times = {}
+        self.poll_intervals = {}
+        self.last_polled = {}
+        self.last_push = {}
+
+    def schedule(self, event, now=None):
+        """ Queue event to be polled again after its poll interval, or
+        remove it from the queue if it never needs polling again. If it's
+        already due sooner (eg poll_now was called while it was being
+        polled), it's left due then. """
+        now = time.time() if now is None else now
+        interval = self.poll_interval(event, now)
+        if interval is not None and self.receiving_pushes(event.event_code, now):
+            interval = max(interval, self.PUSH_SAFETY_INTERVAL)
+        self.poll_intervals[event.event_code] = interval
+        self.last_polled[event.event_code] = now
+        if interval is None:
+            self.due_times.pop(event.event_code, None)
+            return
+        due = self.due_times.get(event.event_code)
+        if due is None or due > now+interval:
+            self._queue(event.event_code, now+interval)
+
+    def record_push(self, event_code, now=None):
+        """ Record that TBA pushed an update for the event, and back its
+        polling off to PUSH_SAFETY_INTERVAL after it was last polled. """
+        now = time.time() if now is None else now
+        self.last_push[event_code] = now
+        due = self.due_times.get(event_code)
+        safety_due = self.last_polled.get(event_code, now)+self.PUSH_SAFETY_INTERVAL
+        if due is not None and due < safety_due:
+            self._queue(event_code, safety_due)
+
+    def poll_now(self, event_code, now=None):
+        """ Make the event due immediately, eg when a push says something
+        has changed that it doesn't include. """
+        self._queue(event_code, time.time() if now is None else now)
+
+    def receiving_pushes(self, event_code, now):
+        last_push = self.last_push.get(event_code)
+        return last_push is not None and now-last_push < self.PUSH_ACTIVE_WINDOW
+
+    def _queue(self, event_code, due):
+        self.due_times[event_code] = due
+        self.sequence += 1
+        heapq.heappush(self.queue, (due, self.sequence, event_code))
+
+    def pop_due(self, now=None):
+        """ Remove and return the codes of the events due by now, most overdue
+        first. They must be scheduled again once they've been polled. """
+        now = time.time() if now is None else now
+        due_codes = []
+        while self.queue and self.queue[0][0] <= now:
+            due, _, event_code = heapq.heappop(self.queue)
+            if self.due_times.get(event_code) == due:
+                del self.due_times[event_code]
+                due_codes.append(event_code)
+        return due_codes
+
+    def next_due(self):
+        """ The time the next event is due, or None if nothing is queued. """
+        while self.queue and self.due_times.get(self.queue[0][2]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        return self.queue[0][0] if self.queue else None
+
+    @property
+    def queue_depth(self):
+        return len(self.due_times)
+
+    def stats(self):
+        """ The queue depth, and the current poll interval of each event (None
+        if it won't be polled again), for tuning the intervals. """
+        return {'queue_depth': self.queue_depth,
+                'poll_intervals': dict(self.poll_intervals)}
+
+    def poll_interval(self, event, now):
+        """ Seconds until event should next be polled, or None for never. """
+        interval = self.status_interval(event, now)
+        if interval is not None and event.fetch_failures:
+            backoff = self.FAILURE_INTERVAL * 2**min(event.fetch_failures-1, 16)
+            interval = max(interval, min(self.FAILURE_MAX_INTERVAL, backoff))
+        return interval
+
+    def status_interval(self, event, now):
+        """ The poll interval for event's status, ignoring failed fetches. """
+        status = event.status
+        if status is None:
+            # never been fetched
+            return 0
+        if status == Event.States.FINISHED:
+            return None
+        if status == Event.States.NOT_STARTED:
+            # the status changes a day before the start date
+            until_start = event.event_start.timestamp()-24*60*60-now
+            return int(min(self.FUTURE_INTERVAL, max(self.PRE_START_INTERVAL, until_start)))
+        if status == Event.States.PRE_MATCHES:
+            return self.PRE_MATCHES_INTERVAL
+        if status == Event.States.NO_DATA:
+            return self.NO_DATA_INTERVAL
+
+        # schedule posted, or matches being played
+        next_match_time = event.next_match_time()
+        if next_match_time is None:
+            return self.LIVE_DEFAULT_INTERVAL
+        until_window = next_match_time-self.MATCH_WINDOW-now
+        return int(min(self.LIVE_MAX_INTERVAL, max(self.MATCH_INTERVAL, until_window)))
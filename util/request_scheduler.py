@@ -0,0 +1,152 @@
+from collections import deque
+from concurrent.futures import Future
+import heapq
+import threading
+import time
+
+
+class Priority:
+    LIVE = 0  # events with matches being played, and their alliances
+    NEAR_TERM = 1  # other current season events
+    BACKFILL = 2  # past seasons
+
+    NAMES = {LIVE: 'live', NEAR_TERM: 'near_term', BACKFILL: 'backfill'}
+
+
+class RequestScheduler():
+    """Decides when each request to TBA is sent.
+
+    Requests take a token from a bucket refilled at rate tokens a second
+    (holding at most burst), so bursts are allowed but the average rate is
+    capped. When requests are waiting for tokens, the next token goes to
+    the waiting request with the highest priority (see Priority), oldest
+    first, so background traffic like a backfill can't hold up live events.
+
+    Identical requests already queued or in flight aren't sent twice: later
+    callers wait for the first one's result. If a higher priority caller
+    joins a queued request, the request is moved up to its priority.
+    """
+
+    # number of recent queue waits kept per priority for the percentiles
+    HISTORY_LEN = 1000
+
+    def __init__(self, rate=None, burst=None):
+        """
+        Args:
+            rate: Requests a second, or None for no limit.
+            burst: Most tokens the bucket holds. Defaults to rate.
+        """
+        self.rate = rate
+        self.burst = max(1, rate if burst is None else burst) if rate else None
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.condition = threading.Condition()
+        # heap of (priority, sequence number, ticket). A ticket moved up to a
+        # higher priority leaves its old entry in the heap, which is skipped
+        # once the ticket has been granted.
+        self.queue = []
+        self.sequence = 0
+        # request key -> Future of the request's result
+        self.in_flight = {}
+        self.waits = {priority: deque([], maxlen=self.HISTORY_LEN) for priority in Priority.NAMES}
+        self.counts = {priority: {'requests': 0, 'deduplicated': 0, 'total_wait': 0.0}
+                       for priority in Priority.NAMES}
+
+    def run(self, key, send, priority=Priority.NEAR_TERM):
+        """ Call send once it's allowed by the rate limit, unless a request
+        with the same key is already queued or in flight, in which case wait
+        for that one instead.
+        Args:
+            key: Identifies the request, eg its URL and headers.
+            send: Function that makes the request and returns its result.
+            priority: A Priority.
+        Returns:
+            What send returned (or raises what it raised).
+        """
+        with self.condition:
+            joined = self.in_flight.get(key)
+            if joined is None:
+                ticket = {'priority': priority, 'granted': False}
+                future = Future()
+                self.in_flight[key] = (future, ticket)
+            else:
+                future, ticket = joined
+                self.counts[priority]['deduplicated'] += 1
+                if not ticket['granted'] and priority < ticket['priority']:
+                    ticket['priority'] = priority
+                    self.push(ticket)
+                    self.condition.notify_all()
+        if joined is not None:
+            return future.result()
+
+        try:
+            self.acquire(ticket)
+            future.set_result(send())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.condition:
+                del self.in_flight[key]
+        return future.result()
+
+    def push(self, ticket):
+        heapq.heappush(self.queue, (ticket['priority'], self.sequence, ticket))
+        self.sequence += 1
+
+    def acquire(self, ticket):
+        """ Wait until ticket is the highest priority request waiting and
+        there's a token for it. """
+        start = time.monotonic()
+        with self.condition:
+            self.push(ticket)
+            while True:
+                while self.queue[0][2]['granted']:
+                    heapq.heappop(self.queue)
+                now = time.monotonic()
+                self.refill(now)
+                at_head = self.queue[0][2] is ticket
+                if at_head and (self.rate is None or self.tokens >= 1):
+                    heapq.heappop(self.queue)
+                    ticket['granted'] = True
+                    if self.rate is not None:
+                        self.tokens -= 1
+                    priority = ticket['priority']
+                    self.counts[priority]['requests'] += 1
+                    self.counts[priority]['total_wait'] += now - start
+                    self.waits[priority].append(now - start)
+                    # the next request may now be at the head
+                    self.condition.notify_all()
+                    return
+                # the head waits for the next token, the rest for the head
+                self.condition.wait((1 - self.tokens) / self.rate if at_head else None)
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def queue_depths(self):
+        """ Number of requests waiting at each priority. """
+        with self.condition:
+            depths = {name: 0 for name in Priority.NAMES.values()}
+            for _, _, ticket in self.queue:
+                if not ticket['granted']:
+                    depths[Priority.NAMES[ticket['priority']]] += 1
+            return depths
+
+    def stats(self):
+        """ For each priority: the requests sent, the requests that joined
+        an identical one, and the seconds requests spent queued (mean, p95
+        and max over the last HISTORY_LEN). """
+        stats = {}
+        with self.condition:
+            for priority, name in Priority.NAMES.items():
+                counts = self.counts[priority]
+                waits = sorted(self.waits[priority])
+                stats[name] = dict(counts, mean_wait=(counts['total_wait'] / counts['requests']
+                                                      if counts['requests'] else None))
+                for percentile, fraction in [('p95_wait', 0.95), ('max_wait', 1.0)]:
+                    stats[name][percentile] = (
+                        waits[min(int(fraction * len(waits)), len(waits) - 1)]
+                        if waits else None)
+        return stats
@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+
+
+class CachedResponse:
+    """A rendered response body, with its gzipped copy and strong ETags."""
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        # mtime=0 so every worker compresses a page to the same bytes
+        self.gzipped = gzip.compress(body, mtime=0)
+        self.mimetype = mimetype
+        # derived from the body, so every worker gives a page the same ETag.
+        # The gzipped copy is a different representation, so has its own.
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.etag = digest
+        self.gzip_etag = digest + '-gzip'
+
+
+class ResponseCache:
+    """Cache of rendered pages, keyed by page and the snapshot version of
+    the data they show (see util.snapshots.Snapshot.event_version).
+
+    A lookup only hits if the page was rendered from the same version, so
+    a page is rendered again exactly when its data changes, and between
+    changes serving it costs a dict lookup. There's one entry per page,
+    replaced when it's rendered from a newer version, so the cache never
+    holds more than the pages there are.
+
+    Shared by the request threads without a lock: getting and replacing a
+    dict entry are atomic, and at worst two threads render the same page
+    at once. The counters may miss a few updates under contention.
+    """
+
+    def __init__(self):
+        # page key -> (version, CachedResponse)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        """ The cached response for key, or None if there isn't one rendered
+        from version. """
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, version, body, mimetype):
+        """ Cache body (a str or bytes) as key's response at version.
+        Returns:
+            The CachedResponse.
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        cached = CachedResponse(body, mimetype)
+        self.entries[key] = (version, cached)
+        return cached
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations}
@@ -0,0 +1,272 @@
+from collections import OrderedDict
+import glob
+import mmap
+import os
+import pickle
+import struct
+import time
+
+# a snapshot file starts with the length of its header
+HEADER_LENGTH = struct.Struct('<Q')
+
+
+class FrozenDict(dict):
+    """A dict that can't be changed once it's made."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('FrozenDict is immutable')
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value):
+    """ A deep copy of value that can't be changed: dicts become FrozenDicts
+    and lists tuples. """
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+class Snapshot():
+    """A consistent, immutable view of every event's event_dict and the
+    ratings at one point in time. Request threads read whichever snapshot
+    is current without locking, as nothing in it ever changes; a new one is
+    published by replacing the reference to it (see SnapshotBuilder), and
+    old ones are freed once the last request using them is done.
+    """
+
+    def __init__(self, version, events, event_versions, events_version, ratings):
+        self.version = version
+        # event code -> frozen event_dict
+        self.events = events
+        # event code -> version of the snapshot its event_dict last changed in
+        self.event_versions = event_versions
+        # version of the snapshot any event last changed in
+        self.events_version = events_version
+        self._ratings = ratings
+
+    @property
+    def event_codes(self):
+        return list(self.events)
+
+    def has_event(self, event_code):
+        return event_code in self.events
+
+    def event(self, event_code):
+        """ The event_dict of event_code.
+        Raises:
+            KeyError: if there's no such event.
+        """
+        return self.events[event_code]
+
+    def event_version(self, event_code):
+        return self.event_versions[event_code]
+
+    def ratings(self):
+        """ FrozenDict of team -> Elo rating. """
+        return self._ratings
+
+
+class SnapshotBuilder():
+    """Builds each new Snapshot from the live events, copying only the
+    event_dicts that have changed since the last one.
+
+    Events replace their event_dict with a new dict whenever anything
+    changes, and keep the same one when nothing has (see
+    Event.update_matches), so an event_dict that's the same object as last
+    time is unchanged, and its frozen copy and version are reused.
+    """
+
+    def __init__(self):
+        # versions from an earlier run mean something else, so every
+        # version includes when this builder was made
+        self.epoch = time.time_ns()
+        self.num_built = 0
+        # event code -> (event_dict last frozen, frozen copy, version)
+        self.frozen = {}
+        self.events_version = None
+        self.event_codes = None
+
+    def build(self, events, ratings):
+        """ Must be called holding the lock that keeps events and ratings
+        consistent.
+        Args:
+            events: OrderedDict of event code -> event_dict.
+            ratings: dict of team -> Elo rating.
+        """
+        self.num_built += 1
+        version = '%s-%s' % (self.epoch, self.num_built)
+        frozen_events = OrderedDict()
+        event_versions = {}
+        event_codes = list(events)
+        if event_codes != self.event_codes:
+            self.event_codes = event_codes
+            self.events_version = version
+        for event_code, event_dict in events.items():
+            source, frozen, event_version = self.frozen.get(event_code, (None, None, None))
+            if source is not event_dict:
+                frozen, event_version = freeze(event_dict), version
+                # keeping the source means its id can't be reused by another
+                # dict, so the identity check is safe
+                self.frozen[event_code] = (event_dict, frozen, event_version)
+                self.events_version = version
+            frozen_events[event_code] = frozen
+            event_versions[event_code] = event_version
+        return Snapshot(version, FrozenDict(frozen_events), FrozenDict(event_versions),
+                        self.events_version, FrozenDict(ratings))
+
+
+class SnapshotWriter():
+    """Writes Snapshots to a directory, for web worker processes to read
+    (see SnapshotReader).
+
+    Each snapshot is one file: a header indexing where each event's pickled
+    event_dict is, followed by the pickles, so a reader only unpickles the
+    events it's asked for. Files are written in full and then named in
+    CURRENT_FILE, which is replaced atomically, so readers never see a
+    partly written snapshot. The newest `keep` snapshots are kept, so
+    readers have time to move on from the one they have open (on POSIX an
+    open memory map stays valid even once its file is removed).
+
+    Events are only pickled again when their version changes.
+    """
+
+    CURRENT_FILE = 'CURRENT'
+    FILE_PATTERN = 'snapshot-%s-%08d.p'
+    KEEP = 3
+
+    def __init__(self, directory, keep=None):
+        self.directory = directory
+        self.keep = self.KEEP if keep is None else keep
+        self.num_written = 0
+        # event code -> (version, pickled event_dict)
+        self.event_blobs = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, snapshot):
+        """ Write snapshot, and make it current. """
+        event_blobs = []
+        for event_code in snapshot.event_codes:
+            event_version = snapshot.event_version(event_code)
+            cached_version, blob = self.event_blobs.get(event_code, (None, None))
+            if cached_version != event_version:
+                blob = pickle.dumps(snapshot.event(event_code), pickle.HIGHEST_PROTOCOL)
+                self.event_blobs[event_code] = (event_version, blob)
+            event_blobs.append(blob)
+        ratings_blob = pickle.dumps(snapshot.ratings(), pickle.HIGHEST_PROTOCOL)
+
+        event_index = OrderedDict()
+        offset = 0
+        for event_code, blob in zip(snapshot.event_codes, event_blobs):
+            event_index[event_code] = (offset, len(blob), snapshot.event_version(event_code))
+            offset += len(blob)
+        header = pickle.dumps({'version': snapshot.version, 'events': event_index,
+                               'events_version': snapshot.events_version,
+                               'ratings': (offset, len(ratings_blob))},
+                              pickle.HIGHEST_PROTOCOL)
+
+        self.num_written += 1
+        file_name = self.FILE_PATTERN % (time.time_ns(), self.num_written)
+        path = os.path.join(self.directory, file_name)
+        with open(path + '.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(HEADER_LENGTH.pack(len(header)))
+            snapshot_file.write(header)
+            for blob in event_blobs:
+                snapshot_file.write(blob)
+            snapshot_file.write(ratings_blob)
+        os.replace(path + '.tmp', path)
+
+        current = os.path.join(self.directory, self.CURRENT_FILE)
+        with open(current + '.tmp', 'w') as current_file:
+            current_file.write(file_name)
+        os.replace(current + '.tmp', current)
+
+        # named so they sort oldest first
+        snapshots = sorted(glob.glob(os.path.join(self.directory, 'snapshot-*.p')))
+        for old_path in snapshots[:-self.keep]:
+            if old_path != path:
+                os.remove(old_path)
+
+
+class MappedSnapshot():
+    """A Snapshot written by SnapshotWriter, memory mapped read-only. Events
+    are unpickled the first time they're asked for."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_length, = HEADER_LENGTH.unpack_from(self.mmap, 0)
+        self.body_start = HEADER_LENGTH.size + header_length
+        header = pickle.loads(self.mmap[HEADER_LENGTH.size:self.body_start])
+        self.version = header['version']
+        self.event_index = header['events']
+        self.events_version = header['events_version']
+        self.ratings_location = header['ratings']
+        self.decoded = {}
+
+    def load(self, location):
+        offset, length = location[:2]
+        start = self.body_start + offset
+        return pickle.loads(self.mmap[start:start + length])
+
+    @property
+    def event_codes(self):
+        return list(self.event_index)
+
+    def has_event(self, event_code):
+        return event_code in self.event_index
+
+    def event(self, event_code):
+        """ The event_dict of event_code.
+        Raises:
+            KeyError: if there's no such event.
+        """
+        event_dict = self.decoded.get(event_code)
+        if event_dict is None:
+            event_dict = self.load(self.event_index[event_code])
+            self.decoded[event_code] = event_dict
+        return event_dict
+
+    def event_version(self, event_code):
+        return self.event_index[event_code][2]
+
+    def ratings(self):
+        """ FrozenDict of team -> Elo rating. """
+        return self.load(self.ratings_location)
+
+
+class SnapshotReader():
+    """Gives a web worker the current snapshot written by a SnapshotWriter
+    to directory. Checking for a new snapshot is one stat() call."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.current_file = os.path.join(directory, SnapshotWriter.CURRENT_FILE)
+        self.current_stat = None
+        self.snapshot = None
+
+    def current(self):
+        """ The newest snapshot, or None if none has been written yet. """
+        try:
+            stat = os.stat(self.current_file)
+        except FileNotFoundError:
+            return None
+        stat_key = (stat.st_ino, stat.st_mtime_ns)
+        if stat_key != self.current_stat:
+            with open(self.current_file, 'r') as current_file:
+                file_name = current_file.read().strip()
+            # replaced in one assignment, so threads reading the old snapshot
+            # aren't affected
+            self.snapshot = MappedSnapshot(os.path.join(self.directory, file_name))
+            self.current_stat = stat_key
+        return self.snapshot
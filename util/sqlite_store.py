@@ -0,0 +1,344 @@
+import json
+import os
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from typing import Dict, List
+
+from util.data_store import DataStore, LazyYears
+from util.match_archive import MatchArchive
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS years (
+    year INTEGER PRIMARY KEY,
+    -- bumped whenever the year's matches change
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    event_code TEXT PRIMARY KEY,
+    year INTEGER NOT NULL,
+    -- chronological order within the year
+    position INTEGER NOT NULL,
+    has_matches INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS events_year ON events (year, position);
+CREATE TABLE IF NOT EXISTS event_metadata (
+    event_code TEXT PRIMARY KEY,
+    year INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS matches (
+    match_id INTEGER PRIMARY KEY,
+    match_key TEXT,
+    event_code TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    -- order within the event
+    position INTEGER NOT NULL,
+    comp_level TEXT,
+    set_number INTEGER,
+    match_number INTEGER,
+    time INTEGER,
+    blue_score INTEGER,
+    red_score INTEGER,
+    -- the whole TBA match, as JSON
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_event ON matches (event_code, position);
+CREATE INDEX IF NOT EXISTS matches_year ON matches (year);
+CREATE TABLE IF NOT EXISTS alliance_teams (
+    match_id INTEGER NOT NULL REFERENCES matches (match_id),
+    team TEXT NOT NULL,
+    alliance TEXT NOT NULL,
+    surrogate INTEGER NOT NULL,
+    event_code TEXT NOT NULL,
+    year INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alliance_teams_team ON alliance_teams (team, year, event_code);
+CREATE INDEX IF NOT EXISTS alliance_teams_match ON alliance_teams (match_id);
+'''
+
+
+def team_key(team) -> str:
+    """ TBA's key for team, given as either a number or a key. """
+    return team if isinstance(team, str) and team.startswith('frc') else 'frc%s' % team
+
+
+class SQLiteDataStore(object):
+    """Stores matches and metadata for each event in an SQLite database.
+
+    Has the same interface as DataStore, but keeps each match's teams in an
+    indexed table, so the matches and events of a team can be found without
+    reading every year. Matches are kept whole as JSON alongside the columns
+    they're queried by.
+
+    Safe to use from several threads; queries and writes are serialised on
+    one connection.
+    """
+
+    DATABASE_FILE = 'matches.sqlite'
+
+    def __init__(self, path: str = 'cache/' + DATABASE_FILE,
+                 new_data_store: bool = False, year_events: Dict[int, list] = {},
+                 metadata_years: List[int] = [], max_resident_years: int = None):
+        """Open (creating if needed) the database at path.
+        Args:
+            path: Path of the database file.
+            new_data_store: Set to True to replace everything in the database
+            with the events of year_events, as for DataStore.
+            year_events: For a new data store, the events of each year, in
+            chronological order.
+            metadata_years: The years to store event metadata for.
+            max_resident_years: Most years of matches (and of metadata) to
+            keep loaded in data and metadata. Defaults to
+            DataStore.MAX_RESIDENT_YEARS.
+        """
+        self.path = path
+        self.cache_directory = os.path.dirname(path) or '.'
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+        if new_data_store:
+            with self.lock, self.connection:
+                for table in ['alliance_teams', 'matches', 'event_metadata', 'events',
+                              'years']:
+                    self.connection.execute('DELETE FROM %s' % table)
+                for year, events in year_events.items():
+                    self.connection.execute('INSERT INTO years VALUES (?, 0)', (year,))
+                    self.connection.executemany(
+                        'INSERT INTO events (event_code, year, position) VALUES (?, ?, ?)',
+                        [(event_code, year, i) for i, event_code in enumerate(events)])
+
+        if max_resident_years is None:
+            max_resident_years = DataStore.MAX_RESIDENT_YEARS
+        # the same view of the data as DataStore.data and DataStore.metadata
+        self.data = LazyYears(self.query_column('SELECT year FROM years ORDER BY year'),
+                              self.load_matches, max_resident_years)
+        self.metadata = (LazyYears(metadata_years, self.load_metadata, max_resident_years)
+                         if metadata_years else None)
+
+    def query(self, sql: str, parameters=()) -> List:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def query_column(self, sql: str, parameters=()) -> List:
+        return [row[0] for row in self.query(sql, parameters)]
+
+    def load_matches(self, year: int) -> OrderedDict:
+        year_odict = OrderedDict(
+            (event_code, [] if has_matches else None) for event_code, has_matches in self.query(
+                'SELECT event_code, has_matches FROM events WHERE year = ? ORDER BY position',
+                (year,)))
+        for event_code, data in self.query(
+                'SELECT event_code, data FROM matches WHERE year = ? ORDER BY position',
+                (year,)):
+            year_odict[event_code].append(json.loads(data))
+        return year_odict
+
+    def load_metadata(self, year: int) -> OrderedDict:
+        return OrderedDict(
+            (event_code, json.loads(data)) for event_code, data in self.query(
+                'SELECT event_code, data FROM event_metadata WHERE year = ?', (year,)))
+
+    def add_event_metadata(self, year: int, event_code: str, data: Dict):
+        self.metadata[year][event_code] = data
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO event_metadata VALUES (?, ?, ?)',
+                                    (event_code, year, json.dumps(data)))
+
+    def add_event_matches(self, year: int, event_code: str, matches: List):
+        """ Add matches to the data store, replacing any matches already
+        stored for event_code. See DataStore.add_event_matches. """
+        self.data[year][event_code] = matches
+        with self.lock, self.connection:
+            self.insert_event_matches(year, event_code, matches)
+
+    def insert_event_matches(self, year: int, event_code: str, matches: List):
+        """ Replace event_code's matches. Must be called holding the lock, in a
+        transaction. """
+        connection = self.connection
+        connection.execute('INSERT OR IGNORE INTO years VALUES (?, 0)', (year,))
+        connection.execute('UPDATE years SET version = version + 1 WHERE year = ?', (year,))
+        # events not added with the data store go after the year's other events
+        connection.execute(
+            'INSERT OR IGNORE INTO events (event_code, year, position) '
+            'SELECT ?, ?, COALESCE(MAX(position) + 1, 0) FROM events WHERE year = ?',
+            (event_code, year, year))
+        connection.execute('UPDATE events SET has_matches = 1 WHERE event_code = ?',
+                           (event_code,))
+        connection.execute('DELETE FROM alliance_teams WHERE match_id IN '
+                           '(SELECT match_id FROM matches WHERE event_code = ?)', (event_code,))
+        connection.execute('DELETE FROM matches WHERE event_code = ?', (event_code,))
+
+        alliance_rows = []
+        for position, match in enumerate(matches):
+            alliances = match.get('alliances', {})
+            cursor = connection.execute(
+                'INSERT INTO matches (match_key, event_code, year, position, comp_level, '
+                'set_number, match_number, time, blue_score, red_score, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (match.get('key'), event_code, year, position, match.get('comp_level'),
+                 match.get('set_number'), match.get('match_number'), match.get('time'),
+                 alliances.get('blue', {}).get('score'), alliances.get('red', {}).get('score'),
+                 json.dumps(match)))
+            for alliance_name, alliance in alliances.items():
+                surrogates = alliance.get('surrogate_team_keys') or []
+                for team in alliance.get('team_keys', []):
+                    alliance_rows.append((cursor.lastrowid, team, alliance_name,
+                                          team in surrogates, event_code, year))
+        connection.executemany('INSERT INTO alliance_teams VALUES (?, ?, ?, ?, ?, ?)',
+                               alliance_rows)
+
+    def import_data_store(self, data_store: DataStore):
+        """ Copy all the events, matches and metadata in data_store into the
+        database, a transaction per year. """
+        for year in data_store.data:
+            year_events = data_store.data[year]
+            with self.lock, self.connection:
+                self.connection.execute('INSERT OR IGNORE INTO years VALUES (?, 0)', (year,))
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO events (event_code, year, position) '
+                    'VALUES (?, ?, ?)',
+                    [(event_code, year, i) for i, event_code in enumerate(year_events)])
+                for event_code, matches in year_events.items():
+                    if matches is not None:
+                        self.insert_event_matches(year, event_code, matches)
+            self.data.put(year, year_events)
+        if data_store.metadata is not None:
+            for year in data_store.metadata:
+                with self.lock, self.connection:
+                    self.connection.executemany(
+                        'INSERT OR REPLACE INTO event_metadata VALUES (?, ?, ?)',
+                        [(event_code, year, json.dumps(data))
+                         for event_code, data in data_store.metadata[year].items()])
+
+    def get_year_events(self, year: int) -> List[str]:
+        """ Get the list of event codes for a year, in chronological order. """
+        return self.data[year].keys()
+
+    def get_event_matches(self, event_year: int, event_code: str) -> List:
+        """ Get the list of matches of event_code, `[]` if none have been
+        added. """
+        event_match_data = self.data[event_year][event_code]
+        return [] if event_match_data is None else event_match_data
+
+    def iter_year_events(self, year: int):
+        """ Stream year's matches an event at a time, in chronological order.
+        Reads through its own connection, so only one event's matches are in
+        memory at once and other threads aren't blocked meanwhile.
+        Yields:
+            (event code, list of matches), with `[]` for events with no
+            matches added.
+        """
+        connection = sqlite3.connect(self.path)
+        try:
+            rows = connection.execute(
+                'SELECT events.event_code, matches.data FROM events '
+                'LEFT JOIN matches ON matches.event_code = events.event_code '
+                'WHERE events.year = ? ORDER BY events.position, matches.position', (year,))
+            event_code = None
+            matches = []
+            for row_event_code, data in rows:
+                if row_event_code != event_code:
+                    if event_code is not None:
+                        yield event_code, matches
+                    event_code = row_event_code
+                    matches = []
+                if data is not None:
+                    matches.append(json.loads(data))
+            if event_code is not None:
+                yield event_code, matches
+        finally:
+            connection.close()
+
+    def iter_events(self, years: List[int] = None):
+        """ Stream the matches of years (by default all of them) an event at
+        a time, in chronological order. See DataStore.iter_events. """
+        for year in list(self.data) if years is None else years:
+            for event_code, matches in self.iter_year_events(year):
+                yield year, event_code, matches
+
+    def get_event_metadata(self, event_year: int, event_code: str) -> Dict:
+        return self.metadata[event_year].get(event_code)
+
+    def year_fingerprint(self, year: int) -> str:
+        """ Get a fingerprint of year's matches, which changes whenever they
+        do, or None if there are none. See DataStore.year_fingerprint. """
+        versions = self.query_column('SELECT version FROM years WHERE year = ?', (year,))
+        if not versions:
+            return None
+        return 'sqlite-%s-%s' % (os.path.abspath(self.path), versions[0])
+
+    def archive_directory(self, year: int) -> str:
+        return os.path.join(self.cache_directory,
+                            '%s%s' % (year, DataStore.ARCHIVE_DIRECTORY_EXTENSION))
+
+    def get_year_archive(self, year: int):
+        """ The up to date MatchArchive of year, or None. See
+        DataStore.get_year_archive. """
+        fingerprint = self.year_fingerprint(year)
+        if fingerprint is None:
+            return None
+        archive = MatchArchive.load(self.archive_directory(year))
+        if archive is None or archive.source_fingerprint != fingerprint:
+            return None
+        return archive
+
+    def write_year_archive(self, year: int):
+        archive = MatchArchive.from_year_events(self.data[year], self.year_fingerprint(year))
+        archive.save(self.archive_directory(year))
+        return MatchArchive.load(self.archive_directory(year))
+
+    def stats(self) -> Dict:
+        return {'matches': self.data.stats(),
+                'metadata': self.metadata.stats() if self.metadata is not None else None}
+
+    def team_matches(self, team, year: int = None) -> List:
+        """ Every match team has played in (or is scheduled to), in
+        chronological order, optionally only those in year. """
+        sql = ('SELECT matches.data FROM alliance_teams '
+               'JOIN matches ON matches.match_id = alliance_teams.match_id '
+               'JOIN events ON events.event_code = alliance_teams.event_code '
+               'WHERE alliance_teams.team = ?')
+        parameters = [team_key(team)]
+        if year is not None:
+            sql += ' AND alliance_teams.year = ?'
+            parameters.append(year)
+        sql += ' ORDER BY alliance_teams.year, events.position, matches.position'
+        return [json.loads(data) for data in self.query_column(sql, parameters)]
+
+    def team_events(self, team, year: int) -> List[str]:
+        """ The codes of the events team has matches at in year, in
+        chronological order. """
+        return self.query_column(
+            'SELECT DISTINCT events.event_code FROM alliance_teams '
+            'JOIN events ON events.event_code = alliance_teams.event_code '
+            'WHERE alliance_teams.team = ? AND alliance_teams.year = ? '
+            'ORDER BY events.position', (team_key(team), year))
+
+    def team_years(self, team) -> List[int]:
+        """ The years team has matches in. """
+        return self.query_column('SELECT DISTINCT year FROM alliance_teams WHERE team = ? '
+                                 'ORDER BY year', (team_key(team),))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+if __name__ == '__main__':
+    # Build the database from the pickle cache, eg
+    # `python -m util.sqlite_store cache`
+    import sys
+    import time
+
+    cache_directory = sys.argv[1] if len(sys.argv) > 1 else 'cache'
+    data_store = DataStore(cache_directory=cache_directory)
+    start = time.perf_counter()
+    store = SQLiteDataStore(os.path.join(cache_directory, SQLiteDataStore.DATABASE_FILE),
+                            new_data_store=True)
+    store.import_data_store(data_store)
+    print("Imported %s years in %.1fs" % (len(store.data), time.perf_counter() - start))
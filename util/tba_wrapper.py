@@ -1,46 +1,244 @@
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
-from collections import OrderedDict
+from urllib3.util.retry import Retry
+from collections import OrderedDict, deque, namedtuple
+from util.backfill import Backfill
 from util.data_store import DataStore
+from util.request_scheduler import Priority, RequestScheduler
 import os
+import re
+import threading
+import time
+
+# A TBA response we've already fetched and parsed. fresh_until is the
+# time.monotonic() time until which max-age says it can be reused without
+# asking TBA at all.
+CachedResponse = namedtuple('CachedResponse', ['data', 'etag', 'last_modified',
+                                               'fresh_until'])
+
+
+class RequestStats():
+    """Latency statistics for the requests made by a BlueAllianceWrapper."""
+
+    # number of recent request latencies kept for the percentiles
+    HISTORY_LEN = 1000
+
+    def __init__(self):
+        self.num_requests = 0
+        self.num_errors = 0
+        self.total_time = 0.0
+        self.latencies = deque([], maxlen=self.HISTORY_LEN)
+        # requests can be made from several threads at once
+        self.lock = threading.Lock()
+
+    def record(self, latency, error=False):
+        with self.lock:
+            self.num_requests += 1
+            self.num_errors += 1 if error else 0
+            self.total_time += latency
+            self.latencies.append(latency)
+
+    def summary(self):
+        """ Summary of the request latencies in seconds, with percentiles
+        over the last HISTORY_LEN requests. """
+        summary = {'requests': self.num_requests, 'errors': self.num_errors,
+                   'mean': self.total_time / self.num_requests if self.num_requests else None}
+        with self.lock:
+            latencies = sorted(self.latencies)
+        for name, fraction in [('p50', 0.5), ('p95', 0.95), ('max', 1.0)]:
+            summary[name] = (latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+                             if latencies else None)
+        return summary
 
 
 class BlueAllianceWrapper():
 
-    TBA_API = 'http://www.thebluealliance.com/api/v3'
+    TBA_API = 'https://www.thebluealliance.com/api/v3'
+
+    # server errors worth retrying, as they're usually transient
+    RETRY_STATUSES = (500, 502, 503, 504)
 
-    def __init__(self, tba_auth_key):
+    # in the cache directory once it holds every past match, so the cache can
+    # be trusted rather than asking TBA
+    TRUSTED_CACHE_FILE = 'data_store.txt'
+    # seasons backfilled into a new data store
+    BACKFILL_YEARS = range(2008, 2019)
+    # requests a second sent to TBA, on average and in a burst
+    RATE = 20
+    BURST = 40
+
+    def __init__(self, tba_auth_key, pool_size=10, timeout=10, max_retries=3,
+                 backoff_factor=0.5, api_url=None, cache_directory='cache',
+                 rate=RATE, burst=BURST):
+        """
+        Args:
+            tba_auth_key: The Blue Alliance API read key.
+            pool_size: The number of connections to TBA kept open for reuse.
+            timeout: Seconds to wait to connect to and hear back from TBA.
+            max_retries: Times to retry a request that fails to connect or
+            gets a server error.
+            backoff_factor: Retries wait backoff_factor * 2^(retry number - 1)
+            seconds before trying again.
+            api_url: The TBA API to use, by default TBA_API.
+            cache_directory: Where the data store is kept.
+            rate: Most requests a second sent to TBA (see RequestScheduler),
+            or None for no limit.
+            burst: Most requests sent at once before rate applies.
+        """
 
         self.tba_key = tba_auth_key
+        self.api_url = self.TBA_API if api_url is None else api_url.rstrip('/')
+        self.cache_directory = cache_directory
         self.headers = {'X-TBA-App-Id': 'Arthur Allshire:Antelope',
                         'X-TBA-Auth-Key': self.tba_key}
-        new_ds = not os.path.isfile('cache/data_store.txt')
+        self.timeout = timeout
+        self.request_stats = RequestStats()
+        self.scheduler = RequestScheduler(rate, burst)
+        # URL -> CachedResponse, for conditional requests
+        self.response_cache = {}
+
+        # one session for every request, so connections are kept alive and
+        # reused rather than opening a new connection for each request
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        retry = Retry(total=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=self.RETRY_STATUSES, raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                   max_retries=retry)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        new_ds = not self.cache_trusted()
         if new_ds:
             print('Creating new data store')
-            years = range(2008, 2019)
-            year_events = {}
-            for year in years:
-                print('Fetching year events for %s' % year)
-                events = self.get_year_events(year)
-                year_events[year] = [event['key'] for event in events]
-            self.data_store = DataStore(new_data_store=True, year_events=year_events,
-                                        metadata_years=[2017, 2018])
+            self.data_store = Backfill(self, self.BACKFILL_YEARS,
+                                       metadata_years=[2017, 2018]).run()
         else:
-            self.data_store = DataStore(metadata_years=[2017, 2018])
+            self.data_store = DataStore(cache_directory=cache_directory,
+                                        metadata_years=[2017, 2018])
+
+    def cache_trusted(self):
+        """ Whether the data store holds every past match (see Backfill). """
+        return os.path.isfile(os.path.join(self.cache_directory, self.TRUSTED_CACHE_FILE))
+
+    def mark_cache_trusted(self):
+        with open(os.path.join(self.cache_directory, self.TRUSTED_CACHE_FILE), 'w') as marker:
+            marker.write('%s\n' % time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def request(self, request_url, headers=None, priority=Priority.NEAR_TERM):
+        """ GET request_url from TBA through the pooled session, recording
+        how long it took. The request waits its turn in self.scheduler, and
+        callers making an identical request at the same time share one. """
+        key = (request_url, tuple(sorted((headers or {}).items())))
+        return self.scheduler.run(key, lambda: self.send(request_url, headers), priority)
+
+    def send(self, request_url, headers=None):
+        start = time.monotonic()
+        try:
+            response = self.session.get(request_url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            self.request_stats.record(time.monotonic() - start, error=True)
+            raise
+        self.request_stats.record(time.monotonic() - start,
+                                  error=response.status_code >= 400)
+        return response
+
+    def fetch_json(self, request_url, priority=Priority.NEAR_TERM):
+        """ Fetch and decode a JSON response from TBA, without caching it.
+        Raises:
+            HTTPError: if TBA returns an error status.
+        """
+        response = self.request(request_url, priority=priority)
+        response.raise_for_status()
+        return response.json()
+
+    def get_json(self, request_url, parse=None, priority=Priority.NEAR_TERM):
+        """ Fetch and decode a JSON response from TBA, reusing the last
+        response for request_url if it hasn't changed.
+
+        Responses are cached with their ETag and Last-Modified headers, which
+        are sent back to TBA so it can answer 304 Not Modified instead of
+        resending the data. Within the response's Cache-Control max-age, the
+        cached response is used without asking TBA at all.
+        Args:
+            request_url: The URL to fetch.
+            parse: Optional function applied to the decoded JSON. It is only
+            called when the data has changed, and its result is what gets
+            cached.
+            priority: The request's Priority.
+        Returns:
+            (data, changed), where changed is False if data is the same
+            object returned last time.
+        Raises:
+            HTTPError: if TBA returns an error status.
+        """
+        cached = self.response_cache.get(request_url)
+        if cached is not None and time.monotonic() < cached.fresh_until:
+            return cached.data, False
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+        response = self.request(request_url, headers=headers, priority=priority)
+
+        if response.status_code == 304 and cached is not None:
+            self.response_cache[request_url] = cached._replace(
+                fresh_until=self.fresh_until(response))
+            return cached.data, False
+
+        response.raise_for_status()
+        data = response.json()
+        if parse is not None:
+            data = parse(data)
+        self.response_cache[request_url] = CachedResponse(
+            data=data, etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            fresh_until=self.fresh_until(response))
+        return data, True
+
+    def expire_event(self, event_code):
+        """ Make the next requests for event_code's data ask TBA again, even
+        if max-age said the cached responses could be reused (they're still
+        revalidated, so TBA can answer 304 if nothing has changed). Used
+        when a webhook says the event has changed. """
+        event_url = self.api_url + '/event/' + event_code
+        for request_url in [event_url, event_url + '/matches', event_url + '/alliances']:
+            cached = self.response_cache.get(request_url)
+            if cached is not None:
+                self.response_cache[request_url] = cached._replace(fresh_until=0.0)
+
+    @staticmethod
+    def fresh_until(response):
+        """ Time until which response can be reused without revalidating it,
+        from its Cache-Control header. """
+        cache_control = response.headers.get('Cache-Control', '')
+        max_age = re.search(r'max-age=(\d+)', cache_control)
+        if max_age is None or 'no-cache' in cache_control or 'no-store' in cache_control:
+            return 0.0
+        return time.monotonic() + int(max_age.group(1))
+
+    def num_connections(self):
+        """ Number of connections opened to TBA so far. Compared to the number
+        of requests, this shows how often connections are being reused. """
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
 
     def get_year_events(self, year):
         year = str(year) if type(year) is int else year
-        request_url = self.TBA_API + "/events/" + year
-        events = requests.get(request_url, headers=self.headers)
+        request_url = self.api_url + "/events/" + year
         try:
-            events.raise_for_status()
-        except HTTPError:
+            events, _ = self.get_json(request_url)
+        except HTTPError as error:
             print("Attempt to get %s matches failed with HTTP error %s"
-                  % (year, events.status_code))
+                  % (year, error.response.status_code))
             print("Request URL: %s" % (request_url))
             raise
         events_sorted = sorted(
-                events.json(), key=lambda x: x["start_date"])
+                events, key=lambda x: x["start_date"])
         return events_sorted
 
     def is_cached(self, event_code):
@@ -49,16 +247,24 @@ class BlueAllianceWrapper():
         cached_metadata = self.data_store.get_event_metadata(ev_year, event_code)
         return cached_matches is not None and cached_metadata is not None
 
-    def get_event_matches(self, event_code):
+    def get_event_matches(self, event_code, return_changed=False,
+                          priority=Priority.NEAR_TERM):
+        """ Get the matches for event_code, sorted by match number.
+        Args:
+            return_changed: If True, return (matches, changed), where changed
+            is False if the matches are unchanged since the last call.
+            priority: The Priority of any request to TBA.
+        """
         ev_year = int(event_code[:4])
         cached_matches = self.data_store.get_event_matches(ev_year, event_code)
-        if cached_matches is None:
+        if not cached_matches:
             print("Request made for matches")
-            request_url = self.TBA_API + '/event/' + event_code + '/matches'
-            matches = requests.get(request_url, headers=self.headers)
-            sorted_matches = self.sort_by_match_number(matches.json())
-            return sorted_matches
-        return cached_matches
+            request_url = self.api_url + '/event/' + event_code + '/matches'
+            matches, changed = self.get_json(request_url, parse=self.sort_by_match_number,
+                                             priority=priority)
+        else:
+            matches, changed = cached_matches, True
+        return (matches, changed) if return_changed else matches
 
     def cache_matches(self, event_code, matches, event_metadata=None):
         ev_year = int(event_code[:4])
@@ -66,34 +272,94 @@ class BlueAllianceWrapper():
         if event_metadata is not None:
             self.data_store.add_event_metadata(ev_year, event_code, event_metadata)
 
-    def get_raw_event(self, event_code):
+    def get_raw_event(self, event_code, return_changed=False, priority=Priority.NEAR_TERM):
+        """ Get TBA's event metadata for event_code.
+        Args:
+            return_changed: If True, return (event, changed), where changed is
+            False if the metadata is unchanged since the last call.
+            priority: The Priority of any request to TBA.
+        """
         ev_year = int(event_code[:4])
         cached_metadata = self.data_store.get_event_metadata(ev_year, event_code)
         if cached_metadata is None:
-            request_url = self.TBA_API + '/event/' + event_code
-            event = requests.get(request_url, headers=self.headers)
-            return event.json()
-        return cached_metadata
+            request_url = self.api_url + '/event/' + event_code
+            event, changed = self.get_json(request_url, priority=priority)
+        else:
+            event, changed = cached_metadata, True
+        return (event, changed) if return_changed else event
 
     def get_year_matches(self, year):
         year = str(year) if type(year) is int else year
-        events = self.get_year_events(year)
-        event_matches = OrderedDict()
-        trust_cache = os.path.isfile('cache/data_store.txt')
+        trust_cache = self.cache_trusted()
         if trust_cache:
             return self.data_store.data[int(year)]
-        else:
-            for event in events:
-                print('Fetching matches for %s' % event['event_code'])
-                event_matches[year + event['event_code']] = \
-                    self.get_event_matches(year + event['event_code'])
+        return OrderedDict(self.iter_year_matches(year))
+
+    def iter_year_matches(self, year):
+        """ Stream year's matches an event at a time, in chronological order,
+        from the cache if it's trusted, otherwise fetching each event's
+        matches as it's reached.
+        Yields:
+            (event code, list of matches)
+        """
+        year = str(year) if type(year) is int else year
+        if self.cache_trusted():
+            yield from self.data_store.iter_year_events(int(year))
+            return
+        for event in self.get_year_events(year):
+            print('Fetching matches for %s' % event['event_code'])
+            yield year + event['event_code'], self.get_event_matches(year + event['event_code'])
+
+    def iter_matches(self, years):
+        """ Stream the matches of years an event at a time, in chronological
+        order. See iter_year_matches.
+        Yields:
+            (year, event code, list of matches)
+        """
+        for year in years:
+            for event_code, matches in self.iter_year_matches(year):
+                yield int(year), event_code, matches
 
-        return event_matches
+    def get_year_matches_fingerprint(self, year):
+        """ Fingerprint of the matches get_year_matches would return for year,
+        or None if they would not come from the cache (and so can't be
+        fingerprinted without fetching them). """
+        if not self.cache_trusted():
+            return None
+        return self.data_store.year_fingerprint(int(year))
 
-    def fetch_alliance_data(self, event_code):
-        request_url = self.TBA_API + '/event/' + event_code + '/alliances'
-        alliance_data = requests.get(request_url, headers=self.headers)
-        return alliance_data.json()
+    def get_year_archive(self, year):
+        """ The columnar MatchArchive of the matches get_year_matches would
+        return for year, converting them if needed, or None if they would not
+        come from the cache. """
+        if not self.cache_trusted():
+            return None
+        year = int(year)
+        archive = self.data_store.get_year_archive(year)
+        if archive is None and year in self.data_store.data:
+            archive = self.data_store.write_year_archive(year)
+        return archive
+
+    def fetch_alliance_data(self, event_code, priority=Priority.LIVE):
+        request_url = self.api_url + '/event/' + event_code + '/alliances'
+        alliance_data, _ = self.get_json(request_url, priority=priority)
+        return alliance_data
+
+    @staticmethod
+    def webhook_match(match):
+        """ Convert a match from a TBA webhook message to the API's match
+        format. Webhooks can use the older format, which lists an alliance's
+        teams under 'teams' rather than 'team_keys'. """
+        match = dict(match)
+        alliances = {}
+        for alliance in ['blue', 'red']:
+            alliance_data = dict(match['alliances'][alliance])
+            if 'team_keys' not in alliance_data:
+                alliance_data['team_keys'] = alliance_data.pop('teams')
+            alliance_data.setdefault('surrogate_team_keys', [])
+            alliances[alliance] = alliance_data
+        match['alliances'] = alliances
+        return match
 
     @staticmethod
     def sort_by_match_number(matches):
@@ -0,0 +1,88 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from util.backfill import Backfill
+from util.tba_wrapper import BlueAllianceWrapper
+import json
+import os
+import threading
+
+YEAR_EVENTS = {2016: ['2016a', '2016b', '2016c'], 2017: ['2017a', '2017b', '2017c']}
+# still to be played, so never backfilled
+UNFINISHED = {'2017c': '2999-01-01'}
+
+
+class LocalTBA(BaseHTTPRequestHandler):
+    """Serves the parts of the TBA API a backfill uses."""
+    # paths requested, and paths to fail once
+    requests = []
+    fail_once = set()
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        parts = self.path.strip('/').split('/')
+        if self.path in self.fail_once:
+            self.fail_once.discard(self.path)
+            body = None
+        elif parts[0] == 'events':
+            events = YEAR_EVENTS[int(parts[1])]
+            body = [{'key': event_code, 'event_code': event_code[4:],
+                     'start_date': '%s-03-0%s' % (event_code[:4], i),
+                     'end_date': UNFINISHED.get(event_code, '%s-03-0%s' % (event_code[:4], i))}
+                    for i, event_code in enumerate(events)]
+        else:
+            event_code = parts[1]
+            body = [{'key': '%s_qm%s' % (event_code, i), 'comp_level': 'qm',
+                     'set_number': 1, 'match_number': i,
+                     'alliances': {'blue': {'team_keys': ['frc1'], 'score': i},
+                                   'red': {'team_keys': ['frc2'], 'score': 0}}}
+                    for i in [2, 1]]
+        self.send_response(404 if body is None else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+def test_backfill_resumes(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalTBA)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = 'http://127.0.0.1:%s' % server.server_address[1]
+    cache_directory = str(tmp_path)
+    LocalTBA.fail_once.add('/event/2016b/matches')
+
+    class Wrapper(BlueAllianceWrapper):
+        BACKFILL_YEARS = list(YEAR_EVENTS)
+
+        def __init__(self):
+            super().__init__('key', api_url=api_url, cache_directory=cache_directory)
+
+    try:
+        first = Wrapper()
+        # the failed event is left to be fetched again
+        assert not first.cache_trusted()
+        assert os.path.isfile(os.path.join(cache_directory, Backfill.CHECKPOINT_FILE))
+        assert first.data_store.data[2016]['2016b'] is None
+        assert [m['match_number'] for m in first.data_store.get_event_matches(2017, '2017a')] \
+            == [1, 2]
+
+        assert '/event/2017c/matches' not in LocalTBA.requests
+
+        LocalTBA.requests.clear()
+        second = Wrapper()
+        # only the missing event is fetched
+        assert LocalTBA.requests == ['/event/2016b/matches']
+        assert second.cache_trusted()
+        assert not os.path.isfile(os.path.join(cache_directory, Backfill.CHECKPOINT_FILE))
+        assert list(second.data_store.data[2016]) == YEAR_EVENTS[2016]
+        assert len(second.data_store.get_event_matches(2016, '2016b')) == 2
+        # so the unfinished event's matches still come from TBA
+        assert second.data_store.data[2017]['2017c'] is None
+        assert second.get_event_matches('2017c')[0]['key'] == '2017c_qm1'
+
+        # and once it's complete, the cache is used without asking TBA
+        LocalTBA.requests.clear()
+        Wrapper()
+        assert LocalTBA.requests == []
+    finally:
+        server.shutdown()
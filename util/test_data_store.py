@@ -0,0 +1,118 @@
+from util.data_store import DataStore, LazyYears
+import os
+import threading
+import time
+
+
+def test_segments(tmp_path):
+    cache_directory = str(tmp_path)
+    store = DataStore(cache_directory=cache_directory, new_data_store=True,
+                      year_events={2017: ['2017a', '2017b', '2017c']}, metadata_years=[2017])
+    base_file = store.cache_file(2017)
+    base_stat = os.stat(base_file)
+    fingerprint = store.year_fingerprint(2017)
+
+    store.add_event_matches(2017, '2017a', [{'key': '2017a_qm1'}])
+    store.add_event_metadata(2017, '2017a', {'name': 'A'})
+    store.add_event_matches(2017, '2017b', [{'key': '2017b_qm1'}])
+    store.add_event_matches(2017, '2017a', [{'key': '2017a_qm1'}, {'key': '2017a_qm2'}])
+    # adding an event doesn't rewrite the year
+    assert os.stat(base_file).st_mtime_ns == base_stat.st_mtime_ns
+    assert store.year_fingerprint(2017) != fingerprint
+
+    # a crash while appending to the index loses only that event
+    with open(store.index_file(2017), 'a') as index:
+        index.write('matches\t2017c\t2017c-matc')
+
+    loaded = DataStore(cache_directory=cache_directory, metadata_years=[2017])
+    assert list(loaded.get_year_events(2017)) == ['2017a', '2017b', '2017c']
+    assert len(loaded.get_event_matches(2017, '2017a')) == 2
+    assert loaded.get_event_matches(2017, '2017c') == []
+    assert loaded.get_event_metadata(2017, '2017a') == {'name': 'A'}
+    # and the next event added isn't appended onto the cut off line
+    loaded.add_event_matches(2017, '2017c', [{'key': '2017c_qm1'}])
+    reloaded = DataStore(cache_directory=cache_directory, metadata_years=[2017])
+    assert reloaded.get_event_matches(2017, '2017c') == [{'key': '2017c_qm1'}]
+    assert len(reloaded.get_event_matches(2017, '2017a')) == 2
+
+    loaded.compact(2017)
+    assert not os.path.exists(loaded.index_file(2017))
+    assert os.listdir(loaded.segment_directory(2017)) == []
+    compacted = DataStore(cache_directory=cache_directory, metadata_years=[2017])
+    assert compacted.data == loaded.data
+    assert compacted.metadata == loaded.metadata
+
+
+def test_automatic_compaction(tmp_path):
+    store = DataStore(cache_directory=str(tmp_path), new_data_store=True,
+                      year_events={2018: ['2018e%s' % i for i in range(100)]})
+    for i in range(100):
+        store.add_event_matches(2018, '2018e%s' % i, [{'key': i}])
+    assert len(store.read_index(2018)) <= DataStore.COMPACT_THRESHOLD
+    loaded = DataStore(cache_directory=str(tmp_path))
+    assert loaded.get_event_matches(2018, '2018e99') == [{'key': 99}]
+    assert loaded.data == store.data
+
+
+def test_lazy_years(tmp_path):
+    years = {year: ['%se' % year] for year in range(2008, 2014)}
+    store = DataStore(cache_directory=str(tmp_path), new_data_store=True, year_events=years)
+    for year in years:
+        store.add_event_matches(year, '%se' % year, [{'key': year}])
+
+    loaded = DataStore(cache_directory=str(tmp_path), max_resident_years=2)
+    # nothing is read until it's used
+    assert list(loaded.data) == list(years)
+    assert loaded.stats()['matches']['loads'] == 0
+
+    assert loaded.get_event_matches(2008, '2008e') == [{'key': 2008}]
+    assert loaded.get_event_matches(2009, '2009e') == [{'key': 2009}]
+    assert loaded.get_event_matches(2008, '2008e') == [{'key': 2008}]
+    assert loaded.get_event_matches(2010, '2010e') == [{'key': 2010}]
+    stats = loaded.stats()['matches']
+    # 2009 was the least recently used
+    assert stats['resident'] == [2008, 2010]
+    assert stats['loads'] == 3 and stats['evictions'] == 1
+    assert stats['resident_bytes'] > 0
+
+    # changes to an evicted year are kept
+    loaded.add_event_matches(2011, '2011e', [{'key': 'new'}])
+    loaded.get_event_matches(2012, '2012e')
+    loaded.get_event_matches(2013, '2013e')
+    assert 2011 not in loaded.stats()['matches']['resident']
+    assert loaded.get_event_matches(2011, '2011e') == [{'key': 'new'}]
+
+
+def test_iter_events(tmp_path):
+    years = {2016: ['2016a', '2016b'], 2017: ['2017a']}
+    store = DataStore(cache_directory=str(tmp_path), new_data_store=True, year_events=years)
+    store.add_event_matches(2016, '2016b', [{'key': '2016b_qm1'}])
+    store.add_event_matches(2017, '2017a', [{'key': '2017a_qm1'}])
+
+    loaded = DataStore(cache_directory=str(tmp_path), max_resident_years=1)
+    assert list(loaded.iter_events()) == [(2016, '2016a', []),
+                                          (2016, '2016b', [{'key': '2016b_qm1'}]),
+                                          (2017, '2017a', [{'key': '2017a_qm1'}])]
+    # streaming doesn't load years to keep
+    assert loaded.stats()['matches']['loads'] == 0
+
+
+def test_lazy_years_threads():
+    loads = []
+
+    def load(year):
+        loads.append(year)
+        time.sleep(0.05)
+        return {'year': year}
+
+    years = LazyYears([2016, 2017], load, max_resident=2)
+    results = []
+    threads = [threading.Thread(target=lambda year=year: results.append(years[year]))
+               for year in [2016] * 8 + [2017] * 8]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(result['year'] for result in results) == [2016] * 8 + [2017] * 8
+    # each year was loaded once while threads were waiting for it
+    assert sorted(loads) == [2016, 2017]
@@ -0,0 +1,78 @@
+from fixtures import EVENT_CODE, make_event, make_match
+from util.event import Event
+import copy
+
+
+def test_incremental_matches():
+    matches = [make_match([1, 2, 3], [4, 5, 6], 100, 50, match_number=1),
+               make_match([1, 2, 3], [4, 5, 6], match_number=2),
+               make_match([7, 8, 9], [10, 11, 12], match_number=3),
+               make_match([1, 8, 9], [10, 5, 6], match_number=4)]
+    event = make_event(matches)
+    assert event.status == Event.States.QUALIFICATION_MATCHES
+    assert event.first_unplayed == 1
+    predictions = dict(event.upcoming_matches)
+
+    # refetched but unchanged: nothing is rechecked or repriced, and the
+    # event_dict is kept, so snapshots see it hasn't changed
+    tba = event.tba_wrapper
+    tba.played_checks = 0
+    event_dict = event.event_dict
+    event.update_matches(copy.deepcopy(matches))
+    assert tba.played_checks == 0
+    assert all(event.upcoming_matches[key] is predictions[key] for key in predictions)
+    assert event.event_dict is event_dict
+    # likewise when TBA says the matches haven't changed
+    event.update_matches(matches, matches_changed=False)
+    assert event.event_dict is event_dict
+
+    # only TBA's predicted times have moved: still nothing to reprice, but
+    # the next match time is up to date
+    retimed = copy.deepcopy(matches)
+    for i, match in enumerate(retimed):
+        match['predicted_time'] = 1500000000 + 600*i
+    event.update_matches(retimed)
+    assert tba.played_checks == 0
+    assert all(event.upcoming_matches[key] is predictions[key] for key in predictions)
+    assert event.next_match_time() == 1500000000 + 600
+    assert event.event_dict is event_dict
+
+    # match 2 is played: only it is checked, and only the matches of the
+    # teams whose ratings moved are repriced
+    matches = copy.deepcopy(matches)
+    matches[1]['alliances']['blue']['score'] = 30
+    matches[1]['alliances']['red']['score'] = 60
+    event.update_matches(matches)
+    assert tba.played_checks == 1
+    assert event.first_unplayed == 2
+    assert list(event.upcoming_matches) == [EVENT_CODE + '_qm3', EVENT_CODE + '_qm4']
+    assert event.upcoming_matches[EVENT_CODE + '_qm3'] is predictions[EVENT_CODE + '_qm3']
+    assert event.upcoming_matches[EVENT_CODE + '_qm4'] is not predictions[EVENT_CODE + '_qm4']
+    assert len(event.retrodictions) == 2
+
+    # all the quals are played, and no playoff matches are posted yet
+    for match in matches[2:]:
+        match['alliances']['blue']['score'] = 10
+        match['alliances']['red']['score'] = 20
+    event.update_matches(matches)
+    assert event.first_unplayed == 4
+    assert event.status == Event.States.QUALIFICATION_MATCHES
+    assert not event.upcoming_matches
+
+
+def test_reprice_unchanged_matches():
+    matches = [make_match([1, 2, 3], [4, 5, 6], 100, 50, match_number=1),
+               make_match([1, 2, 3], [4, 5, 6], match_number=2),
+               make_match([7, 8, 9], [10, 11, 12], match_number=3)]
+    event = make_event(matches)
+    predictions = dict(event.upcoming_matches)
+
+    # team 1 plays at another event, and TBA then says this event's matches
+    # haven't changed: only the match team 1 is in is repriced
+    other = make_match([1, 13, 14], [15, 16, 17], 200, 0, match_number=1, event_code='2017other')
+    event.elo.update(other)
+    event.update_matches(matches, matches_changed=False)
+    assert event.upcoming_matches[EVENT_CODE + '_qm2'] is not predictions[EVENT_CODE + '_qm2']
+    assert event.upcoming_matches[EVENT_CODE + '_qm3'] is predictions[EVENT_CODE + '_qm3']
+    assert event.event_dict['upcoming_matches'][0]['blue_win_prob'] > \
+        predictions[EVENT_CODE + '_qm2']['blue_win_prob']
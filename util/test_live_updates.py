@@ -0,0 +1,100 @@
+from util.live_updates import LiveUpdates, LiveUpdateServer
+import json
+import socket
+import time
+
+
+def make_event_dict(retrodictions, status='Qualifications'):
+    return {'name': 'Test Regional', 'status': status, 'status_code': 'qm',
+            'upcoming_matches': [], 'retrodictions': retrodictions,
+            'finals': {'in_progress': False},
+            'rank_projections': [{'team': '1', 'ranking_points': 2.0, 'mean_ranking_points': 4.0,
+                                  'mean_seed': 1.5, 'top_seed_percent': 100,
+                                  'seed_distribution': [0.5, 0.5]}]}
+
+
+def test_deltas():
+    live_updates = LiveUpdates()
+    messages = []
+    live_updates.add_listener(lambda event_code, message: messages.append(message))
+
+    retrodictions = [{'name': 'Quals 1'}]
+    live_updates.publish('2017test', make_event_dict(retrodictions))
+    assert messages[0]['seq'] == 1
+    # distributions aren't shown, so aren't sent
+    assert 'seed_distribution' not in messages[0]['set']['rank_projections'][0]
+
+    # publishing an unchanged event sends nothing
+    live_updates.publish('2017test', make_event_dict(retrodictions))
+    assert len(messages) == 1
+
+    retrodictions.append({'name': 'Quals 2'})
+    live_updates.publish('2017test', make_event_dict(retrodictions, status='Knockout Rounds'))
+    assert messages[1] == {'seq': 2, 'set': {'status': 'Knockout Rounds'},
+                           'append': {'retrodictions': {'start': 1,
+                                                        'items': [{'name': 'Quals 2'}]}}}
+
+    assert live_updates.catch_up('2017test', since=2) is None
+    catch_up = live_updates.catch_up('2017test', since=1)
+    assert catch_up['full'] and catch_up['seq'] == 2
+    assert catch_up['set']['retrodictions'] == retrodictions
+    assert live_updates.catch_up('2017other') is None
+
+
+def read_headers(stream):
+    status = stream.readline()
+    while stream.readline() != b'\r\n':
+        pass
+    return status
+
+
+def read_message(stream):
+    lines = []
+    while True:
+        line = stream.readline()
+        if line == b'\n':
+            if lines and not lines[0].startswith(b':'):
+                return json.loads(lines[-1][len(b'data: '):])
+            lines = []
+        else:
+            lines.append(line.rstrip(b'\n'))
+
+
+def test_server():
+    live_updates = LiveUpdates()
+    live_updates.publish('2017test', make_event_dict([{'name': 'Quals 1'}]))
+    server = LiveUpdateServer(live_updates, host='127.0.0.1', port=0)
+    server.start()
+
+    not_found = socket.create_connection(('127.0.0.1', server.port))
+    not_found.sendall(b'GET /events/2017other/stream HTTP/1.1\r\n\r\n')
+    assert not_found.makefile('rb').readline().startswith(b'HTTP/1.1 404')
+
+    clients = []
+    for _ in range(3):
+        client = socket.create_connection(('127.0.0.1', server.port))
+        client.sendall(b'GET /events/2017test/stream HTTP/1.1\r\nAccept: text/event-stream\r\n\r\n')
+        stream = client.makefile('rb')
+        assert read_headers(stream).startswith(b'HTTP/1.1 200')
+        assert read_message(stream)['full']
+        clients.append((client, stream))
+    deadline = time.time() + 5
+    while server.num_clients < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert server.num_clients == 3
+
+    live_updates.publish('2017test', make_event_dict([{'name': 'Quals 1'}, {'name': 'Quals 2'}]))
+    for client, stream in clients:
+        message = read_message(stream)
+        assert message['seq'] == 2
+        assert message['append']['retrodictions']['items'] == [{'name': 'Quals 2'}]
+        client.close()
+
+    # a client that's already up to date isn't resent the state
+    client = socket.create_connection(('127.0.0.1', server.port))
+    client.sendall(b'GET /events/2017test/stream?since=2 HTTP/1.1\r\n\r\n')
+    stream = client.makefile('rb')
+    read_headers(stream)
+    live_updates.publish('2017test', make_event_dict([{'name': 'Quals 1'}], status='Event Over'))
+    assert read_message(stream)['seq'] == 3
+    client.close()
@@ -0,0 +1,56 @@
+from fixtures import make_elo
+from predict.elo_replay import EloReplay
+from predict.replay_benchmark import synthetic_year
+from util.data_store import DataStore
+from util.match_archive import MatchArchive
+import numpy as np
+import random
+
+
+def test_round_trip(tmp_path):
+    year_events = synthetic_year(2017, random.Random(1))
+    year_events['2017empty'] = None
+    archive = MatchArchive.from_year_events(year_events, 'fingerprint')
+    archive.save(str(tmp_path / 'archive'))
+
+    loaded = MatchArchive.load(str(tmp_path / 'archive'))
+    assert isinstance(loaded.blue_scores, np.memmap)
+    assert loaded.source_fingerprint == 'fingerprint'
+    assert loaded.num_matches == sum(len(event) for event in year_events.values() if event)
+    assert '2017empty' not in loaded.event_codes
+
+    event_matches = year_events['2017ev3']
+    event_slice = loaded.event_matches('2017ev3')
+    assert loaded.blue_scores[event_slice].tolist() == \
+        [match['alliances']['blue']['score'] for match in event_matches]
+    assert [loaded.teams[team] for team in loaded.red_teams[event_slice][0]] == \
+        event_matches[0]['alliances']['red']['team_keys']
+
+    assert MatchArchive.load(str(tmp_path / 'missing')) is None
+
+
+def test_replay_from_archive(tmp_path):
+    year_events = synthetic_year(2017, random.Random(2))
+    archive = MatchArchive.from_year_events(year_events)
+    archive.save(str(tmp_path))
+
+    from_dicts = make_elo()
+    expected = EloReplay(from_dicts).replay_year(year_events)
+    from_archive = make_elo()
+    predictions = EloReplay(from_archive).replay(
+        EloReplay.season_from_archive(MatchArchive.load(str(tmp_path))))
+    assert np.allclose(predictions, expected)
+    assert from_archive.elo == from_dicts.elo
+
+
+def test_data_store_archive(tmp_path):
+    store = DataStore(cache_directory=str(tmp_path), new_data_store=True,
+                      year_events={2017: ['2017a']})
+    store.add_event_matches(2017, '2017a', synthetic_year(2017, random.Random(3))['2017ev0'])
+    assert store.get_year_archive(2017) is None
+    assert store.write_year_archive(2017).num_matches == len(store.data[2017]['2017a'])
+    assert store.get_year_archive(2017) is not None
+
+    # adding matches makes the archive stale
+    store.add_event_matches(2017, '2017a', [])
+    assert store.get_year_archive(2017) is None
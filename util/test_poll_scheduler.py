@@ -0,0 +1,109 @@
+from util.event import Event
+from util.poll_scheduler import PollScheduler
+from datetime import datetime
+from pytz import utc
+
+
+class FakeEvent:
+    def __init__(self, event_code, status, event_start=None, next_match_time=None,
+                 fetch_failures=0):
+        self.event_code = event_code
+        self.status = status
+        self.fetch_failures = fetch_failures
+        self.event_start = event_start
+        self._next_match_time = next_match_time
+
+    def next_match_time(self):
+        return self._next_match_time
+
+
+NOW = 1500000000
+
+
+def test_poll_intervals():
+    scheduler = PollScheduler()
+    months_away = FakeEvent('future', Event.States.NOT_STARTED,
+                            event_start=utc.localize(datetime(2018, 1, 1)))
+    assert scheduler.poll_interval(months_away, NOW) == PollScheduler.FUTURE_INTERVAL
+    tomorrow = FakeEvent('tomorrow', Event.States.NOT_STARTED,
+                         event_start=utc.localize(datetime.utcfromtimestamp(NOW + 24*60*60)))
+    assert scheduler.poll_interval(tomorrow, NOW) == PollScheduler.PRE_START_INTERVAL
+
+    match_soon = FakeEvent('soon', Event.States.QUALIFICATION_MATCHES, next_match_time=NOW + 60)
+    assert scheduler.poll_interval(match_soon, NOW) == PollScheduler.MATCH_INTERVAL
+    running_late = FakeEvent('late', Event.States.FINAL_MATCHES, next_match_time=NOW - 600)
+    assert scheduler.poll_interval(running_late, NOW) == PollScheduler.MATCH_INTERVAL
+    # woken up just before the next match
+    lunch = FakeEvent('lunch', Event.States.QUALIFICATION_MATCHES, next_match_time=NOW + 20*60)
+    assert scheduler.poll_interval(lunch, NOW) == 20*60 - PollScheduler.MATCH_WINDOW
+    overnight = FakeEvent('overnight', Event.States.MATCHES_POSTED,
+                          next_match_time=NOW + 12*60*60)
+    assert scheduler.poll_interval(overnight, NOW) == PollScheduler.LIVE_MAX_INTERVAL
+
+    assert scheduler.poll_interval(FakeEvent('new', None), NOW) == 0
+    assert scheduler.poll_interval(FakeEvent('done', Event.States.FINISHED), NOW) is None
+
+
+def test_queue():
+    scheduler = PollScheduler()
+    live = FakeEvent('live', Event.States.QUALIFICATION_MATCHES, next_match_time=NOW)
+    pre = FakeEvent('pre', Event.States.PRE_MATCHES)
+    done = FakeEvent('done', Event.States.FINISHED)
+    for event in [pre, live, done]:
+        scheduler.schedule(event, now=NOW)
+    assert scheduler.queue_depth == 2
+    assert scheduler.next_due() == NOW + PollScheduler.MATCH_INTERVAL
+    assert scheduler.pop_due(now=NOW) == []
+    assert scheduler.pop_due(now=NOW + PollScheduler.PRE_MATCHES_INTERVAL) == ['live', 'pre']
+    assert scheduler.queue_depth == 0 and scheduler.next_due() is None
+
+    # rescheduling replaces the old due time
+    scheduler.schedule(pre, now=NOW)
+    live.status = Event.States.FINISHED
+    scheduler.schedule(live, now=NOW)
+    pre.status = Event.States.QUALIFICATION_MATCHES
+    pre._next_match_time = NOW
+    scheduler.schedule(pre, now=NOW)
+    assert scheduler.queue_depth == 1
+    assert scheduler.pop_due(now=NOW + PollScheduler.PRE_MATCHES_INTERVAL) == ['pre']
+    assert scheduler.stats()['poll_intervals'] == {'live': None, 'done': None,
+                                                   'pre': PollScheduler.MATCH_INTERVAL}
+
+
+def test_failure_backoff():
+    scheduler = PollScheduler()
+    # never fetched successfully: due straight away until a fetch fails
+    new = FakeEvent('new', None)
+    intervals = []
+    for failures in range(10):
+        new.fetch_failures = failures
+        intervals.append(scheduler.poll_interval(new, NOW))
+    assert intervals[:4] == [0, PollScheduler.FAILURE_INTERVAL, 2 * PollScheduler.FAILURE_INTERVAL,
+                             4 * PollScheduler.FAILURE_INTERVAL]
+    assert intervals[-1] == PollScheduler.FAILURE_MAX_INTERVAL
+
+    # a failing event isn't polled sooner than its status would have it
+    live = FakeEvent('live', Event.States.QUALIFICATION_MATCHES, next_match_time=NOW + 20*60,
+                     fetch_failures=1)
+    assert scheduler.poll_interval(live, NOW) == 20*60 - PollScheduler.MATCH_WINDOW
+    live.fetch_failures = 100
+    assert scheduler.poll_interval(live, NOW) == PollScheduler.FAILURE_MAX_INTERVAL
+    # once it's fetched, it's back to its usual interval
+    live.fetch_failures = 0
+    live._next_match_time = NOW
+    assert scheduler.poll_interval(live, NOW) == PollScheduler.MATCH_INTERVAL
+
+    scheduler.schedule(FakeEvent('failed', None, fetch_failures=1), now=NOW)
+    assert scheduler.pop_due(now=NOW) == []
+    assert scheduler.next_due() == NOW + PollScheduler.FAILURE_INTERVAL
+
+
+def test_poll_now_while_polling():
+    scheduler = PollScheduler()
+    live = FakeEvent('live', Event.States.QUALIFICATION_MATCHES, next_match_time=NOW + 20*60)
+    scheduler.schedule(live, now=NOW)
+    assert scheduler.pop_due(now=NOW + 20*60) == ['live']
+    # a webhook asks for a poll while the event is being polled
+    scheduler.poll_now('live', now=NOW + 20*60 + 1)
+    scheduler.schedule(live, now=NOW + 20*60 + 2)
+    assert scheduler.next_due() == NOW + 20*60 + 1
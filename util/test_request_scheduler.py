@@ -0,0 +1,78 @@
+from util.request_scheduler import Priority, RequestScheduler
+import threading
+import time
+
+
+def start(scheduler, key, send, priority):
+    thread = threading.Thread(target=scheduler.run, args=(key, send, priority))
+    thread.start()
+    return thread
+
+
+def wait_for_queue(scheduler, depth):
+    while sum(scheduler.queue_depths().values()) < depth:
+        time.sleep(0.001)
+
+
+def test_priority_order():
+    # one request every 0.1s, after a burst of one
+    scheduler = RequestScheduler(rate=10, burst=1)
+    sent = []
+    scheduler.run('first', lambda: sent.append('first'), Priority.NEAR_TERM)
+
+    threads = [start(scheduler, 'backfill%s' % i, lambda i=i: sent.append('backfill%s' % i),
+                     Priority.BACKFILL) for i in range(3)]
+    wait_for_queue(scheduler, 3)
+    threads.append(start(scheduler, 'live', lambda: sent.append('live'), Priority.LIVE))
+    for thread in threads:
+        thread.join()
+
+    assert sent == ['first', 'live', 'backfill0', 'backfill1', 'backfill2']
+    stats = scheduler.stats()
+    assert stats['backfill']['requests'] == 3
+    assert stats['backfill']['max_wait'] > stats['live']['max_wait']
+
+
+def test_deduplication():
+    scheduler = RequestScheduler(rate=10, burst=1)
+    scheduler.run('first', lambda: None, Priority.NEAR_TERM)
+    calls = []
+    results = []
+
+    def send():
+        calls.append(1)
+        return 'response'
+
+    def run(priority):
+        results.append(scheduler.run('same', send, priority))
+
+    threads = [threading.Thread(target=run, args=(Priority.BACKFILL,))]
+    threads[0].start()
+    wait_for_queue(scheduler, 1)
+    # joining the queued backfill request moves it up to live
+    threads.append(threading.Thread(target=run, args=(Priority.LIVE,)))
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ['response', 'response']
+    stats = scheduler.stats()
+    assert stats['live']['deduplicated'] == 1
+    assert stats['live']['requests'] == 1 and stats['backfill']['requests'] == 0
+
+
+def test_errors_are_shared():
+    scheduler = RequestScheduler()
+
+    def send():
+        raise ValueError('failed')
+
+    try:
+        scheduler.run('key', send)
+    except ValueError:
+        pass
+    else:
+        assert False
+    # the failed request isn't left in flight
+    assert scheduler.run('key', lambda: 'retried') == 'retried'
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from util.snapshots import FrozenDict, SnapshotBuilder, SnapshotReader, SnapshotWriter, freeze
+import os
+import pickle
+
+
+def test_freeze():
+    frozen = freeze({'matches': [{'teams': ['frc1']}], 'finals': OrderedDict(a=1)})
+    assert frozen == {'matches': ({'teams': ('frc1',)},), 'finals': {'a': 1}}
+    for mutate in [lambda: frozen.update(a=1), lambda: frozen['matches'][0].pop('teams'),
+                   lambda: frozen['finals'].__setitem__('a', 2)]:
+        try:
+            mutate()
+        except TypeError:
+            pass
+        else:
+            assert False
+    assert isinstance(pickle.loads(pickle.dumps(frozen))['finals'], FrozenDict)
+
+
+def test_builder_reuses_unchanged_events():
+    builder = SnapshotBuilder()
+    event_a = {'name': 'A', 'retrodictions': [1]}
+    events = OrderedDict([('2018a', event_a), ('2018b', {'name': 'B'})])
+    first = builder.build(events, {'frc1': 1500.0})
+
+    # changing the live data doesn't change the snapshot
+    event_a['retrodictions'].append(2)
+    assert first.event('2018a')['retrodictions'] == (1,)
+
+    events['2018b'] = {'name': 'B', 'status': 'Finished'}
+    second = builder.build(events, {'frc1': 1510.0})
+    assert second.event('2018a') is first.event('2018a')
+    assert second.event_version('2018a') == first.event_version('2018a')
+    assert second.event_version('2018b') != first.event_version('2018b')
+    assert first.ratings() == {'frc1': 1500.0} and second.ratings() == {'frc1': 1510.0}
+    assert not second.has_event('2018c')
+    assert second.events_version == second.version
+
+    # ratings alone changing leaves every event's version alone
+    third = builder.build(events, {'frc1': 1520.0})
+    assert third.events_version == second.events_version
+    assert third.event_version('2018b') == second.event_version('2018b')
+
+
+def test_publish_and_read(tmp_path):
+    directory = str(tmp_path)
+    builder = SnapshotBuilder()
+    writer = SnapshotWriter(directory, keep=2)
+    reader = SnapshotReader(directory)
+    assert reader.current() is None
+
+    events = OrderedDict([('2018a', {'name': 'A', 'upcoming_matches': [1, 2]}),
+                          ('2018b', {'name': 'B', 'upcoming_matches': []})])
+    snapshot = builder.build(events, {'frc1': 1500.0})
+    writer.write(snapshot)
+    first = reader.current()
+    assert first.version == snapshot.version
+    assert first.event_codes == ['2018a', '2018b']
+    assert first.event('2018b') == {'name': 'B', 'upcoming_matches': ()}
+    assert first.ratings() == {'frc1': 1500.0}
+    # unchanged until a new snapshot is written
+    assert reader.current() is first
+
+    events['2018a'] = {'name': 'A', 'upcoming_matches': [2]}
+    writer.write(builder.build(events, {'frc1': 1510.0}))
+    second = reader.current()
+    assert second is not first
+    assert second.event('2018a') == {'name': 'A', 'upcoming_matches': (2,)}
+    # only changed events get a new version
+    assert second.event_version('2018a') != first.event_version('2018a')
+    assert second.event_version('2018b') == first.event_version('2018b')
+
+    for _ in range(3):
+        writer.write(builder.build(events, {}))
+    assert len([name for name in os.listdir(directory) if name.startswith('snapshot-')]) == 2
+    # a snapshot still open keeps working once its file is removed
+    assert first.event('2018a') == {'name': 'A', 'upcoming_matches': (1, 2)}
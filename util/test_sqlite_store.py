@@ -0,0 +1,64 @@
+from predict.replay_benchmark import synthetic_year
+from util.data_store import DataStore
+from util.sqlite_store import SQLiteDataStore
+import random
+
+
+def test_import_and_queries(tmp_path):
+    year_events = {2017: synthetic_year(2017, random.Random(1)),
+                   2018: synthetic_year(2018, random.Random(2))}
+    pickle_store = DataStore(cache_directory=str(tmp_path), new_data_store=True,
+                             year_events={year: list(events)
+                                          for year, events in year_events.items()},
+                             metadata_years=[2018])
+    for year, events in year_events.items():
+        for event_code, matches in events.items():
+            pickle_store.add_event_matches(year, event_code, matches)
+    pickle_store.add_event_metadata(2018, '2018ev0', {'name': 'Event 0'})
+
+    path = str(tmp_path / 'matches.sqlite')
+    store = SQLiteDataStore(path, new_data_store=True, metadata_years=[2018])
+    store.import_data_store(pickle_store)
+
+    reopened = SQLiteDataStore(path, metadata_years=[2018])
+    assert list(reopened.data) == [2017, 2018]
+    assert list(reopened.get_year_events(2018)) == list(year_events[2018])
+    assert reopened.get_event_matches(2017, '2017ev5') == year_events[2017]['2017ev5']
+    assert reopened.get_event_metadata(2018, '2018ev0') == {'name': 'Event 0'}
+    assert reopened.get_event_metadata(2018, '2018ev1') is None
+
+    team = year_events[2018]['2018ev7'][0]['alliances']['red']['team_keys'][1]
+    expected = [match for year in [2017, 2018] for matches in year_events[year].values()
+                for match in matches
+                if any(team in alliance['team_keys']
+                       for alliance in match['alliances'].values())]
+    assert reopened.team_matches(team) == expected
+    assert reopened.team_matches(int(team[3:]), 2018) == \
+        [match for match in expected if match['key'].startswith('2018')]
+    assert reopened.team_events(team, 2018) == [
+        event_code for event_code, matches in year_events[2018].items()
+        if any(match in expected for match in matches)]
+    assert 2018 in reopened.team_years(team)
+
+
+def test_add_event_matches(tmp_path):
+    store = SQLiteDataStore(str(tmp_path / 'matches.sqlite'), new_data_store=True,
+                            year_events={2018: ['2018a', '2018b']})
+    assert store.get_event_matches(2018, '2018a') == []
+    fingerprint = store.year_fingerprint(2018)
+
+    match = {'key': '2018a_qm1', 'comp_level': 'qm',
+             'alliances': {'blue': {'team_keys': ['frc1', 'frc2', 'frc3'], 'score': 10},
+                           'red': {'team_keys': ['frc4', 'frc5', 'frc6'], 'score': 20}}}
+    store.add_event_matches(2018, '2018a', [match])
+    # replacing an event's matches replaces its teams too
+    store.add_event_matches(2018, '2018a', [dict(match, key='2018a_qm2')])
+    assert store.year_fingerprint(2018) != fingerprint
+    assert [m['key'] for m in store.team_matches(1)] == ['2018a_qm2']
+
+    reopened = SQLiteDataStore(str(tmp_path / 'matches.sqlite'))
+    assert reopened.get_event_matches(2018, '2018a')[0]['key'] == '2018a_qm2'
+    assert reopened.get_event_matches(2018, '2018b') == []
+    assert [(event_code, [m['key'] for m in matches])
+            for _, event_code, matches in reopened.iter_events()] == \
+        [('2018a', ['2018a_qm2']), ('2018b', [])]
@@ -0,0 +1,141 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from util.data_store import DataStore
+from util.tba_wrapper import BlueAllianceWrapper, RequestStats
+import json
+import pytest
+import threading
+import time
+
+
+class LocalTBA(BaseHTTPRequestHandler):
+    """Serves whatever responses the test sets for each path, keeping
+    connections alive like TBA does."""
+    protocol_version = 'HTTP/1.1'
+    # path -> list of (status, headers, body) to send in turn, the last
+    # repeated once the others have been sent
+    responses = {}
+    # (path, request headers) of each request
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, dict(self.headers)))
+        responses = self.responses[self.path]
+        status, headers, body = responses.pop(0) if len(responses) > 1 else responses[0]
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tba(tmp_path):
+    LocalTBA.responses = {}
+    LocalTBA.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalTBA)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    class Wrapper(BlueAllianceWrapper):
+        # nothing to backfill
+        BACKFILL_YEARS = []
+
+    try:
+        yield Wrapper('key', api_url='http://127.0.0.1:%s' % server.server_address[1],
+                      cache_directory=str(tmp_path), backoff_factor=0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_connection_reuse_and_retries(tba):
+    LocalTBA.responses['/status'] = [(200, {}, {'ok': True})]
+    LocalTBA.responses['/flaky'] = [(503, {}, None), (502, {}, None), (200, {}, [1, 2])]
+    for _ in range(5):
+        assert tba.fetch_json(tba.api_url + '/status') == {'ok': True}
+    # server errors are retried
+    assert tba.fetch_json(tba.api_url + '/flaky') == [1, 2]
+    assert [path for path, _ in LocalTBA.requests].count('/flaky') == 3
+    # every request went over the one connection
+    assert tba.num_connections() == 1
+    assert tba.request_stats.summary()['requests'] == 6
+
+
+def test_request_stats():
+    stats = RequestStats()
+    assert stats.summary()['p95'] is None
+    for latency in range(1, 101):
+        stats.record(latency / 1000, error=latency > 98)
+    summary = stats.summary()
+    assert (summary['requests'], summary['errors']) == (100, 2)
+    assert summary['mean'] == pytest.approx(0.0505)
+    assert (summary['p50'], summary['p95'], summary['max']) == (0.051, 0.096, 0.1)
+    # only the last HISTORY_LEN latencies count towards the percentiles
+    for _ in range(RequestStats.HISTORY_LEN):
+        stats.record(0.5)
+    assert stats.summary()['p50'] == stats.summary()['max'] == 0.5
+
+
+def match(match_number):
+    return {'key': '2017test_qm%s' % match_number, 'comp_level': 'qm', 'set_number': 1,
+            'match_number': match_number}
+
+
+def test_conditional_requests(tba, tmp_path):
+    tba.data_store = DataStore(cache_directory=str(tmp_path), new_data_store=True,
+                               year_events={2017: ['2017test']})
+    validators = {'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Mar 2017 00:00:00 GMT',
+                  'Cache-Control': 'no-cache'}
+    LocalTBA.responses['/event/2017test/matches'] = [
+        (200, validators, [match(2), match(1)]), (304, validators, None),
+        (200, dict(validators, ETag='"v2"'), [match(1)])]
+
+    matches, changed = tba.get_event_matches('2017test', return_changed=True)
+    assert changed and [m['match_number'] for m in matches] == [1, 2]
+    # no-cache, so TBA is asked again, and answers that nothing has changed
+    again, changed = tba.get_event_matches('2017test', return_changed=True)
+    assert again is matches and not changed
+    _, headers = LocalTBA.requests[-1]
+    assert headers['If-None-Match'] == '"v1"'
+    assert headers['If-Modified-Since'] == validators['Last-Modified']
+
+    changed_matches, changed = tba.get_event_matches('2017test', return_changed=True)
+    assert changed and changed_matches == [match(1)]
+    assert len(LocalTBA.requests) == 3
+
+
+def test_max_age(tba):
+    LocalTBA.responses['/fresh'] = [(200, {'ETag': '"v1"', 'Cache-Control': 'max-age=60'}, [1])]
+    LocalTBA.responses['/revalidated'] = [
+        (200, {'ETag': '"v1"', 'Cache-Control': 'max-age=60, no-cache'}, [1]),
+        (304, {'ETag': '"v1"'}, None)]
+
+    data, changed = tba.get_json(tba.api_url + '/fresh')
+    assert changed
+    # still within max-age: no request is sent
+    assert tba.get_json(tba.api_url + '/fresh') == (data, False)
+    assert len(LocalTBA.requests) == 1
+    # until it's expired
+    url = tba.api_url + '/fresh'
+    tba.response_cache[url] = tba.response_cache[url]._replace(fresh_until=time.monotonic())
+    tba.get_json(url)
+    assert len(LocalTBA.requests) == 2
+
+    # expiring the event's responses makes the next request ask TBA again
+    LocalTBA.responses['/event/2017test'] = [
+        (200, {'ETag': '"v1"', 'Cache-Control': 'max-age=60'}, {'key': '2017test'}),
+        (304, {'ETag': '"v1"', 'Cache-Control': 'max-age=60'}, None)]
+    event, _ = tba.get_json(tba.api_url + '/event/2017test')
+    tba.expire_event('2017test')
+    assert tba.get_json(tba.api_url + '/event/2017test') == (event, False)
+    assert [path for path, _ in LocalTBA.requests].count('/event/2017test') == 2
+    assert LocalTBA.requests[-1][1]['If-None-Match'] == '"v1"'
+
+    # no-cache overrides max-age
+    data, _ = tba.get_json(tba.api_url + '/revalidated')
+    assert tba.get_json(tba.api_url + '/revalidated') == (data, False)
+    assert [path for path, _ in LocalTBA.requests].count('/revalidated') == 2
@@ -0,0 +1,136 @@
+from flask import Flask, Response, request, abort, jsonify
+from flask import render_template
+from util.response_cache import ResponseCache
+import hashlib
+import json
+import hmac
+import os
+
+
+def load_webhook_secret(path='tba/webhook_secret.txt'):
+    """ The secret set when registering the webhook with TBA, used to check
+    that webhook messages really come from TBA, or None if there isn't one. """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as secretfile:
+        return secretfile.readline().rstrip('\n')
+
+
+def create_app(frc, webhook_secret=None, live_updates_port=None, match_store=None,
+               snapshots=None):
+    """ Create the website for frc (an FRC that has been set up).
+    Args:
+        frc: The FRC to show, or None if pages are served from snapshots
+        (webhooks then aren't accepted).
+        webhook_secret: The secret TBA signs webhook messages with. If given,
+        webhook messages without a valid signature are rejected.
+        live_updates_port: The port of the util.live_updates.LiveUpdateServer
+        streaming frc.live_updates, if there is one. Event pages connect to it
+        to update without reloading.
+        match_store: A util.sqlite_store.SQLiteDataStore to look up teams'
+        matches in, if there is one.
+        snapshots: A util.snapshots.SnapshotReader to read the events from,
+        rather than frc.
+    """
+    app = Flask(__name__)
+    # requests only ever read immutable snapshots, so they never wait on the
+    # threads updating events
+    current_snapshot = snapshots.current if snapshots is not None else frc.current_snapshot
+
+    def snapshot():
+        """ The snapshot to answer this request from. """
+        current = current_snapshot()
+        if current is None:
+            # nothing has been published yet
+            abort(503)
+        return current
+
+    # pages are only rendered again when the events they show change
+    app.response_cache = ResponseCache()
+
+    def cached_response(key, version, render, mimetype='text/html'):
+        """ The response for page key, from the cache if it was rendered at
+        version, else from render(). Clients that already have it (their
+        If-None-Match has its ETag) get a 304. """
+        cached = app.response_cache.get(key, version)
+        if cached is None:
+            cached = app.response_cache.put(key, version, render(), mimetype)
+        if request.accept_encodings['gzip']:
+            body, etag, encoding = cached.gzipped, cached.gzip_etag, 'gzip'
+        else:
+            body, etag, encoding = cached.body, cached.etag, None
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=cached.mimetype)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # the data changes during events, so always check the ETag is current
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def render_index(current):
+        events = []
+        past_events = []
+        for event_code in current.event_codes:
+            event = current.event(event_code)
+            if event['upcoming_matches']:
+                events.append(event)
+            else:
+                past_events.append(event)
+        return render_template('index.html', events=events, past_events=past_events)
+
+    @app.route('/')
+    def index():
+        current = snapshot()
+        return cached_response('index', current.events_version, lambda: render_index(current))
+
+    @app.route('/event/<string:event_code>')
+    def event(event_code):
+        current = snapshot()
+        if not current.has_event(event_code):
+            abort(404)
+        return cached_response(('event', event_code), current.event_version(event_code),
+                               lambda: render_template('event.html',
+                                                       event=current.event(event_code),
+                                                       live_updates_port=live_updates_port))
+
+    @app.route('/api/event/<string:event_code>')
+    def event_json(event_code):
+        current = snapshot()
+        if not current.has_event(event_code):
+            abort(404)
+        return cached_response(('event_json', event_code), current.event_version(event_code),
+                               lambda: json.dumps(current.event(event_code)),
+                               mimetype='application/json')
+
+    @app.route('/team/<int:team>')
+    def team(team):
+        # TODO: actually make team page
+        if match_store is None:
+            return str(team)
+        return jsonify({'team': team,
+                        'events': {year: match_store.team_events(team, year)
+                                   for year in match_store.team_years(team)}})
+
+    @app.route('/tba-webhook', methods=['POST'])
+    def tba_webhook():
+        if frc is None:
+            # webhooks go to the ingestion process
+            abort(404)
+        if webhook_secret is not None:
+            expected = hmac.new(webhook_secret.encode(), request.get_data(),
+                                hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(expected, request.headers.get('X-TBA-HMAC', '')):
+                abort(401)
+        msg_data = request.json['message_data']
+        msg_type = request.json['message_type']
+        if msg_type == 'verification':
+            print('TBA verification key: %s' % msg_data)
+        else:
+            frc.handle_webhook(msg_type, msg_data)
+        return ''
+
+    return app
@@ -0,0 +1,17 @@
+"""A web worker, serving pages from the snapshots published by ingest.py.
+Workers hold no state of their own, so run as many as there are cores, eg
+`gunicorn --workers 8 web_worker:app`."""
+
+from ingest import SNAPSHOT_DIRECTORY
+from util.snapshots import SnapshotReader
+from util.sqlite_store import SQLiteDataStore
+from web import create_app
+import os
+
+# index of every team's matches, built with `python -m util.sqlite_store`
+match_store = None
+if os.path.exists('cache/' + SQLiteDataStore.DATABASE_FILE):
+    match_store = SQLiteDataStore('cache/' + SQLiteDataStore.DATABASE_FILE)
+
+app = create_app(None, live_updates_port=5001, match_store=match_store,
+                 snapshots=SnapshotReader(SNAPSHOT_DIRECTORY))